@@ -5,11 +5,22 @@
 #
 # Distributed under the terms of the MIT license.
 #
+import codecs
+import importlib
+import itertools
+import os
 import sys
+import threading
+import time
 import types
 
-from vlermv import cache
-import anyhttp.serializers as serializers
+from anyhttp import compression, events
+from anyhttp.caches import DirectoryCache, PackCache, write_file
+# re-exported for anyhttp.memory_cache = anyhttp.MemoryCache(...)
+from anyhttp.caches import MemoryCache  # noqa
+from anyhttp.curlmulti import CurlMulti, parse_header_lines
+from anyhttp.pool import ConnectionPool
+from anyhttp.workers import SingleFlight, imap as workers_imap
 
 from io import BytesIO
 from warnings import warn
@@ -32,50 +43,309 @@ available_http_packages = None
 http = None
 verbose = False
 
+# If True, choose_package() returns a ThreadLocalHttp, so that threads
+# sharing anyhttp.http each use their own handler instance.
+thread_safe = False
+
+# Optional MemoryCache in front of cache directories
+memory_cache = None
+
+# Size of the chunks yielded by iter_binary()
+default_chunk_size = 64 * 1024
+
+# Charset of text responses whose Content-Type has none
+default_charset = 'utf-8'
+
+# Accept-Encoding sent by clients which anyhttp decompresses, or None
+accept_encoding = compression.accept_encoding
+
+# If True, compressed binary responses are stored in caches as received,
+# and decompressed when loaded.
+store_encoded = False
+
+# If True, binary responses are fetched into caches in byte ranges, as
+# with workers = 1, so that interrupted downloads are resumed.
+resumable = False
+
+
+def _debug(message, *args):
+    """Print message if verbose, and emit it as a debug event."""
+    if args:
+        message = message % args
+    if verbose:
+        print(message)
+    if events.active:
+        events.emit('debug', message=message)
+
+
+def _handler_name(http):
+    return getattr(http, 'prototype', http).__class__.__name__
+
+
+def _lower_headers(headers):
+    """Return a dict of headers with lower case names."""
+    if hasattr(headers, 'items'):
+        headers = headers.items()
+    result = {}
+    for (name, value) in headers:
+        if isinstance(name, bytes):
+            name = name.decode('latin1')
+        if isinstance(value, bytes):
+            value = value.decode('latin1')
+        result[name.lower()] = value
+    return result
+
+
+def charset_of(content_type):
+    """
+    Return the charset parameter of a Content-Type header value.
+
+    Returns None if there is none, or if Python has no codec for it.
+    """
+    if not content_type:
+        return None
+    for param in content_type.split(';')[1:]:
+        (name, sep, value) = param.partition('=')
+        if name.strip().lower() == 'charset':
+            charset = value.strip().strip('"\'')
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                return None
+    return None
+
+
+def iter_decode(chunks, charset=None):
+    """
+    Decode an iterable of bytes chunks, yielding text.
+
+    Characters split between chunks are decoded once complete, so only
+    one chunk is held as bytes and as text at a time.
+    """
+    decoder = codecs.getincrementaldecoder(charset or default_charset)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', True)
+    if text:
+        yield text
+
+
+def _accept_encoding(headers):
+    """Return request headers, with Accept-Encoding unless it is set."""
+    headers = dict(headers or {})
+    if accept_encoding and not any(name.lower() == 'accept-encoding'
+                                   for name in headers):
+        headers['Accept-Encoding'] = accept_encoding
+    return headers
+
+
+def _decoded(response):
+    """Decompress the body of a Response from request_encoded()."""
+    if response.content_encoding:
+        response.body = compression.decode_content(response.body,
+                                                   response.content_encoding)
+        response.content_encoding = None
+    return response
+
+
+class Response(object):
+
+    """
+    Status, headers and body of a response.
+
+    headers is a dict with lower case names.  status is None if the
+    client does not expose it; such clients also ignore request headers.
+    content_encoding is the content coding the body is still compressed
+    with, or None.
+    """
+
+    def __init__(self, status, headers, body, content_encoding=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.content_encoding = content_encoding
+
+    @property
+    def charset(self):
+        """Charset of the Content-Type header, or None."""
+        return charset_of(self.headers.get('content-type'))
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.status)
+
+
+class StatusError(IOError):
+
+    """A response with an error status, which is not cached."""
+
+    def __init__(self, url, status):
+        super(StatusError, self).__init__('HTTP status %s for %s'
+                                          % (status, url))
+        self.url = url
+        self.status = status
+
 
 class Http(object):
 
     """Base class to wrap HTTP client implementations."""
 
+    # concurrent.futures executor used by araw(); None for the loop default
+    executor = None
+
     def __init__(self, package):
         self.package = package
+        self._local = threading.local()
 
     def raw(self, url):
         raise NotImplementedError('%s raw() not defined' % self.package)
 
+    def araw(self, url):
+        """
+        Return an awaitable resolving to raw(url).
+
+        Clients without asyncio support are run in an executor thread,
+        each thread using its own clone().
+        Subclasses wrapping asyncio clients override this with a coroutine.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, self._thread_raw, url)
+
+    def araw_text(self, url):
+        """
+        Return an awaitable resolving to raw_text(url).
+
+        Like araw(); subclasses wrapping asyncio clients override this.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, self._thread_raw_text,
+                                    url)
+
+    def _thread_http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = self.clone()
+        return http
+
+    def _thread_raw(self, url):
+        return self._thread_http().raw(url)
+
+    def _thread_raw_text(self, url):
+        return self._thread_http().raw_text(url)
+
+    def request(self, url, headers=None):
+        """
+        Send a GET request with headers; return a Response.
+
+        Subclasses override this where the client exposes headers and
+        status; the default ignores headers, and the status is unknown.
+        """
+        return Response(None, {}, self.raw(url))
+
+    def request_encoded(self, url, headers=None):
+        """
+        Send a GET request accepting a compressed body; return a Response.
+
+        Subclasses override this where the client can leave the body
+        compressed, setting content_encoding; the default is request().
+        """
+        return self.request(url, headers)
+
+    def head(self, url, headers=None):
+        """
+        Send a HEAD request with headers; return a Response without body.
+
+        Subclasses override this where the client can send one; the
+        default returns None.
+        """
+        return None
+
     def get_text(self, url):
-        raw = self.raw(url)
-        if verbose:
+        (raw, charset) = self.raw_text(url)
+        return self._text(raw, charset)
+
+    def raw_text(self, url):
+        """
+        Return the body and the charset of its Content-Type, or None.
+
+        Subclasses which can read the response headers override this.
+        """
+        return (self.raw(url), None)
+
+    def iter_text(self, url, chunk_size=None, charset=None):
+        """
+        Yield the body decoded in chunks.
+
+        The charset of the Content-Type is used where the client exposes
+        it while streaming; otherwise charset, or default_charset.
+        """
+        if self.__class__.iter_raw is Http.iter_raw:
+            # the body is not streamed, so it is decoded in one chunk
+            (raw, content_charset) = self.raw_text(url)
+            return iter([self._text(raw, content_charset or charset)])
+        return iter_decode(self.iter_raw(url, chunk_size), charset)
+
+    def _text(self, raw, charset=None):
+        debug = verbose or events.active
+        if isinstance(raw, (bytes, bytearray, memoryview)):
+            # decode directly from the buffer, without an intermediate copy
+            if debug:
+                _debug('%s.raw: type: %s, charset: %s',
+                       self.__class__.__name__, type(raw), charset)
+            return unicode(raw, charset or default_charset)
+
+        if debug:
             if isinstance(raw, (bytes, str, unicode)):
-                print('%s.raw: type: %s'
-                      % (self.__class__.__name__, type(raw)))
+                _debug('%s.raw: type: %s', self.__class__.__name__, type(raw))
             else:
-                print('%s.raw: type: %s : %r'
-                      % (self.__class__.__name__, type(raw), raw))
+                _debug('%s.raw: type: %s : %r',
+                       self.__class__.__name__, type(raw), raw)
 
         if not isinstance(raw, (bytes, str, unicode)):
-            if verbose:
-                if hasattr(raw, '__dict__'):
-                    print('%s.raw __dict__: %s'
-                          % (self.__class__.__name__, raw.__dict__))
+            if debug and hasattr(raw, '__dict__'):
+                _debug('%s.raw __dict__: %s',
+                       self.__class__.__name__, raw.__dict__)
             out = unicode(raw)
-            if verbose:
-                if out == repr(raw) and verbose:
-                    print('%s.get resulted in repr: %s'
-                          % (self.__class__.__name__, out))
+            if debug and out == repr(raw):
+                _debug('%s.get resulted in repr: %s',
+                       self.__class__.__name__, out)
         else:
             out = raw
 
         if isinstance(out, bytes):
-            out = raw.decode('utf8')
+            out = out.decode(charset or default_charset)
 
-        if verbose:
-            print('%s.get: type: %r' % (self.__class__.__name__, type(out)))
+        if debug:
+            _debug('%s.get: type: %r', self.__class__.__name__, type(out))
         return out
 
     def get_binary(self, url):
         return self.raw(url)
 
+    def iter_raw(self, url, chunk_size=None):
+        """
+        Yield the body in chunks.
+
+        Subclasses which can stream the body override this; the default
+        yields the whole body as one chunk.
+        """
+        yield self.raw(url)
+
+    def write_raw(self, url, fp, chunk_size=None):
+        """Write the body to the file object fp; return its length."""
+        length = 0
+        for chunk in self.iter_raw(url, chunk_size):
+            fp.write(chunk)
+            length += len(chunk)
+        return length
+
+    def clone(self):
+        """Return a new instance for use by another thread."""
+        return self.__class__(self.package)
+
     @classmethod
     def _extract_raw(cls, value):
         return value
@@ -83,10 +353,40 @@ class Http(object):
 
 class PackageGet(Http):
 
-    """Use get function from the package."""
+    """
+    Use get function from the package.
+
+    If the package provides a session class with a get method, such as
+    requests.Session, one session is kept per instance so that
+    connections are re-used.  The package get function is the fallback.
+    """
+
+    session_cls = ('Session', )
+
+    def __init__(self, package):
+        super(PackageGet, self).__init__(package)
+        self.session = self.new_session()
+
+    def new_session(self):
+        for name in self.session_cls:
+            cls = getattr(self.package, name, None)
+            if not callable(cls):
+                continue
+            try:
+                session = cls()
+            except Exception:
+                continue
+            if callable(getattr(session, 'get', None)):
+                if verbose or events.active:
+                    _debug('%s: using %s.%s', self.__class__.__name__,
+                           self.package.__name__, name)
+                return session
 
     def raw(self, url):
-        result = self.package.get(url)
+        if self.session is not None:
+            result = self.session.get(url)
+        else:
+            result = self.package.get(url)
         return self._extract_raw(result)
 
 
@@ -111,11 +411,128 @@ class addinfourl(Http):
 
 class urlopen(addinfourl, Http):
 
-    """Use urlopen to fetch the resource."""
+    """
+    Use urlopen to fetch the resource.
+
+    urllib does not decompress bodies, so they are decompressed here.
+    """
+
+    def _open(self, url, headers=None):
+        # urllib.request; urlgrabber has no Request class
+        if not hasattr(self.package, 'Request'):
+            return self.package.urlopen(url)
+        request = self.package.Request(url, headers=_accept_encoding(headers))
+        return self.package.urlopen(request)
+
+    @staticmethod
+    def _headers(result):
+        info = result.info() if hasattr(result, 'info') else None
+        return _lower_headers(info) if info else {}
 
     def raw(self, url):
-        result = self.package.urlopen(url)
-        return self._extract_raw(result)
+        return self.raw_text(url)[0]
+
+    def raw_text(self, url):
+        result = self._open(url)
+        try:
+            headers = self._headers(result)
+            body = compression.decode_content(
+                result.read(), compression.content_coding(headers))
+            return (body, charset_of(headers.get('content-type')))
+        finally:
+            result.close()
+
+    def request(self, url, headers=None):
+        return _decoded(self.request_encoded(url, headers))
+
+    def request_encoded(self, url, headers=None):
+        if not hasattr(self.package, 'Request'):
+            return super(urlopen, self).request(url, headers)
+        try:
+            result = self._open(url, headers)
+        except self.package.HTTPError as e:
+            # raised for all responses other than 2xx, including 304
+            result = e
+        try:
+            headers = self._headers(result)
+            return Response(result.getcode(), headers, result.read(),
+                            compression.content_coding(headers))
+        finally:
+            result.close()
+
+    def head(self, url, headers=None):
+        if not hasattr(self.package, 'Request'):
+            return super(urlopen, self).head(url, headers)
+        request = self.package.Request(url, headers=headers or {})
+        # Request only has a method argument in Python 3
+        request.get_method = lambda: 'HEAD'
+        try:
+            result = self.package.urlopen(request)
+        except self.package.HTTPError as e:
+            result = e
+        try:
+            return Response(result.getcode(), self._headers(result), b'')
+        finally:
+            result.close()
+
+    def iter_raw(self, url, chunk_size=None):
+        result = self._open(url)
+        try:
+            for chunk in compression.iter_decode_content(
+                    self._iter_read(result, chunk_size),
+                    compression.content_coding(self._headers(result))):
+                yield chunk
+        finally:
+            result.close()
+
+    @staticmethod
+    def _iter_read(result, chunk_size):
+        while True:
+            chunk = result.read(chunk_size or default_chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def write_raw(self, url, fp, chunk_size=None):
+        result = self._open(url)
+        try:
+            coding = compression.content_coding(self._headers(result))
+            if coding:
+                writer = compression.DecodingWriter(fp, coding)
+                for chunk in self._iter_read(result, chunk_size):
+                    writer.write(chunk)
+                writer.finish()
+                return writer.length
+            if not hasattr(result, 'readinto'):
+                return super(urlopen, self).write_raw(url, fp, chunk_size)
+            return _copy_readinto(result.readinto, fp, chunk_size)
+        finally:
+            result.close()
+
+
+class _CountingWriter(object):
+
+    """File object which counts the bytes written to fp."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.length = 0
+
+    def write(self, data):
+        self.fp.write(data)
+        self.length += len(data)
+
+
+def _copy_readinto(readinto, fp, chunk_size=None):
+    """Copy using readinto() and one buffer; return the length copied."""
+    buf = memoryview(bytearray(chunk_size or default_chunk_size))
+    length = 0
+    while True:
+        size = readinto(buf)
+        if not size:
+            return length
+        fp.write(buf[:size])
+        length += size
 
 
 class ClassHttp(Http):
@@ -132,32 +549,165 @@ class ClassHttp(Http):
 
 class SingleSiteClass(ClassHttp):
 
-    """Base class to wrap a client class instance per site."""
+    """
+    Base class to wrap a client class instance per site.
+
+    Client instances are kept in a ConnectionPool keyed by site, so
+    repeated requests to one site re-use a keep-alive connection.
+    Subclasses which can re-use the instance implement fetch();
+    a request which fails on a re-used connection is retried once
+    on a new connection.
+    """
+
+    pooled = True
 
     def __init__(self, package):
-        self._url = None
         super(SingleSiteClass, self).__init__(package)
+        self.pool = ConnectionPool() if self.pooled else None
 
     def cls_init(self, url):
-        self._url = None
-        if verbose:
-            print('%s.cls_init(%s)' % (self.__class__.__name__, url))
+        if verbose or events.active:
+            _debug('%s.cls_init(%s)', self.__class__.__name__, url)
         self.http = self.cls(url)
 
     def get_baseurl(self, url):
-        if not self._url:
-            self._url = urlparse(url)
-        return self._url.scheme + '://' + self._url.netloc
+        url = urlparse(url)
+        return url.scheme + '://' + url.netloc
 
     def get_host_port(self, url):
-        if not self._url:
-            self._url = urlparse(url)
-        return (self._url.netloc, self._url.port)
+        url = urlparse(url)
+        return (url.hostname, url.port)
 
     def get_path(self, url):
-        if not self._url:
-            self._url = urlparse(url)
-        return self._url.path
+        return urlparse(url).path
+
+    def clone(self):
+        http = super(SingleSiteClass, self).clone()
+        http.pool = self.pool
+        return http
+
+    def get_pool_key(self, url):
+        url = urlparse(url)
+        return (url.scheme, url.hostname, url.port)
+
+    def connect(self, url):
+        """Set http to a pooled or new client instance; return if re-used."""
+        http = None
+        if self.pool is not None:
+            http = self.pool.acquire(self.get_pool_key(url))
+        if http is None:
+            self.cls_init(url)
+            return False
+        self.http = http
+        return True
+
+    def release(self, url):
+        """Return the client instance to the pool."""
+        if self.pool is not None:
+            self.pool.release(self.get_pool_key(url), self.http)
+        self.http = None
+
+    def fetch(self, url):
+        raise NotImplementedError('%s fetch() not defined' % self.package)
+
+    def iter_fetch(self, http, url, chunk_size):
+        """
+        Yield the body in chunks using the client instance http.
+
+        Subclasses which can stream the body set this to a generator.
+        """
+        raise NotImplementedError
+
+    def _discard(self, http):
+        if self.pool is not None:
+            self.pool.discard(http)
+
+    def fetch_request(self, url, headers):
+        """
+        Return a Response using the client instance in http.
+
+        Subclasses which expose headers and status implement this.
+        """
+        raise NotImplementedError
+
+    def fetch_encoded(self, url, headers):
+        """
+        Return a Response using http, leaving the body compressed.
+
+        Subclasses which decompress bodies themselves implement this.
+        """
+        raise NotImplementedError
+
+    def request(self, url, headers=None):
+        if self.__class__.fetch_request is SingleSiteClass.fetch_request:
+            return super(SingleSiteClass, self).request(url, headers)
+        return self._pooled(url, lambda url: self.fetch_request(url, headers))
+
+    def request_encoded(self, url, headers=None):
+        if self.__class__.fetch_encoded is SingleSiteClass.fetch_encoded:
+            return self.request(url, headers)
+        return self._pooled(url, lambda url: self.fetch_encoded(url, headers))
+
+    def raw(self, url):
+        return self._pooled(url, self.fetch)
+
+    def raw_text(self, url):
+        if self.__class__.fetch_request is SingleSiteClass.fetch_request:
+            return super(SingleSiteClass, self).raw_text(url)
+        response = self.request(url)
+        return (response.body, response.charset)
+
+    def _pooled(self, url, fetch):
+        reused = self.connect(url)
+        while True:
+            try:
+                result = fetch(url)
+            except Exception:
+                if self.pool is not None:
+                    self.pool.discard(self.http)
+                if not reused:
+                    raise
+                if verbose or events.active:
+                    _debug('%s: re-used connection failed; reconnecting',
+                           self.__class__.__name__)
+                self.cls_init(url)
+                reused = False
+            else:
+                self.release(url)
+                return result
+
+    def iter_raw(self, url, chunk_size=None):
+        if self.__class__.iter_fetch is SingleSiteClass.iter_fetch:
+            for chunk in super(SingleSiteClass, self).iter_raw(url):
+                yield chunk
+            return
+
+        chunk_size = chunk_size or default_chunk_size
+        reused = self.connect(url)
+        # keep the connection local; other requests may use self.http
+        # while this generator is suspended.
+        http, self.http = self.http, None
+        started = False
+        while True:
+            try:
+                for chunk in self.iter_fetch(http, url, chunk_size):
+                    started = True
+                    yield chunk
+            except GeneratorExit:
+                # the rest of the body has not been read
+                self._discard(http)
+                raise
+            except Exception:
+                self._discard(http)
+                if started or not reused:
+                    raise
+                self.cls_init(url)
+                http, self.http = self.http, None
+                reused = False
+            else:
+                if self.pool is not None:
+                    self.pool.release(self.get_pool_key(url), http)
+                return
 
 
 class BaseurlSiteClass(SingleSiteClass):
@@ -174,7 +724,6 @@ class HostPortConnectionClass(SingleSiteClass):
     """Base class to wrap a client class initialised with a host and port."""
 
     def cls_init(self, url):
-        self._url = None
         (host, port) = self.get_host_port(url)
         self.http = self.cls(host, port)
 
@@ -202,6 +751,21 @@ class httplib2(MultiuseClass):
         result = self.http.request(url, method='GET')
         return self._extract_raw(result)
 
+    def request(self, url, headers=None):
+        result = self.http.request(url, method='GET', headers=headers)
+        return Response(int(result[0].status), _lower_headers(result[0]),
+                        self._extract_raw(result))
+
+    def head(self, url, headers=None):
+        result = self.http.request(url, method='HEAD', headers=headers)
+        return Response(int(result[0].status), _lower_headers(result[0]),
+                        b'')
+
+    def raw_text(self, url):
+        result = self.http.request(url, method='GET')
+        return (self._extract_raw(result),
+                charset_of(result[0].get('content-type')))
+
 
 class urllib3(MultiuseClass):
 
@@ -209,8 +773,97 @@ class urllib3(MultiuseClass):
 
     cls = 'PoolManager'
 
+    def clone(self):
+        # PoolManager is thread-safe
+        http = super(urllib3, self).clone()
+        http.http = self.http
+        return http
+
+    # urllib3 decompresses bodies, but does not ask for them compressed
+
+    def _request(self, url, headers=None, **kwargs):
+        return self.http.request(method='GET', url=url,
+                                 headers=_accept_encoding(headers), **kwargs)
+
     def raw(self, url):
-        return self.http.request(method='GET', url=url).data
+        return self._request(url).data
+
+    def raw_text(self, url):
+        result = self._request(url)
+        return (result.data, charset_of(result.headers.get('content-type')))
+
+    def request(self, url, headers=None):
+        result = self._request(url, headers)
+        return Response(result.status, _lower_headers(result.headers),
+                        result.data)
+
+    def request_encoded(self, url, headers=None):
+        result = self._request(url, headers, decode_content=False)
+        headers = _lower_headers(result.headers)
+        return Response(result.status, headers, result.data,
+                        compression.content_coding(headers))
+
+    def head(self, url, headers=None):
+        result = self.http.request(method='HEAD', url=url, headers=headers)
+        return Response(result.status, _lower_headers(result.headers), b'')
+
+    def iter_raw(self, url, chunk_size=None):
+        result = self._request(url, preload_content=False)
+        try:
+            for chunk in result.stream(chunk_size or default_chunk_size):
+                yield chunk
+        finally:
+            result.release_conn()
+
+    def iter_text(self, url, chunk_size=None, charset=None):
+        result = self._request(url, preload_content=False)
+        try:
+            charset = (charset_of(result.headers.get('content-type')) or
+                       charset)
+            chunks = result.stream(chunk_size or default_chunk_size)
+            for text in iter_decode(chunks, charset):
+                yield text
+        finally:
+            result.release_conn()
+
+    def write_raw(self, url, fp, chunk_size=None):
+        result = self._request(url, preload_content=False)
+        try:
+            return _copy_readinto(result.readinto, fp, chunk_size)
+        finally:
+            result.release_conn()
+
+
+class _Engines(object):
+
+    """
+    Idle batch engines, such as CurlMulti, re-used by imap_request().
+
+    Each imap() checks out an engine of its own, so batches may run in
+    several threads or be interleaved in one, and returns it, with its
+    connections, once the batch is complete or closed.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def imap(self, *args, **kwargs):
+        """Return engine.imap(*args, **kwargs) of a checked out engine."""
+        with self._lock:
+            engine = self._idle.pop() if self._idle else self.factory()
+        return self._imap(engine, engine.imap(*args, **kwargs))
+
+    def _imap(self, engine, results):
+        try:
+            for result in results:
+                yield result
+        finally:
+            # abort the transfers of an unfinished batch first
+            results.close()
+            with self._lock:
+                self._idle.append(engine)
 
 
 class pycurl(MultiuseClass):
@@ -219,6 +872,56 @@ class pycurl(MultiuseClass):
 
     cls = 'Curl'
 
+    # CurlMulti options used by get_many()
+    multi_handles = 16
+    max_host_connections = 6
+
+    def __init__(self, package):
+        super(pycurl, self).__init__(package)
+        self.share = None
+        self._share_lock = threading.Lock()
+        self._multis = _Engines(self.new_multi)
+        if accept_encoding:
+            # libcurl sends Accept-Encoding and decompresses bodies
+            self.http.setopt(package.ENCODING, accept_encoding)
+
+    def new_multi(self):
+        """Return a CurlMulti engine with the options of this class."""
+        return CurlMulti(self.package, handles=self.multi_handles,
+                         max_host_connections=self.max_host_connections)
+
+    def imap_request(self, func, urls, ordered=True, lookup=None,
+                     limit=None, headers=None, encoded=False):
+        """
+        Fetch urls concurrently on this thread; see CurlMulti.imap.
+
+        Each call uses a CurlMulti of its own.
+        """
+        return self._multis.imap(func, urls, ordered=ordered, lookup=lookup,
+                                 limit=limit, headers=headers,
+                                 encoded=encoded and bool(accept_encoding))
+
+    def clone(self):
+        """
+        Return an instance with its own Curl handle.
+
+        A Curl handle must not be used by two threads at once; clones
+        share the DNS cache and TLS sessions through a CurlShare instead.
+        """
+        package = self.package
+        # the first clones may be made by several threads at once
+        with self._share_lock:
+            if self.share is None:
+                share = package.CurlShare()
+                share.setopt(package.SH_SHARE, package.LOCK_DATA_DNS)
+                share.setopt(package.SH_SHARE, package.LOCK_DATA_SSL_SESSION)
+                self.http.setopt(package.SHARE, share)
+                self.share = share
+        http = super(pycurl, self).clone()
+        http.share = self.share
+        http.http.setopt(package.SHARE, self.share)
+        return http
+
     def raw(self, url):
         import pycurl  # noqa
         instance = self.http
@@ -226,8 +929,118 @@ class pycurl(MultiuseClass):
         result = BytesIO()
         instance.setopt(pycurl.WRITEDATA, result)
         instance.perform()
+        self._first_byte(url)
         return result.getvalue()
 
+    def raw_text(self, url):
+        body = self.raw(url)
+        return (body, charset_of(self.http.getinfo(self.package.CONTENT_TYPE)))
+
+    def _first_byte(self, url):
+        if events.active:
+            events.emit('first_byte', url=url, handler='pycurl',
+                        elapsed=self.http.getinfo(
+                            self.package.STARTTRANSFER_TIME))
+
+    def request(self, url, headers=None):
+        import pycurl  # noqa
+        instance = self.http
+        instance.setopt(pycurl.URL, url)
+        result = BytesIO()
+        instance.setopt(pycurl.WRITEDATA, result)
+        lines = []
+        instance.setopt(pycurl.HEADERFUNCTION, lines.append)
+        if headers:
+            instance.setopt(pycurl.HTTPHEADER,
+                            ['%s: %s' % item for item in headers.items()])
+        try:
+            instance.perform()
+        finally:
+            instance.unsetopt(pycurl.HEADERFUNCTION)
+            if headers:
+                instance.unsetopt(pycurl.HTTPHEADER)
+        self._first_byte(url)
+
+        return Response(instance.getinfo(pycurl.RESPONSE_CODE),
+                        parse_header_lines(lines), result.getvalue())
+
+    def request_encoded(self, url, headers=None):
+        if not accept_encoding:
+            return self.request(url, headers)
+        # without ENCODING, libcurl leaves the body compressed
+        instance = self.http
+        instance.setopt(self.package.ENCODING, None)
+        try:
+            response = self.request(url, _accept_encoding(headers))
+        finally:
+            instance.setopt(self.package.ENCODING, accept_encoding)
+        response.content_encoding = compression.content_coding(
+            response.headers)
+        return response
+
+    def head(self, url, headers=None):
+        instance = self.http
+        instance.setopt(self.package.NOBODY, True)
+        try:
+            return self.request(url, headers)
+        finally:
+            instance.setopt(self.package.NOBODY, False)
+            instance.setopt(self.package.HTTPGET, True)
+
+    def iter_raw(self, url, chunk_size=None):
+        import pycurl  # noqa
+        instance = self.http
+        chunks = []
+        instance.setopt(pycurl.URL, url)
+        instance.setopt(pycurl.WRITEFUNCTION, chunks.append)
+        if chunk_size:
+            instance.setopt(pycurl.BUFFERSIZE, chunk_size)
+        # drive the transfer with the multi interface, so the generator
+        # can yield between reads without a thread.
+        multi = pycurl.CurlMulti()
+        multi.add_handle(instance)
+        try:
+            active = 1
+            while active:
+                while True:
+                    (ret, active) = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                for chunk in chunks:
+                    yield chunk
+                del chunks[:]
+                if active:
+                    multi.select(1.0)
+            (queued, ok, failed) = multi.info_read()
+            for (handle, errno, errmsg) in failed:
+                raise pycurl.error(errno, errmsg)
+        finally:
+            multi.remove_handle(instance)
+            if chunk_size:
+                # libcurl default, CURL_MAX_WRITE_SIZE
+                instance.setopt(pycurl.BUFFERSIZE, 16384)
+
+    def iter_text(self, url, chunk_size=None, charset=None):
+        chunks = self.iter_raw(url, chunk_size)
+        for chunk in chunks:
+            # the headers have been received with the first chunk
+            charset = (charset_of(self.http.getinfo(
+                self.package.CONTENT_TYPE)) or charset)
+            for text in iter_decode(itertools.chain([chunk], chunks),
+                                    charset):
+                yield text
+            return
+
+    def write_raw(self, url, fp, chunk_size=None):
+        import pycurl  # noqa
+        instance = self.http
+        instance.setopt(pycurl.URL, url)
+        # SIZE_DOWNLOAD is the length before decompression
+        fp = _CountingWriter(fp)
+        instance.setopt(pycurl.WRITEFUNCTION, fp.write)
+        instance.perform()
+        return fp.length
+
 
 class fido(Http):
 
@@ -245,6 +1058,7 @@ class async_http(SingleSiteClass):
     """Wrapper for async_http."""
 
     cls = 'AsyncHTTPRequest'
+    pooled = False
 
     def raw(self, url):
         self.cls_init(url)
@@ -258,9 +1072,9 @@ class webob(SingleSiteClass):
     """Wrapper for async_http."""
 
     cls = 'BaseRequest'
+    pooled = False
 
     def cls_init(self, url):
-        self._url = None
         self.http = self.cls.blank(path=url)
 
     def raw(self, url):
@@ -305,6 +1119,15 @@ class tornado(MultiuseClass):
         result = self.http.fetch(url)
         return result.body
 
+    def raw_text(self, url):
+        result = self.http.fetch(url)
+        return (result.body, charset_of(result.headers.get('Content-Type')))
+
+    def request(self, url, headers=None):
+        result = self.http.fetch(url, headers=headers, raise_error=False)
+        return Response(result.code, _lower_headers(result.headers.get_all()),
+                        result.body)
+
 
 class ultralite(MultiuseClass):
 
@@ -324,12 +1147,13 @@ class basic_http(SingleSiteClass):
     cls = 'BasicHttp'
 
     def cls_init(self, url):
-        self._url = None
         self.http = self.cls(url)
 
-    def raw(self, url):
-        self.cls_init(url)
+    def get_pool_key(self, url):
+        # BasicHttp instances are bound to one url
+        return url
 
+    def fetch(self, url):
         result = self.http.GET()
         return result['body']
 
@@ -348,12 +1172,9 @@ class tinydav(SingleSiteClass):
     cls = 'HTTPClient'
 
     def cls_init(self, url):
-        self._url = None
         self.http = self.cls.fromurl(url)
 
-    def raw(self, url):
-        self.cls_init(url)
-
+    def fetch(self, url):
         path = self.get_path(url)
         result = self.http.get(path)
         return result.content
@@ -372,35 +1193,104 @@ class pylhttp(MultiuseClass):
 
 class hyper(HostPortConnectionClass):
 
-    """Wrapper for hyper."""
+    """
+    Wrapper for hyper, which decompresses bodies.
+
+    If multiplex is True, get_many() multiplexes requests on HTTP/2
+    connections; see HTTP2Batch.  Requests to servers without HTTP/2
+    are then made one after another, so by default get_many() uses
+    worker threads.
+    """
 
     cls = 'HTTP11Connection'
 
-    def raw(self, url):
-        self.cls_init(url)
+    # HTTP2Batch options used by get_many()
+    multiplex = False
+    max_streams = 100
 
+    def __init__(self, package):
+        super(hyper, self).__init__(package)
+        self._batches = _Engines(self.new_batch)
+
+    def new_batch(self):
+        """Return an HTTP2Batch with the options of this class."""
+        from anyhttp.http2 import HTTP2Batch
+        return HTTP2Batch(self.package, max_streams=self.max_streams)
+
+    def imap_request(self, func, urls, ordered=True, lookup=None,
+                     limit=None, headers=None, encoded=False):
+        """
+        Fetch urls multiplexed per origin; see HTTP2Batch.imap.
+
+        Each call uses an HTTP2Batch of its own.
+        """
+        return self._batches.imap(func, urls, ordered=ordered,
+                                  lookup=lookup, limit=limit,
+                                  headers=headers, encoded=encoded)
+
+    def fetch(self, url):
         path = self.get_path(url)
-        result = self.http.request(method='GET', url=path)
+        self.http.request(method='GET', url=path,
+                          headers=_accept_encoding(None))
         result = self.http.get_response()
         return result.read()
 
+    def fetch_request(self, url, headers):
+        path = self.get_path(url)
+        self.http.request(method='GET', url=path,
+                          headers=_accept_encoding(headers))
+        result = self.http.get_response()
+        return Response(result.status, _lower_headers(result.headers.items()),
+                        result.read())
+
+    def iter_fetch(self, http, url, chunk_size):
+        path = self.get_path(url)
+        http.request(method='GET', url=path, headers=_accept_encoding(None))
+        result = http.get_response()
+        while True:
+            chunk = result.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
 
 class geventhttpclient(SingleSiteClass):
 
-    """Wrapper for geventhttpclient."""
+    """Wrapper for geventhttpclient, which does not decompress bodies."""
 
     cls = 'HTTPClient'
 
     def cls_init(self, url):
-        self._url = None
         self.http = self.cls.from_url(url)
 
-    def raw(self, url):
-        self.cls_init(url)
+    def fetch(self, url):
+        return self.fetch_request(url, None).body
+
+    def fetch_request(self, url, headers):
+        return _decoded(self.fetch_encoded(url, headers))
 
+    def fetch_encoded(self, url, headers):
         path = self.get_path(url)
-        result = self.http.get(path)
-        return result.read()
+        result = self.http.get(path, headers=_accept_encoding(headers))
+        headers = _lower_headers(result.headers)
+        return Response(result.status_code, headers, result.read(),
+                        compression.content_coding(headers))
+
+    def iter_fetch(self, http, url, chunk_size):
+        path = self.get_path(url)
+        result = http.get(path, headers=_accept_encoding(None))
+        coding = compression.content_coding(_lower_headers(result.headers))
+        for chunk in compression.iter_decode_content(
+                self._iter_read(result, chunk_size), coding):
+            yield chunk
+
+    @staticmethod
+    def _iter_read(result, chunk_size):
+        while True:
+            chunk = result.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
 
 
 class bolacha(httplib2):
@@ -433,8 +1323,7 @@ class httxlib(addinfourl, SingleSiteClass):
 
     cls = 'HttxConnection'
 
-    def raw(self, url):
-        self.cls_init(url)
+    def fetch(self, url):
         from httxlib import HttxRequest
         request = HttxRequest(url)
         response = self.http.request(request)
@@ -444,18 +1333,35 @@ class httxlib(addinfourl, SingleSiteClass):
 
 class dugong(HostPortConnectionClass):
 
-    """Wrapper for dugong."""
+    """Wrapper for dugong, which always asks for identity bodies."""
 
     cls = 'HTTPConnection'
 
-    def raw(self, url):
-        self.cls_init(url)
+    def fetch(self, url):
         path = self.get_path(url)
         self.http.send_request('GET', path)
         self.http.read_response()
         result = self.http.readall()
         return bytes(result)
 
+    def fetch_request(self, url, headers):
+        path = self.get_path(url)
+        self.http.send_request('GET', path, headers=headers)
+        result = self.http.read_response()
+        body = self.http.readall()
+        return Response(result.status, _lower_headers(result.headers),
+                        bytes(body))
+
+    def iter_fetch(self, http, url, chunk_size):
+        path = self.get_path(url)
+        http.send_request('GET', path)
+        http.read_response()
+        while True:
+            chunk = http.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
 
 # API wrappers
 
@@ -478,7 +1384,64 @@ class drest_request(MultiuseClass):
         return result.data
 
 
-requests = PackageGetContents
+class requests(PackageGetContents):
+
+    """Wrapper for requests."""
+
+    def _get(self, url, **kwargs):
+        if self.session is not None:
+            return self.session.get(url, **kwargs)
+        return self.package.get(url, **kwargs)
+
+    def request(self, url, headers=None):
+        result = self._get(url, headers=headers)
+        return Response(result.status_code, _lower_headers(result.headers),
+                        result.content)
+
+    def head(self, url, headers=None):
+        if self.session is not None:
+            result = self.session.head(url, headers=headers)
+        else:
+            result = self.package.head(url, headers=headers)
+        return Response(result.status_code, _lower_headers(result.headers),
+                        b'')
+
+    def request_encoded(self, url, headers=None):
+        result = self._get(url, headers=_accept_encoding(headers),
+                           stream=True)
+        try:
+            headers = _lower_headers(result.headers)
+            return Response(result.status_code, headers,
+                            result.raw.read(decode_content=False),
+                            compression.content_coding(headers))
+        finally:
+            result.close()
+
+    def raw_text(self, url):
+        # result.encoding defaults to ISO-8859-1 for text/* without a
+        # charset, so the header is parsed instead
+        result = self._get(url)
+        return (result.content, charset_of(result.headers.get('content-type')))
+
+    def iter_raw(self, url, chunk_size=None):
+        result = self._get(url, stream=True)
+        try:
+            for chunk in result.iter_content(chunk_size or
+                                             default_chunk_size):
+                yield chunk
+        finally:
+            result.close()
+
+    def iter_text(self, url, chunk_size=None, charset=None):
+        result = self._get(url, stream=True)
+        try:
+            charset = (charset_of(result.headers.get('content-type')) or
+                       charset)
+            chunks = result.iter_content(chunk_size or default_chunk_size)
+            for text in iter_decode(chunks, charset):
+                yield text
+        finally:
+            result.close()
 
 package_handlers = {
     'requests': requests,
@@ -486,23 +1449,23 @@ package_handlers = {
     'urllib3': urllib3,
     'pycurl': pycurl,
     'fido': fido,
-    'httq': requests,
+    'httq': PackageGetContents,
     'async_http': async_http,
     'webob': webob,
     'urlfetch': urlfetch,
-    'simplefetch': requests,
+    'simplefetch': PackageGetContents,
     'httputils': httputils,
     'tornado.httpclient': tornado,
     'ihttp': ihttp,
     'basic_http': basic_http,
     'unirest': urlfetch,
-    'httpstream': requests,
+    'httpstream': PackageGetContents,
     'http1': urlfetch,
     'reqres': reqres,
     'tinydav': tinydav,
     'ultralite': ultralite,
     'urlgrabber': urlopen,
-    'dogbutler': requests,
+    'dogbutler': PackageGetContents,
     'pylhttp': pylhttp,
     'hyper': hyper,
     'asynchttp': asynchttp,
@@ -514,10 +1477,57 @@ package_handlers = {
     'dugong': dugong,
 }
 
-if sys.version_info[0] > 2:
-    from . import py3_clients
-    package_handlers['aiohttp'] = py3_clients.aiohttp
-    package_handlers['yieldfrom.http.client'] = py3_clients.yieldfrom
+class LazyHandler(object):
+
+    """
+    Handler class which is imported from module when first used.
+
+    It is called like the class, to wrap a package.
+    """
+
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+        self._cls = None
+
+    def load(self):
+        """Import and return the handler class."""
+        if self._cls is None:
+            module = importlib.import_module(self.module)
+            self._cls = getattr(module, self.name)
+        return self._cls
+
+    def __call__(self, package):
+        return self.load()(package)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__, self.module, self.name)
+
+
+if sys.version_info >= (3, 5):
+    # py3_clients imports asyncio, so it is imported when first used
+    package_handlers['aiohttp'] = LazyHandler('anyhttp.py3_clients',
+                                              'aiohttp')
+    package_handlers['yieldfrom.http.client'] = LazyHandler(
+        'anyhttp.py3_clients', 'yieldfrom')
+
+    def aget_text(url, cache = None):
+        """
+        Get unicode resource from a coroutine.
+
+        Clients without asyncio support are run in an executor thread.
+        """
+        from anyhttp import py3_clients
+        return py3_clients.aget_text(url, cache = cache)
+
+    def aget_binary(url, cache = None):
+        """
+        Get binary resource from a coroutine.
+
+        Clients without asyncio support are run in an executor thread.
+        """
+        from anyhttp import py3_clients
+        return py3_clients.aget_binary(url, cache = cache)
 
 httplib2_derivatives = [
     'tinfoilhat', 'streaming_httplib2', 'bolacha',
@@ -532,6 +1542,21 @@ for package in httplib2_derivatives:
 
 known_http_packages = set(package_handlers.keys())
 
+# Packages in order of preference, fastest first, when several are loaded.
+# Loaded packages which are not listed are used after these, in
+# alphabetical order.  Saved benchmark results, see anyhttp.ranking,
+# take precedence over this table.
+package_priority = [
+    'pycurl', 'urllib3', 'geventhttpclient', 'dugong', 'httplib2',
+    'requests', 'tornado.httpclient', 'aiohttp', 'yieldfrom.http.client',
+    'hyper', 'urlfetch', 'urlgrabber', 'httpstream', 'unirest',
+    'jaraco.httplib2', 'streaming_httplib2', 'drest.request',
+]
+
+# Packages to use before all others, such as ['requests'].
+# By default, the space separated names in ANYHTTP_PACKAGES.
+preferred_packages = os.environ.get('ANYHTTP_PACKAGES', '').split()
+
 py2_http_packages = set([
     # bug in deps code:
     'geventhttpclient',
@@ -550,56 +1575,522 @@ py3_http_packages = set([
 ])
 
 
+class ThreadLocalHttp(object):
+
+    """
+    Handler which delegates to a clone of a handler in each thread.
+
+    Handlers keep per-request state, such as the current client
+    instance, so one handler must not be used by threads at once.
+    Clones share what is thread-safe, such as connection pools.
+    """
+
+    def __init__(self, http):
+        self.prototype = http
+        self._local = threading.local()
+
+    def get(self):
+        """Return the handler of the current thread."""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = self.prototype.clone()
+        return http
+
+    def clone(self):
+        return self.prototype.clone()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.prototype)
+
+
 def detect_loaded_package():
     """Detect all HTTP client packages that are already loaded."""
     global loaded_http_packages
 
     all_packages = set(sys.modules)
     loaded_http_packages = known_http_packages & set(all_packages)
-    if verbose:
-        print('loaded', loaded_http_packages)
+    if verbose or events.active:
+        _debug('loaded %s', loaded_http_packages)
+
+
+def _installed(name):
+    """Return True if the top level package of name can be imported."""
+    name = name.split('.')[0]
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return False
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def detect_available_packages():
+    """
+    Detect HTTP client packages that are installed, without importing them.
+
+    The result is kept in available_http_packages, so the probe runs
+    once per process.
+    """
+    global available_http_packages
+
+    if available_http_packages is None:
+        if sys.version_info[0] > 2:
+            unsupported = py2_http_packages
+        else:
+            unsupported = py3_http_packages
+        available_http_packages = set(
+            name for name in known_http_packages - unsupported
+            if _installed(name))
+        if verbose or events.active:
+            _debug('available %s', available_http_packages)
+    return available_http_packages
+
+
+def rank_packages(packages):
+    """
+    Return package names in order of preference.
+
+    preferred_packages come first, then the order of the saved
+    benchmark, then package_priority.
+    """
+    from anyhttp.ranking import load_ranking
+    ranking = list(preferred_packages) + load_ranking() + package_priority
+    position = {}
+    for (index, name) in enumerate(ranking):
+        position.setdefault(name, index)
+    return sorted(packages,
+                  key=lambda name: (position.get(name, len(ranking)), name))
 
 
 def choose_loaded_package(detect=True):
-    """Choose an already loaded HTTP client package."""
+    """Choose the preferred already loaded HTTP client package."""
     loaded_http_packages or detect_loaded_package()
-    for package_name in loaded_http_packages:
+    for package_name in rank_packages(loaded_http_packages):
         try:
             package = sys.modules[package_name]
             http = package_handlers.get(package_name, None)
             if http:
                 http = http(package)
 
-            if verbose:
-                print('using handler %s' % http)
+            if verbose or events.active:
+                _debug('using handler %s', http)
             return http
         except KeyError:
             warn('anyhttp: %s not found' % package)
 
 
+def import_package():
+    """
+    Import the preferred installed HTTP client package.
+
+    Packages are tried in the order of rank_packages() until one
+    imports.  Returns its handler, or None.
+    """
+    global loaded_http_packages
+
+    for package_name in rank_packages(detect_available_packages()):
+        try:
+            package = importlib.import_module(package_name)
+        except Exception as e:
+            if verbose or events.active:
+                _debug('importing %s failed: %r', package_name, e)
+            continue
+        loaded_http_packages = None
+        if verbose or events.active:
+            _debug('imported %s', package_name)
+        return package_handlers[package_name](package)
+
+
 def choose_package():
-    """Choose a HTTP client package."""
+    """
+    Choose a HTTP client package.
+
+    An already loaded package is used if there is one; otherwise the
+    preferred installed package is imported.
+    If thread_safe is set, the handler is wrapped in a ThreadLocalHttp.
+    """
     global http
-    http = choose_loaded_package()
+    http = choose_loaded_package() or import_package()
     if not http:
-        # TODO: try loading packages
         raise RuntimeError('no http packages found')
+    if thread_safe:
+        http = ThreadLocalHttp(http)
+    if events.active:
+        events.emit('handler_chosen', handler = _handler_name(http),
+                    package = getattr(http.package, '__name__', None))
+    return http
+
+def _body_size(result):
+    if isinstance(result, Response):
+        result = result.body
+    if isinstance(result, int):
+        # write_raw returns the length
+        return result
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+def _fetch(http, mode, url, fetch, *args, **kwargs):
+    """Call fetch(*args, **kwargs), emitting request events."""
+    if not events.active:
+        return fetch(*args, **kwargs)
+
+    handler = _handler_name(http)
+    events.emit('request_start', url = url, mode = mode, handler = handler)
+    start = time.time()
+    try:
+        result = fetch(*args, **kwargs)
+    except Exception as e:
+        events.emit('error', url = url, handler = handler, error = e)
+        events.emit('request_end', url = url, mode = mode, handler = handler,
+                    elapsed = time.time() - start, bytes = None,
+                    status = None, error = e)
+        raise
+    events.emit('request_end', url = url, mode = mode, handler = handler,
+                elapsed = time.time() - start, bytes = _body_size(result),
+                status = getattr(result, 'status', None), error = None)
+    return result
+
+class _EventWriter(object):
+
+    """File object which emits events for the chunks written to fp."""
+
+    def __init__(self, fp, http, url):
+        self.fp = fp
+        self.handler = _handler_name(http)
+        self.url = url
+        self.start = time.time()
+        self.first = True
+
+    def write(self, data):
+        if self.first:
+            self.first = False
+            events.emit('first_byte', url = self.url, handler = self.handler,
+                        elapsed = time.time() - self.start)
+        events.emit('bytes_received', url = self.url, handler = self.handler,
+                    bytes = len(data))
+        return self.fp.write(data)
+
+def _write_raw(http, url, fp, chunk_size):
+    """Call http.write_raw, emitting request events."""
+    if events.active:
+        fp = _EventWriter(fp, http, url)
+    return _fetch(http, 'stream', url, http.write_raw, url, fp, chunk_size)
+
+def _seekable(fp):
+    try:
+        return fp.seekable()
+    except AttributeError:
+        return hasattr(fp, 'seek') and hasattr(fp, 'truncate')
+
+def _write(http, url, fp, chunk_size, workers = None):
+    """Write a body to fp, in parallel ranges if workers and fp can seek."""
+    if workers and _seekable(fp):
+        from anyhttp import ranges
+        return ranges.get_to_file(http, url, fp, workers = workers)
+    return _write_raw(http, url, fp, chunk_size)
+
+def _iter_raw(http, url, chunk_size):
+    """Yield from http.iter_raw, emitting request events."""
+    handler = _handler_name(http)
+    events.emit('request_start', url = url, mode = 'stream',
+                handler = handler)
+    start = time.time()
+    length = 0
+    error = None
+    try:
+        for chunk in http.iter_raw(url, chunk_size = chunk_size):
+            if not length:
+                events.emit('first_byte', url = url, handler = handler,
+                            elapsed = time.time() - start)
+            length += len(chunk)
+            events.emit('bytes_received', url = url, handler = handler,
+                        bytes = len(chunk))
+            yield chunk
+    except Exception as e:
+        error = e
+        events.emit('error', url = url, handler = handler, error = e)
+        raise
+    finally:
+        events.emit('request_end', url = url, mode = 'stream',
+                    handler = handler, elapsed = time.time() - start,
+                    bytes = length, status = None, error = error)
+
+def _get(text_or_binary, url, http = None, workers = None):
+    if text_or_binary == 'text':
+        return _fetch(http, 'text', url, http.get_text, url)
+    elif text_or_binary == 'binary' and workers:
+        from anyhttp import ranges
+        return ranges.get(http, url, workers = workers)
+    elif text_or_binary == 'binary':
+        return _fetch(http, 'binary', url, http.get_binary, url)
+    else:
+        raise ValueError('text_or_binary must be "text" or "binary".')
+
+_caches = {}
+
+def _get_cache(cache):
+    """
+    Return the cache object for a cache path or cache object.
+
+    Paths ending in '.pack' are a PackCache, otherwise a DirectoryCache.
+    """
+    if not isinstance(cache, basestring):
+        return cache
+    try:
+        return _caches[cache]
+    except KeyError:
+        pass
+    if cache.endswith('.pack'):
+        _caches[cache] = PackCache(cache)
+    else:
+        _caches[cache] = DirectoryCache(cache)
+    return _caches[cache]
+
+def _cache_lookup(cache, text_or_binary, url, max_age = None):
+    """Get a cached resource, raising KeyError if it is not cached."""
+    cache = _get_cache(cache)
+    if max_age is None:
+        max_age = cache.max_age
+    key = (text_or_binary, url)
+    if memory_cache is not None:
+        try:
+            response = memory_cache.get(key, max_age = max_age)
+        except KeyError:
+            pass
+        else:
+            if events.active:
+                events.emit('cache_hit', url = url, mode = text_or_binary,
+                            tier = 'memory')
+            return response
+
+    try:
+        response, timestamp = cache.load(text_or_binary, url,
+                                         max_age = max_age)
+    except KeyError:
+        if events.active:
+            events.emit('cache_miss', url = url, mode = text_or_binary)
+        raise
+    if events.active:
+        events.emit('cache_hit', url = url, mode = text_or_binary,
+                    tier = 'cache')
+    if memory_cache is not None:
+        memory_cache.set(key, response, timestamp)
+    return response
+
+def _cache_save(cache, text_or_binary, url, response, headers = None,
+                codec = None):
+    """
+    Store a response; return it.
+    If codec is set, response is compressed with it, and is stored as is
+    and returned decompressed.
+    """
+    cache = _get_cache(cache)
+    if codec:
+        cache.dump(text_or_binary, url, response, headers = headers,
+                   codec = codec)
+        response = compression.decode_content(response, codec)
+    else:
+        cache.dump(text_or_binary, url, response, headers = headers)
+    if memory_cache is not None:
+        memory_cache.set((text_or_binary, url), response)
+    return response
+
+def _request(http, text_or_binary, url, headers = None, workers = None):
+    """
+    Send a request; binary bodies are left compressed if store_encoded.
+    Unconditional binary requests are made in parallel ranges if workers.
+    """
+    if workers and text_or_binary == 'binary' and not headers:
+        from anyhttp import ranges
+        return ranges.request(http, url, workers = workers)
+    if store_encoded and text_or_binary == 'binary':
+        return _fetch(http, 'request', url, http.request_encoded, url,
+                      headers = headers)
+    return _fetch(http, 'request', url, http.request, url, headers = headers)
+
+def _validators(headers):
+    """Conditional request headers for stored response headers."""
+    validators = {}
+    if headers.get('etag'):
+        validators['If-None-Match'] = headers['etag']
+    if headers.get('last-modified'):
+        validators['If-Modified-Since'] = headers['last-modified']
+    return validators
+
+def _cache_response(cache, text_or_binary, url, http, response):
+    """
+    Store the response to a cache fill request; return the body.
+    A 304 response revalidates the stale entry.  Other statuses than 2xx
+    raise StatusError, and the entry is kept as it was.
+    """
+    cache = _get_cache(cache)
+    if response.status == 304:
+        try:
+            body, timestamp = cache.load(text_or_binary, url, stale = True)
+        except KeyError:
+            # the body has been evicted
+            response = _request(http, text_or_binary, url)
+        else:
+            if events.active:
+                events.emit('cache_hit', url = url, mode = text_or_binary,
+                            tier = 'revalidated')
+            cache.touch(text_or_binary, url)
+            if response.headers:
+                headers = cache.load_headers(text_or_binary, url)
+                headers.update(response.headers)
+                cache.dump_headers(text_or_binary, url, headers)
+            if memory_cache is not None:
+                memory_cache.set((text_or_binary, url), body)
+            return body
+    if response.status is not None and not 200 <= response.status < 300:
+        raise StatusError(url, response.status)
 
-def _get(text_or_binary, url, http = None):
     if text_or_binary == 'text':
-        return http.get_text(url)
+        body = http._text(response.body, response.charset)
     elif text_or_binary == 'binary':
-        return http.get_binary(url)
+        body = response.body
     else:
         raise ValueError('text_or_binary must be "text" or "binary".')
+    return _cache_save(cache, text_or_binary, url, body,
+                       headers = response.headers,
+                       codec = response.content_encoding)
 
-def _get_cached(cache_dir, text_or_binary, url, http = None):
-    serializer = getattr(serializers, text_or_binary)
-    return cache(cache_dir, serializer = serializer)(_get)(text_or_binary, url, http = http)
+def _resumable(cache, text_or_binary, workers = None):
+    """Whether to fetch into a partial entry of cache, which can resume."""
+    return (text_or_binary == 'binary' and bool(workers or resumable) and
+            getattr(_get_cache(cache), 'partials', None) is not None)
 
-def _get_wrapper(cache, text_or_binary, url, require_http = True):
+def _fill_partial(cache, url, http, workers = None):
+    """
+    Fetch a binary resource in ranges into a partial cache entry.
+    An interrupted download of it is resumed, if the server supports
+    ranges and the body is unchanged.  The entry is promoted once the
+    body has been received; until then it is not loaded.
+    """
+    from anyhttp import ranges
+    cache = _get_cache(cache)
+    partials = cache.partials
+    try:
+        received, headers = partials.load('binary', url)
+    except KeyError:
+        received, headers = 0, {}
+    validator = ranges.validator_of(headers)
+    if not validator:
+        # without it, the rest could be of another version of the body
+        received = 0
+    elif verbose or events.active:
+        _debug('resuming %s at %d bytes', url, received)
+
+    fp = partials.open('binary', url)
+    try:
+        def progress(received, headers):
+            # the body must be on disk before it is recorded
+            fp.flush()
+            partials.dump('binary', url, received,
+                          dict((name, value)
+                               for (name, value) in headers.items()
+                               if name in cache.cached_headers))
+
+        length, headers = ranges.fetch(
+            http, url, ranges._File(fp), workers = workers or 1,
+            part_size = ranges.default_part_size, start = received,
+            validator = validator, progress = progress)
+    finally:
+        fp.close()
+    cache.promote('binary', url, headers = headers)
+
+def _cache_fill(cache, text_or_binary, url, http = None, workers = None):
+    """Fetch a resource into the cache, revalidating a stale entry."""
+    cache = _get_cache(cache)
+    validators = _validators(cache.load_headers(text_or_binary, url))
+    if not validators and _resumable(cache, text_or_binary, workers):
+        _fill_partial(cache, url, http, workers)
+        body, timestamp = cache.load(text_or_binary, url, stale = True)
+        if memory_cache is not None:
+            memory_cache.set((text_or_binary, url), body)
+        return body
+    response = _request(http, text_or_binary, url,
+                        headers = validators or None, workers = workers)
+    return _cache_response(cache, text_or_binary, url, http, response)
+
+# Concurrent fetches and cache fills of the same resource share one call
+_in_flight = SingleFlight()
+
+# Result of a call which wrote the body to the cache without loading it
+_written = object()
+
+def _fill_key(cache, text_or_binary, url):
+    """Return the _in_flight key of all writes of url to cache."""
+    return ('fill', cache, text_or_binary, url)
+
+def _refill(cache, text_or_binary, url, http, max_age, workers = None):
+    # another thread may have filled the cache since it was looked up
+    try:
+        return _cache_lookup(cache, text_or_binary, url, max_age = max_age)
+    except KeyError:
+        return _cache_fill(cache, text_or_binary, url, http = http,
+                           workers = workers)
+
+def _coalesced_fill(cache, text_or_binary, url, http = None, max_age = None,
+                    workers = None):
+    cache = _get_cache(cache)
+    result = _in_flight.do(_fill_key(cache, text_or_binary, url), _refill,
+                           cache, text_or_binary, url, http, max_age,
+                           workers)
+    if result is _written:
+        # the call was a streamed write, from _cache_open
+        result, timestamp = cache.load(text_or_binary, url, stale = True)
+        if memory_cache is not None:
+            memory_cache.set((text_or_binary, url), result)
+    return result
+
+def _cache_open(cache, url, http, chunk_size = None, workers = None):
+    """Stream a binary resource into the cache if needed; open the entry."""
+    cache = _get_cache(cache)
+    try:
+        return cache.open('binary', url)
+    except KeyError:
+        pass
+
+    def write():
+        try:
+            cache.open('binary', url).close()
+        except KeyError:
+            if _resumable(cache, 'binary', workers):
+                _fill_partial(cache, url, http, workers)
+            else:
+                cache.write('binary', url,
+                            lambda fp: _write(http, url, fp, chunk_size,
+                                              workers))
+        return _written
+
+    # shared with fills of the body, which must not write it meanwhile
+    _in_flight.do(_fill_key(cache, 'binary', url), write)
+    return cache.open('binary', url, stale = True)
+
+def _get_cached(cache, text_or_binary, url, http = None, max_age = None,
+                workers = None):
+    try:
+        return _cache_lookup(cache, text_or_binary, url, max_age = max_age)
+    except KeyError:
+        return _coalesced_fill(cache, text_or_binary, url, http = http,
+                               max_age = max_age, workers = workers)
+
+def _get_http(require_http = True):
     if not require_http:
-        class http:
+        class handler:
             @staticmethod
             def get_binary(url):
                 raise AssertionError('This should not be run.')
@@ -608,28 +2099,246 @@ def _get_wrapper(cache, text_or_binary, url, require_http = True):
             def get_text(url):
                 raise AssertionError('This should not be run.')
 
+            @classmethod
+            def clone(Class):
+                return Class
+
+        return handler
+
+    handler = http or choose_package()
+    if not handler:
+        raise RuntimeError('no http packages found')
+    return handler
+
+def _get_wrapper(cache, text_or_binary, url, require_http = True,
+                 max_age = None, workers = None):
+    handler = _get_http(require_http)
+    if cache:
+        return _get_cached(cache, text_or_binary, url, http = handler,
+                           max_age = max_age, workers = workers)
+    elif workers:
+        # a ranged fetch returns a bytearray, which is not shared
+        return _get(text_or_binary, url, http = handler, workers = workers)
     else:
-        http or choose_package()
-        if not http:
-            raise RuntimeError('no http packages found')
+        return _in_flight.do((text_or_binary, url), _get,
+                             text_or_binary, url, http = handler)
+
+def _get_many(cache, text_or_binary, urls, workers, ordered,
+              require_http = True, max_age = None):
+    if workers < 1:
+        raise ValueError('workers must be at least 1, not %r' % workers)
+    handler = _get_http(require_http)
+
+    if (getattr(handler, 'imap_request', None) and
+            getattr(handler, 'multiplex', True)):
+        # the client runs concurrent transfers itself
+        return _imap_request(handler, cache, text_or_binary, urls, workers,
+                             ordered, max_age = max_age)
 
     if cache:
-        return _get_cached(cache, text_or_binary, url, http = http)
+        def lookup(url):
+            return _cache_lookup(cache, text_or_binary, url,
+                                 max_age = max_age)
     else:
-        return _get(text_or_binary, url, http = http)
+        lookup = None
+
+    def fetch(http, url):
+        if cache:
+            return _coalesced_fill(cache, text_or_binary, url, http = http,
+                                   max_age = max_age)
+        else:
+            return _in_flight.do((text_or_binary, url), _get,
+                                 text_or_binary, url, http = http)
 
-def get_text(url, cache = None):
+    return workers_imap(fetch, urls, workers = workers, ordered = ordered,
+                        context = handler.clone, lookup = lookup)
+
+def _imap_request(handler, cache, text_or_binary, urls, workers, ordered,
+                  max_age = None):
+    """
+    Fetch urls with handler.imap_request, yielding (url, error, result).
+    As with worker threads, stale entries are revalidated, responses are
+    stored as _cache_fill does, and each transfer is a call of _in_flight,
+    so other threads fetching the url wait for it.  Calls running in other
+    threads are not waited for, as batches waiting for each other would
+    never complete; the url is fetched again instead.
+    """
+    if cache:
+        cache = _get_cache(cache)
+        # for a request made while the batch is running, on this thread
+        http = handler.clone()
+    else:
+        cache = None
+    calls = {}
+
+    def key(url):
+        if cache is not None:
+            return _fill_key(cache, text_or_binary, url)
+        return (text_or_binary, url)
+
+    def lookup(url):
+        if cache is not None:
+            try:
+                return _cache_lookup(cache, text_or_binary, url,
+                                     max_age = max_age)
+            except KeyError:
+                pass
+        call = _in_flight.start(key(url))
+        if call is not None:
+            calls[url] = call
+        raise KeyError(url)
+
+    def headers(url):
+        if cache is not None:
+            return _validators(cache.load_headers(text_or_binary, url)) or None
+
+    def finish(url, response):
+        call = calls.pop(url, None)
+        try:
+            if cache is not None:
+                result = _cache_response(cache, text_or_binary, url, http,
+                                         response)
+            elif text_or_binary == 'text':
+                result = handler._text(response.body, response.charset)
+            else:
+                result = response.body
+        except Exception as e:
+            if call:
+                _in_flight.end(key(url), call, error = e)
+            raise
+        if call:
+            _in_flight.end(key(url), call, result = result)
+        return result
+
+    results = handler.imap_request(
+        finish, urls, ordered = ordered, lookup = lookup,
+        limit = 2 * workers, headers = headers,
+        encoded = (cache is not None and store_encoded and
+                   text_or_binary == 'binary'))
+    try:
+        for (url, error, result) in results:
+            if error is not None and url in calls:
+                # the transfer failed, so finish was not called
+                _in_flight.end(key(url), calls.pop(url), error = error)
+            yield (url, error, result)
+    finally:
+        results.close()
+        for (url, call) in calls.items():
+            _in_flight.end(key(url), call, cancelled = True)
+
+def get_text(url, cache = None, max_age = None):
     """
     Get unicode resource.
     If you set "cache" to directory, requests will be cached in that directory.
+    "cache" may also be a cache object, such as DirectoryCache.
+    Cached responses older than "max_age" seconds are fetched again;
+    by default the cache max_age is used.
+    Concurrent calls for the same url wait for one fetch and share it.
     """
-    return _get_wrapper(cache, 'text', url)
+    return _get_wrapper(cache, 'text', url, max_age = max_age)
 
-def get_binary(url, cache = None):
+def get_binary(url, cache = None, max_age = None, workers = None):
     """
     Get binary resource.
     If you set "cache" to directory, requests will be cached in that directory.
+    "cache" may also be a cache object, such as DirectoryCache.
+    Cached responses older than "max_age" seconds are fetched again;
+    by default the cache max_age is used.
+    Concurrent calls for the same url wait for one fetch and share it.
+    If you set "workers", a large body is fetched in byte ranges by that
+    many threads where the server supports ranges, and returned as a
+    bytearray; see anyhttp.ranges.
     """
-    return _get_wrapper(cache, 'binary', url)
+    return _get_wrapper(cache, 'binary', url, max_age = max_age,
+                        workers = workers)
+
+def get_many(urls, cache = None, workers = 4, ordered = True, max_age = None):
+    """
+    Get many unicode resources using a pool of worker threads.
+    Yields (url, error, text) for each url; error is the exception raised
+    while fetching it, or None.  If "ordered" is False, results are yielded
+    as they complete.  Cache hits are yielded without using a worker.
+    Clients which run concurrent transfers themselves, such as pycurl
+    using CurlMulti, fetch on the calling thread instead, with at most
+    2 * "workers" urls in flight.
+    """
+    return _get_many(cache, 'text', urls, workers, ordered, max_age = max_age)
+
+def get_binary_many(urls, cache = None, workers = 4, ordered = True,
+                    max_age = None):
+    """
+    Get many binary resources using a pool of worker threads.
+    See get_many.
+    """
+    return _get_many(cache, 'binary', urls, workers, ordered,
+                     max_age = max_age)
 
 get_bin = get_binary
+
+def _iter_file(fp, chunk_size):
+    with fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def iter_binary(url, chunk_size = default_chunk_size, cache = None):
+    """
+    Get binary resource as an iterator of chunks.
+    Clients which cannot stream the body yield it as one chunk.
+    If you set "cache" to directory, the body is streamed into the cache
+    and then read back in chunks.
+    """
+    handler = _get_http()
+    if cache:
+        fp = _cache_open(cache, url, handler, chunk_size)
+        return _iter_file(fp, chunk_size)
+    if events.active:
+        return _iter_raw(handler, url, chunk_size)
+    return handler.iter_raw(url, chunk_size = chunk_size)
+
+def iter_text(url, chunk_size = default_chunk_size, cache = None,
+              charset = None):
+    """
+    Get unicode resource as an iterator of chunks.
+    The charset of the Content-Type is used where the client exposes it
+    while streaming, otherwise "charset", or default_charset.
+    Only one chunk is held as bytes and as text at a time.
+    If you set "cache" to directory, the body is streamed into the cache
+    and decoded from there.
+    """
+    if cache or events.active:
+        return iter_decode(iter_binary(url, chunk_size, cache = cache),
+                           charset)
+    return _get_http().iter_text(url, chunk_size = chunk_size,
+                                 charset = charset)
+
+def get_to_file(url, path_or_fileobj, cache = None,
+                chunk_size = default_chunk_size, workers = None):
+    """
+    Get binary resource into a file without holding it in memory.
+    "path_or_fileobj" is a filename, which is replaced once the body has
+    been received, or a file object opened for binary writing.
+    If you set "cache" to directory, the body is streamed into the cache
+    and copied from there.
+    If you set "workers", the body is fetched in byte ranges by that many
+    threads and written in place, where the server supports ranges and
+    the file is seekable; each thread holds one range in memory.
+    Returns the length of the body.
+    """
+    handler = _get_http()
+
+    if cache:
+        cached = _cache_open(cache, url, handler, chunk_size, workers)
+
+        def write(fp):
+            with cached:
+                return _copy_readinto(cached.readinto, fp, chunk_size)
+    else:
+        def write(fp):
+            return _write(handler, url, fp, chunk_size, workers)
+
+    if isinstance(path_or_fileobj, basestring):
+        return write_file(path_or_fileobj, write)
+    return write(path_or_fileobj)
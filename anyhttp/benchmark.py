@@ -0,0 +1,359 @@
+# -*- coding: utf-8  -*-
+"""
+Benchmark of the client wrappers against a local server.
+
+Run it like so::
+
+    python -m anyhttp.benchmark [--sizes 1024,1048576] [--output FILE]
+                                [HANDLER...]
+
+Each handler is run in a separate process, so its peak RSS is its own;
+the server runs in this process.  Results are written as JSON.
+
+The time taken by ``import anyhttp`` is measured with::
+
+    python -m anyhttp.benchmark --import-time
+"""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import json
+import math
+import optparse
+import platform
+import subprocess
+import sys
+import time
+
+import anyhttp
+from anyhttp.localserver import LocalServer
+from anyhttp.workers import imap
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+KB = 1024
+MB = 1024 * KB
+
+default_sizes = [KB, 64 * KB, MB, 10 * MB, 100 * MB]
+default_concurrency = [1, 8]
+
+# Baseline without anyhttp, to measure the overhead of the wrappers
+baseline = 'http.client'
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = max(0, int(math.ceil(fraction * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on OS X
+    return rss if sys.platform == 'darwin' else rss * KB
+
+
+def request_count(size, requests=None):
+    """Return the number of requests to make for a payload size."""
+    if requests:
+        return requests
+    return max(4, min(200, (64 * MB) // size))
+
+
+class _Baseline(object):
+
+    """Keep-alive http.client connection, without anyhttp."""
+
+    def __init__(self):
+        try:
+            import http.client as client
+        except ImportError:
+            import httplib as client
+        self.client = client
+        self.conn = None
+
+    def get_binary(self, url):
+        url = anyhttp.urlparse(url)
+        if self.conn is None:
+            self.conn = self.client.HTTPConnection(url.hostname, url.port)
+        self.conn.request('GET', url.path)
+        return self.conn.getresponse().read()
+
+    def clone(self):
+        return _Baseline()
+
+
+def make_handler(name):
+    if name == baseline:
+        return _Baseline()
+    __import__(name)
+    return anyhttp.package_handlers[name](sys.modules[name])
+
+
+def available_handlers():
+    """Return the names of handlers which can be imported."""
+    names = []
+    for name in sorted(anyhttp.package_handlers):
+        try:
+            __import__(name)
+        except Exception:
+            continue
+        names.append(name)
+    return names
+
+
+def run_case(name, url, size, requests, warm, concurrency):
+    """
+    Fetch url requests times; return a dict of results.
+
+    Cold requests each use a new handler, and so a new connection;
+    warm requests re-use one handler per thread, which has already
+    fetched url once.
+    """
+    def context():
+        if not warm:
+            return None
+        http = make_handler(name)
+        http.get_binary(url)
+        return http
+
+    def fetch(http, i):
+        http = http or make_handler(name)
+        start = timer()
+        body = http.get_binary(url)
+        elapsed = timer() - start
+        if len(body) != size:
+            raise ValueError('%d bytes received' % len(body))
+        return elapsed
+
+    latencies = []
+    errors = []
+    start = timer()
+    if concurrency == 1:
+        http = context()
+        for i in range(requests):
+            try:
+                latencies.append(fetch(http, i))
+            except Exception as e:
+                errors.append(repr(e))
+    else:
+        for (i, error, elapsed) in imap(fetch, range(requests),
+                                        workers=concurrency, ordered=False,
+                                        context=context):
+            if error:
+                errors.append(repr(error))
+            else:
+                latencies.append(elapsed)
+    wall = timer() - start
+
+    return {
+        'handler': name,
+        'size': size,
+        'connection': 'warm' if warm else 'cold',
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(errors),
+        'error': errors[0] if errors else None,
+        'seconds': wall,
+        'requests_per_second': len(latencies) / wall if wall else None,
+        'bytes_per_second': size * len(latencies) / wall if wall else None,
+        'p50_ms': _ms(percentile(latencies, 0.5)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def run_handler(name, base_url, sizes, concurrency=default_concurrency,
+                requests=None):
+    """Run all cases for one handler in this process."""
+    results = []
+    for size in sizes:
+        url = '%s/bytes/%d' % (base_url, size)
+        for level in concurrency:
+            for warm in (False, True):
+                result = run_case(name, url, size,
+                                  request_count(size, requests), warm, level)
+                result['peak_rss'] = peak_rss()
+                results.append(result)
+    return results
+
+
+def run(handlers=None, sizes=default_sizes, concurrency=default_concurrency,
+        requests=None, isolate=True):
+    """
+    Run the benchmark; return a dict with a list of results.
+
+    If isolate is True, each handler is run in a new process.
+    """
+    if not handlers:
+        handlers = [baseline] + available_handlers()
+    results = []
+    with LocalServer() as server:
+        base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+        for name in handlers:
+            if anyhttp.verbose:
+                print('benchmark: %s' % name)
+            try:
+                if isolate:
+                    results += _run_process(name, base_url, sizes,
+                                            concurrency, requests)
+                else:
+                    results += run_handler(name, base_url, sizes,
+                                           concurrency, requests)
+            except Exception as e:
+                results.append({'handler': name, 'error': repr(e)})
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': results,
+    }
+
+
+# Modules which import anyhttp must not import, until they are used
+lazy_modules = ['anyhttp.py3_clients', 'asyncio', 'vlermv', 'sqlite3']
+
+_import_script = """
+import sys
+from timeit import default_timer
+before = set(sys.modules)
+start = default_timer()
+import %s
+elapsed = default_timer() - start
+import json
+print(json.dumps([elapsed, sorted(set(sys.modules) - before)]))
+"""
+
+
+def import_time(module='anyhttp', runs=10):
+    """
+    Measure importing module in new processes.
+
+    Returns a dict with the median and best seconds, and the modules
+    imported by the last run.
+    """
+    times = []
+    for i in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', _import_script % module])
+        (elapsed, modules) = json.loads(out.decode('ascii'))
+        times.append(elapsed)
+    return {
+        'module': module,
+        'runs': runs,
+        'median': percentile(times, 0.5),
+        'best': min(times),
+        'modules': modules,
+    }
+
+
+def _run_process(name, base_url, sizes, concurrency, requests):
+    args = [sys.executable, '-m', 'anyhttp.benchmark', '--worker',
+            '--base-url', base_url,
+            '--sizes', ','.join(str(size) for size in sizes),
+            '--concurrency', ','.join(str(level) for level in concurrency)]
+    if requests:
+        args += ['--requests', str(requests)]
+    process = subprocess.Popen(args + [name], stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    (out, err) = process.communicate()
+    if process.returncode:
+        lines = err.decode('utf-8', 'replace').strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else process.returncode)
+    return json.loads(out.decode('utf-8'))
+
+
+def _ints(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def format_table(report):
+    lines = ['%-22s %10s %4s %3s %9s %9s %9s %8s' % (
+        'handler', 'size', 'conn', 'c', 'MB/s', 'p50 ms', 'p99 ms', 'RSS MB')]
+    for result in report['results']:
+        if 'size' not in result:
+            lines.append('%-22s %s' % (result['handler'], result['error']))
+            continue
+        lines.append('%-22s %10d %4s %3d %9s %9s %9s %8s' % (
+            result['handler'], result['size'], result['connection'],
+            result['concurrency'],
+            _format(result['bytes_per_second'], MB),
+            _format(result['p50_ms']), _format(result['p99_ms']),
+            _format(result['peak_rss'], MB)))
+    return '\n'.join(lines)
+
+
+def _format(value, unit=1):
+    return '-' if value is None else '%.2f' % (value / float(unit))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage='python -m anyhttp.benchmark [options] [HANDLER...]')
+    parser.add_option('--sizes', default=','.join(map(str, default_sizes)),
+                      help='payload sizes in bytes, comma separated')
+    parser.add_option('--concurrency',
+                      default=','.join(map(str, default_concurrency)),
+                      help='numbers of threads, comma separated')
+    parser.add_option('--requests', type='int',
+                      help='requests per case; by default, by size')
+    parser.add_option('--output', help='write JSON to this file')
+    parser.add_option('--in-process', action='store_true',
+                      help='run handlers in this process')
+    parser.add_option('--import-time', action='store_true',
+                      help='measure import anyhttp instead')
+    parser.add_option('--worker', action='store_true',
+                      help=optparse.SUPPRESS_HELP)
+    parser.add_option('--base-url', help=optparse.SUPPRESS_HELP)
+    (options, handlers) = parser.parse_args(argv)
+    sizes = _ints(options.sizes)
+    concurrency = _ints(options.concurrency)
+
+    if options.worker:
+        results = run_handler(handlers[0], options.base_url, sizes,
+                              concurrency, options.requests)
+        sys.stdout.write(json.dumps(results))
+        return 0
+
+    if options.import_time:
+        result = import_time()
+        sys.stderr.write('import anyhttp: median %.2f ms, best %.2f ms\n'
+                         % (result['median'] * 1000, result['best'] * 1000))
+        eager = sorted(set(lazy_modules) & set(result['modules']))
+        if eager:
+            sys.stderr.write('imported eagerly: %s\n' % ', '.join(eager))
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return 1 if eager else 0
+
+    report = run(handlers, sizes, concurrency, options.requests,
+                 isolate=not options.in_process)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as fp:
+            fp.write(output)
+        print(format_table(report))
+    else:
+        sys.stderr.write(format_table(report) + '\n')
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
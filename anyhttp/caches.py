@@ -0,0 +1,883 @@
+# -*- coding: utf-8  -*-
+"""Caches of responses."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+# vlermv, sqlite3 and others are imported when first used, so that
+# importing anyhttp stays fast for callers which do not cache.
+import atexit
+import heapq
+import mmap
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from io import BytesIO
+
+import anyhttp.compression as compression
+
+temp_prefix = '.anyhttp-'
+
+
+def write_file(filename, write):
+    """Call write(fp) on a temporary file, then rename it to filename."""
+    import tempfile
+    directory = os.path.dirname(filename) or os.curdir
+    try:
+        os.makedirs(directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=temp_prefix)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            result = write(fp)
+        replace_file(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return result
+
+
+def replace_file(source, filename):
+    """Rename source to filename, replacing any file there."""
+    if hasattr(os, 'replace'):
+        os.replace(source, filename)
+    else:
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(source, filename)
+
+
+def map_file(fp):
+    """
+    Return a read-only memoryview of the contents of a file object.
+
+    The pages are shared with the OS page cache, and with other processes
+    mapping the same file, instead of being copied.
+    """
+    size = os.fstat(fp.fileno()).st_size
+    if not size:
+        # empty files can not be mapped
+        return memoryview(b'')
+    return memoryview(mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ))
+
+
+class PartialFiles(object):
+
+    """
+    Bodies of interrupted downloads, kept to be resumed.
+
+    Each partial body is a file in directory, with a JSON file of the
+    number of bytes received and the headers of the response, whose
+    validator is sent as If-Range when the download is resumed.  File
+    names start with temp_prefix, so DirectoryCache does not count or
+    evict them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def filename(self, text_or_binary, url):
+        import hashlib
+        key = '%s\n%s' % (text_or_binary, url)
+        return os.path.join(self.directory, '%spartial-%s' % (
+            temp_prefix, hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def load(self, text_or_binary, url):
+        """
+        Return (received, headers) of a partial body.
+
+        Raises KeyError if there is none.
+        """
+        import json
+        filename = self.filename(text_or_binary, url)
+        try:
+            with open(filename + '.json') as fp:
+                state = json.load(fp)
+            size = os.path.getsize(filename)
+        except (IOError, OSError, ValueError):
+            raise KeyError(url)
+        if size < state['received']:
+            raise KeyError(url)
+        return (state['received'], state['headers'])
+
+    def open(self, text_or_binary, url):
+        """Open the partial body for writing, creating it if needed."""
+        filename = self.filename(text_or_binary, url)
+        try:
+            return open(filename, 'r+b')
+        except (IOError, OSError):
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            return open(filename, 'w+b')
+
+    def dump(self, text_or_binary, url, received, headers):
+        """Record that the partial body has received bytes."""
+        import json
+        state = json.dumps({'received': received, 'headers': headers})
+        write_file(self.filename(text_or_binary, url) + '.json',
+                   lambda fp: fp.write(state.encode('utf-8')))
+
+    def remove(self, text_or_binary, url):
+        filename = self.filename(text_or_binary, url)
+        for name in (filename + '.json', filename):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+def size_of(value):
+    """
+    Return the size in bytes of a cached response.
+
+    Buffers are measured by their contents, as sys.getsizeof does not
+    count the memory of a memoryview, such as one of a mapped file.
+    """
+    if isinstance(value, memoryview):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class MemoryCache(object):
+
+    """
+    Least recently used responses, bounded by their total size in bytes.
+
+    Keys are (text_or_binary, url).  The cache may be shared by threads.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, max_age=None):
+        """
+        Get a response, raising KeyError if it is not cached.
+
+        Responses cached more than max_age seconds ago are discarded.
+        """
+        with self._lock:
+            try:
+                (value, size, timestamp) = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            if max_age is not None and time.time() - timestamp > max_age:
+                self.size -= size
+                self.misses += 1
+                raise KeyError(key)
+            self._entries[key] = (value, size, timestamp)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timestamp=None):
+        """
+        Add a response, evicting the least recently used ones.
+
+        timestamp is when the response was fetched; by default, now.
+        """
+        size = size_of(value)
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                # the old response must not be served in its place
+                return
+            self._entries[key] = (value, size, timestamp)
+            self.size += size
+            while self.size > self.max_bytes:
+                size = self._entries.popitem(last=False)[1][1]
+                self.size -= size
+
+    def discard(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.size -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dict of hits, misses, entries and size in bytes."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self.size,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _not_cached(*args, **kwargs):
+    raise KeyError(args)
+
+
+class DirectoryCache(object):
+
+    """
+    Responses stored in a directory, one file per url, using vlermv.
+
+    Entries older than max_age seconds are stale, and are fetched again.
+    If max_bytes is set, the least recently used files are removed when
+    the directory grows beyond it.  The directory is scanned scan_batch
+    files at a time as entries are written, so no write walks the whole
+    directory; until the scan completes, only the files seen so far are
+    counted.
+
+    If use_mmap is True, binary responses are loaded as read-only
+    memoryviews of the mapped files instead of being read into memory.
+
+    If compress is 'zlib', 'lzma', 'gzip' or 'deflate', responses are
+    compressed with that codec.  Entries are loaded whether or not they
+    are compressed.
+
+    Interrupted downloads are kept in partials until they are resumed
+    and promote() makes them entries.
+    """
+
+    scan_batch = 1000
+    # response headers stored with entries
+    cached_headers = ('etag', 'last-modified', 'content-type')
+    # fraction of max_bytes which eviction reduces the directory to
+    low_water = 0.9
+
+    def __init__(self, directory, max_age=None, max_bytes=None,
+                 use_mmap=False, compress=None):
+        if compress:
+            compression.check_codec(compress)
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.use_mmap = use_mmap
+        self.compress = compress
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._heap = []
+        self._size = 0
+        self._scanner = None
+        self.partials = PartialFiles(directory)
+
+    def store(self, text_or_binary):
+        """Return the vlermv for text or binary entries."""
+        try:
+            return self._stores[text_or_binary]
+        except KeyError:
+            pass
+        from vlermv import cache
+        import anyhttp.serializers as serializers
+        serializer = getattr(serializers, text_or_binary)
+        if text_or_binary != 'headers':
+            serializer = serializers.compressed(serializer, self.compress)
+        store = cache(self.directory, serializer=serializer)(_not_cached)
+        self._stores[text_or_binary] = store
+        return store
+
+    def filename(self, text_or_binary, url):
+        return self.store(text_or_binary).filename((text_or_binary, url))
+
+    @staticmethod
+    def _set(store, key, value):
+        filename = store.filename(key)
+        # some vlermv versions treat an existing file as a directory index
+        if os.path.isfile(filename):
+            os.remove(filename)
+        store[key] = (None, value)
+        return filename
+
+    def open(self, text_or_binary, url, max_age=None, stale=False):
+        """
+        Open a fresh binary entry for reading.
+
+        Raises KeyError if there is no entry or it is stale,
+        unless stale is True.
+        """
+        filename = self.filename(text_or_binary, url)
+        self._fresh_mtime(filename, url, max_age, stale)
+        try:
+            return compression.Reader(open(filename, 'rb'))
+        except (IOError, OSError):
+            raise KeyError(url)
+
+    def _fresh_mtime(self, filename, url, max_age, stale=False):
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            raise KeyError(url)
+        if max_age is None:
+            max_age = self.max_age
+        if (not stale and max_age is not None and
+                time.time() - mtime > max_age):
+            raise KeyError(url)
+        if self.max_bytes is not None:
+            # record the access time for eviction, keeping the mtime
+            try:
+                os.utime(filename, (time.time(), mtime))
+            except OSError:
+                pass
+        return mtime
+
+    def load(self, text_or_binary, url, max_age=None, stale=False):
+        """
+        Return (response, mtime) for a fresh entry.
+
+        Raises KeyError if there is no entry or it is stale,
+        unless stale is True.
+        """
+        filename = self.filename(text_or_binary, url)
+        mtime = self._fresh_mtime(filename, url, max_age, stale)
+        if self.use_mmap and text_or_binary == 'binary':
+            try:
+                with open(filename, 'rb') as fp:
+                    return (compression.decompress(map_file(fp)), mtime)
+            except (IOError, OSError):
+                raise KeyError(url)
+        error, response = self.store(text_or_binary)[(text_or_binary, url)]
+        if error:
+            raise error
+        return (response, mtime)
+
+    def load_headers(self, text_or_binary, url):
+        """Return the stored response headers of an entry, or {}."""
+        store = self.store('headers')
+        key = ('headers', text_or_binary, url)
+        if key not in store:
+            return {}
+        return store[key][1]
+
+    def dump(self, text_or_binary, url, response, headers=None, codec=None):
+        """
+        Store a response, and its cached_headers from headers.
+
+        If codec is set, the binary response is already compressed with
+        it, such as a gzip response body, and is stored as is.
+        """
+        if codec:
+            def write(fp):
+                fp.write(compression.header(codec))
+                fp.write(response)
+            filename = self.filename(text_or_binary, url)
+            write_file(filename, write)
+            self._added(filename)
+        else:
+            self._added(self._set(self.store(text_or_binary),
+                                  (text_or_binary, url), response))
+        self.dump_headers(text_or_binary, url, headers)
+
+    def dump_headers(self, text_or_binary, url, headers):
+        headers = dict((name, value)
+                       for (name, value) in (headers or {}).items()
+                       if name in self.cached_headers)
+        store = self.store('headers')
+        key = ('headers', text_or_binary, url)
+        if headers:
+            self._added(self._set(store, key, headers))
+        elif key in store:
+            # do not keep validators of an older response
+            try:
+                os.remove(store.filename(key))
+            except OSError:
+                pass
+
+    def touch(self, text_or_binary, url):
+        """Mark an entry as fetched now, after it has been revalidated."""
+        try:
+            os.utime(self.filename(text_or_binary, url), None)
+        except OSError:
+            raise KeyError(url)
+
+    def write(self, text_or_binary, url, write):
+        """Call write(fp) to create a binary entry."""
+        filename = self.filename(text_or_binary, url)
+        write_file(filename, self._compressed(write))
+        self._added(filename)
+
+    def promote(self, text_or_binary, url, headers=None):
+        """Make the completed partial body of url an entry."""
+        partial = self.partials.filename(text_or_binary, url)
+        if self.compress:
+            import shutil
+            with open(partial, 'rb') as source:
+                self.write(text_or_binary, url,
+                           lambda fp: shutil.copyfileobj(source, fp))
+        else:
+            filename = self.filename(text_or_binary, url)
+            directory = os.path.dirname(filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            replace_file(partial, filename)
+            self._added(filename)
+        self.dump_headers(text_or_binary, url, headers)
+        self.partials.remove(text_or_binary, url)
+
+    def _compressed(self, write):
+        if not self.compress:
+            return write
+
+        def compressed_write(fp):
+            writer = compression.Writer(fp, self.compress)
+            result = write(writer)
+            writer.finish()
+            return result
+        return compressed_write
+
+    def _added(self, filename):
+        if self.max_bytes is None:
+            return
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return
+        with self._lock:
+            self._account(filename, size, time.time())
+            self._scan_step()
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _account(self, filename, size, atime):
+        self._size += size - self._sizes.get(filename, 0)
+        self._sizes[filename] = size
+        heapq.heappush(self._heap, (atime, filename))
+
+    def _scan(self):
+        for (dirpath, dirnames, filenames) in os.walk(self.directory):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            for name in filenames:
+                if name.startswith(temp_prefix):
+                    continue
+                filename = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                yield (filename, st.st_size, st.st_atime)
+
+    def _scan_step(self):
+        if self._scanner is None:
+            self._scanner = self._scan()
+        elif self._scanner is False:
+            return
+        for i in range(self.scan_batch):
+            try:
+                (filename, size, atime) = next(self._scanner)
+            except StopIteration:
+                self._scanner = False
+                return
+            if filename not in self._sizes:
+                self._account(filename, size, atime)
+
+    def _evict(self):
+        target = self.max_bytes * self.low_water
+        while self._size > target and self._heap:
+            (atime, filename) = heapq.heappop(self._heap)
+            if filename not in self._sizes:
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                self._size -= self._sizes.pop(filename)
+                continue
+            if st.st_atime > atime:
+                # used since it was queued
+                heapq.heappush(self._heap, (st.st_atime, filename))
+                continue
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            self._size -= self._sizes.pop(filename)
+
+
+class _PackReader(object):
+
+    """Read-only file object over one entry of a pack file."""
+
+    def __init__(self, cache, offset, length):
+        self._cache = cache
+        self._pos = offset
+        self._end = offset + length
+
+    def read(self, size=-1):
+        remaining = self._end - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self._cache._read(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._pos = self._end
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PackCache(object):
+
+    """
+    Responses appended to a single pack file, indexed with sqlite.
+
+    The index, stored alongside the pack in path + '.idx', maps a hash of
+    each (text_or_binary, url) to the position of its body, so lookups
+    do not depend on the number of entries, and any url may be cached.
+    Index updates are committed every batch writes, or after
+    commit_interval seconds, and on flush() or close().
+
+    Replaced and stale entries remain in the pack until compact(), which
+    writes a new pack and index beside them, in path + '.compact' and
+    path + '.idx.compact', and replaces the index, then the pack.  If it
+    is interrupted, the cache is opened with the old pack and index, or
+    the new pack is moved into place if the new index already was.
+
+    If use_mmap is True, binary responses are loaded as read-only
+    memoryviews of their slice of the mapped pack.
+
+    If compress is 'zlib', 'lzma', 'gzip' or 'deflate', responses are
+    compressed with that codec.  Entries are loaded whether or not they
+    are compressed.
+
+    Interrupted downloads are kept in partials, in path + '.partial',
+    until they are resumed and promote() appends them to the pack.
+    """
+
+    # response headers stored with entries
+    cached_headers = DirectoryCache.cached_headers
+    commit_interval = 1
+
+    def __init__(self, path, max_age=None, batch=100, use_mmap=False,
+                 compress=None):
+        if compress:
+            compression.check_codec(compress)
+        self.compress = compress
+        self.path = path
+        self.max_age = max_age
+        self.batch = batch
+        self.use_mmap = use_mmap
+        self._map = None
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._committed = time.time()
+        self.partials = PartialFiles(path + '.partial')
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+        self._pack = open(path, 'a+b')
+        self._index = self._connect(path + '.idx')
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _connect(filename):
+        import sqlite3
+        index = sqlite3.connect(filename, check_same_thread=False)
+        index.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key BLOB PRIMARY KEY, offset INTEGER, length INTEGER, '
+            'mtime REAL, headers TEXT) WITHOUT ROWID')
+        index.commit()
+        return index
+
+    def _recover(self):
+        """Finish or discard an interrupted compact()."""
+        pack, index = self.path + '.compact', self.path + '.idx.compact'
+        if os.path.exists(index):
+            # the new index is not in place; the old pack is used
+            for filename in (pack, index, index + '-journal'):
+                if os.path.exists(filename):
+                    os.remove(filename)
+        elif os.path.exists(pack):
+            # the new index is in place, and refers to the new pack
+            replace_file(pack, self.path)
+
+    @staticmethod
+    def key(text_or_binary, url):
+        import hashlib
+        import sqlite3
+        key = '%s\n%s' % (text_or_binary, url)
+        return sqlite3.Binary(hashlib.sha1(key.encode('utf-8')).digest())
+
+    def _entry(self, text_or_binary, url, max_age=None, stale=False):
+        with self._lock:
+            row = self._index.execute(
+                'SELECT offset, length, mtime FROM entries WHERE key = ?',
+                (self.key(text_or_binary, url), )).fetchone()
+        if row is None:
+            raise KeyError(url)
+        if max_age is None:
+            max_age = self.max_age
+        if (not stale and max_age is not None and
+                time.time() - row[2] > max_age):
+            raise KeyError(url)
+        return row
+
+    def _read(self, offset, size):
+        with self._lock:
+            self._pack.seek(offset)
+            return self._pack.read(size)
+
+    def _view(self, offset, size):
+        with self._lock:
+            if self._map is None or len(self._map) < offset + size:
+                # the pack has grown since it was mapped
+                self._map = map_file(self._pack)
+            return self._map[offset:offset + size]
+
+    def _append(self, fp, codec=None):
+        """
+        Append the contents of fp to the pack; return (offset, length).
+
+        If codec is set, fp is already compressed with it.
+        """
+        import shutil
+        self._pack.seek(0, os.SEEK_END)
+        offset = self._pack.tell()
+        if codec:
+            self._pack.write(compression.header(codec))
+            shutil.copyfileobj(fp, self._pack)
+        elif self.compress:
+            writer = compression.Writer(self._pack, self.compress)
+            shutil.copyfileobj(fp, writer)
+            writer.finish()
+        else:
+            shutil.copyfileobj(fp, self._pack)
+        length = self._pack.tell() - offset
+        # the body must be on disk before the index refers to it
+        self._pack.flush()
+        return (offset, length)
+
+    def _put(self, text_or_binary, url, fp, headers=None, codec=None):
+        import json
+        headers = self._filter_headers(headers)
+        with self._lock:
+            (offset, length) = self._append(fp, codec)
+            self._index.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                (self.key(text_or_binary, url), offset, length, time.time(),
+                 json.dumps(headers) if headers else None))
+            self._written()
+
+    def _written(self):
+        self._pending += 1
+        if (self._pending >= self.batch or
+                time.time() - self._committed > self.commit_interval):
+            self.flush()
+
+    def _filter_headers(self, headers):
+        return dict((name, value)
+                    for (name, value) in (headers or {}).items()
+                    if name in self.cached_headers)
+
+    def open(self, text_or_binary, url, max_age=None, stale=False):
+        """
+        Open a fresh binary entry for reading.
+
+        Raises KeyError if there is no entry or it is stale,
+        unless stale is True.
+        """
+        (offset, length, mtime) = self._entry(text_or_binary, url,
+                                              max_age, stale)
+        return compression.Reader(_PackReader(self, offset, length))
+
+    def load(self, text_or_binary, url, max_age=None, stale=False):
+        """
+        Return (response, mtime) for a fresh entry.
+
+        Raises KeyError if there is no entry or it is stale,
+        unless stale is True.
+        """
+        (offset, length, mtime) = self._entry(text_or_binary, url,
+                                              max_age, stale)
+        if self.use_mmap and text_or_binary == 'binary':
+            return (compression.decompress(self._view(offset, length)),
+                    mtime)
+        response = compression.decompress(self._read(offset, length))
+        if text_or_binary == 'text':
+            response = response.decode('utf-8')
+        return (response, mtime)
+
+    def load_headers(self, text_or_binary, url):
+        """Return the stored response headers of an entry, or {}."""
+        with self._lock:
+            row = self._index.execute(
+                'SELECT headers FROM entries WHERE key = ?',
+                (self.key(text_or_binary, url), )).fetchone()
+        if not row or not row[0]:
+            return {}
+        import json
+        return json.loads(row[0])
+
+    def dump(self, text_or_binary, url, response, headers=None, codec=None):
+        """
+        Store a response, and its cached_headers from headers.
+
+        If codec is set, the binary response is already compressed with
+        it, such as a gzip response body, and is stored as is.
+        """
+        if text_or_binary == 'text' and not codec:
+            response = response.encode('utf-8')
+        self._put(text_or_binary, url, BytesIO(response), headers, codec)
+
+    def dump_headers(self, text_or_binary, url, headers):
+        import json
+        headers = self._filter_headers(headers)
+        with self._lock:
+            self._index.execute(
+                'UPDATE entries SET headers = ? WHERE key = ?',
+                (json.dumps(headers) if headers else None,
+                 self.key(text_or_binary, url)))
+            self._written()
+
+    def touch(self, text_or_binary, url):
+        """Mark an entry as fetched now, after it has been revalidated."""
+        with self._lock:
+            cursor = self._index.execute(
+                'UPDATE entries SET mtime = ? WHERE key = ?',
+                (time.time(), self.key(text_or_binary, url)))
+            if not cursor.rowcount:
+                raise KeyError(url)
+            self._written()
+
+    def write(self, text_or_binary, url, write):
+        """Call write(fp) to create a binary entry."""
+        import tempfile
+        # stream to a temporary file, so the pack is not locked meanwhile
+        with tempfile.TemporaryFile() as fp:
+            write(fp)
+            fp.seek(0)
+            self._put(text_or_binary, url, fp)
+
+    def promote(self, text_or_binary, url, headers=None):
+        """Append the completed partial body of url to the pack."""
+        with open(self.partials.filename(text_or_binary, url), 'rb') as fp:
+            self._put(text_or_binary, url, fp, headers)
+        self.partials.remove(text_or_binary, url)
+
+    def flush(self):
+        """Commit pending index updates."""
+        with self._lock:
+            if self._index is None:
+                return
+            self._index.commit()
+            self._pending = 0
+            self._committed = time.time()
+
+    def close(self):
+        with self._lock:
+            if self._index is None:
+                return
+            self.flush()
+            self._index.close()
+            self._index = None
+            self._map = None
+            self._pack.close()
+
+    def compact(self, max_age=None):
+        """
+        Rewrite the pack with only its live entries.
+
+        Entries older than max_age seconds are removed.
+        Returns the number of bytes reclaimed.
+        """
+        with self._lock:
+            self.flush()
+            self._pack.seek(0, os.SEEK_END)
+            old_size = self._pack.tell()
+            min_mtime = -1 if max_age is None else time.time() - max_age
+            rows = self._index.execute(
+                'SELECT key, offset, length, mtime, headers FROM entries '
+                'WHERE mtime >= ? ORDER BY offset', (min_mtime, ))
+            pack, index = self.path + '.compact', self.path + '.idx.compact'
+            # the new index exists before the new pack, so that _recover()
+            # never moves a partly written pack into place
+            new_index = self._connect(index)
+            offset = 0
+            with open(pack, 'wb') as fp:
+                for (key, old_offset, length, mtime, headers) in rows:
+                    self._copy(old_offset, length, fp)
+                    new_index.execute(
+                        'INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                        (key, offset, length, mtime, headers))
+                    offset += length
+                fp.flush()
+                os.fsync(fp.fileno())
+            new_index.commit()
+            new_index.close()
+            # views already returned keep the old pack mapped
+            self._map = None
+            self._pack.close()
+            self._index.close()
+            try:
+                # the index is replaced first; _recover() finishes the rest
+                replace_file(index, self.path + '.idx')
+                replace_file(pack, self.path)
+            finally:
+                self._recover()
+                self._pack = open(self.path, 'a+b')
+                self._index = self._connect(self.path + '.idx')
+            return old_size - offset
+
+    def _copy(self, offset, length, fp, chunk_size=1024 * 1024):
+        """Copy length bytes of the pack from offset to fp, in chunks."""
+        end = offset + length
+        while offset < end:
+            data = self._read(offset, min(chunk_size, end - offset))
+            if not data:
+                raise IOError('%s is truncated' % self.path)
+            fp.write(data)
+            offset += len(data)
+
+    def __len__(self):
+        with self._lock:
+            return self._index.execute(
+                'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+def main(argv=None):
+    """Command line interface: compact PATH [MAX_AGE]."""
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) not in (2, 3) or argv[0] != 'compact':
+        sys.stderr.write('usage: python -m anyhttp.caches '
+                         'compact PATH [MAX_AGE]\n')
+        return 2
+    max_age = float(argv[2]) if len(argv) == 3 else None
+    cache = PackCache(argv[1])
+    reclaimed = cache.compact(max_age=max_age)
+    entries = len(cache)
+    cache.close()
+    print('%s: %d entries, %d bytes reclaimed'
+          % (argv[1], entries, reclaimed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+# -*- coding: utf-8  -*-
+"""Compression of cached response bodies, and HTTP content codings."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Compressed entries start with magic followed by one byte for the codec.
+# Entries without it are stored as is.
+magic = b'\x89ahz'
+header_size = len(magic) + 1
+
+codec_ids = {
+    'zlib': b'z',
+    'lzma': b'x',
+    # HTTP content codings, so compressed responses can be stored as is
+    'gzip': b'g',
+    'deflate': b'd',
+}
+codec_names = dict((value, key) for (key, value) in codec_ids.items())
+
+
+def check_codec(codec):
+    if codec not in codec_ids:
+        raise ValueError('codec must be one of %s'
+                         % ', '.join(sorted(codec_ids)))
+    if codec == 'lzma' and lzma is None:
+        raise ValueError('lzma is not available')
+
+
+def compressor(codec):
+    check_codec(codec)
+    if codec in ('zlib', 'deflate'):
+        return zlib.compressobj()
+    if codec == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return lzma.LZMACompressor()
+
+
+def decompressor(codec):
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    if codec in content_codings:
+        return content_decoder(codec)
+    if lzma is None:
+        raise IOError('lzma is needed to read this entry')
+    return lzma.LZMADecompressor()
+
+
+def header(codec):
+    check_codec(codec)
+    return magic + codec_ids[codec]
+
+
+def codec_of(data):
+    """Return the codec named in a header, or None if data has none."""
+    if data[:len(magic)] != magic:
+        return None
+    return codec_names.get(bytes(data[len(magic):header_size]))
+
+
+def compress(data, codec):
+    c = compressor(codec)
+    return header(codec) + c.compress(data) + c.flush()
+
+
+def decompress(data):
+    """Decompress data with a header, or return data without one."""
+    codec = codec_of(data)
+    if codec is None:
+        return data
+    return decompressor(codec).decompress(bytes(data[header_size:]))
+
+
+# Value of the Accept-Encoding request header
+accept_encoding = 'gzip, deflate'
+
+# Content-Encoding values which content_decoder() can decode
+content_codings = ('gzip', 'x-gzip', 'deflate')
+
+
+class _DeflateDecoder(object):
+
+    """
+    Decoder of the deflate content coding.
+
+    It should be zlib data, but some servers send raw deflate data.
+    """
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._decompressor.decompress(data)
+        self._first = False
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+def content_coding(headers):
+    """
+    Return the Content-Encoding of response headers, or None.
+
+    headers is a dict with lower case names.  Raises ValueError if the
+    coding cannot be decoded.
+    """
+    coding = (headers.get('content-encoding') or '').strip().lower()
+    if not coding or coding == 'identity':
+        return None
+    if coding not in content_codings:
+        raise ValueError('unsupported Content-Encoding %r' % coding)
+    return 'gzip' if coding == 'x-gzip' else coding
+
+
+def content_decoder(coding):
+    """Return a decompressor for a content coding."""
+    if coding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if coding == 'deflate':
+        return _DeflateDecoder()
+    raise ValueError('unsupported Content-Encoding %r' % coding)
+
+
+def decode_content(data, coding):
+    """Return data decoded from a content coding, or as is if None."""
+    if not coding:
+        return data
+    decoder = content_decoder(coding)
+    return decoder.decompress(data) + decoder.flush()
+
+
+def iter_decode_content(chunks, coding):
+    """Decode an iterable of chunks from a content coding as they arrive."""
+    if not coding:
+        for chunk in chunks:
+            yield chunk
+        return
+    decoder = content_decoder(coding)
+    for chunk in chunks:
+        data = decoder.decompress(chunk)
+        if data:
+            yield data
+    data = decoder.flush()
+    if data:
+        yield data
+
+
+class DecodingWriter(object):
+
+    """File object which decodes a content coding written to fp."""
+
+    def __init__(self, fp, coding):
+        self.fp = fp
+        self.length = 0
+        self._decoder = content_decoder(coding)
+
+    def write(self, data):
+        self._write(self._decoder.decompress(data))
+        return len(data)
+
+    def _write(self, data):
+        if data:
+            self.fp.write(data)
+            self.length += len(data)
+
+    def finish(self):
+        """Write the rest of the decoded body, leaving fp open."""
+        self._write(self._decoder.flush())
+
+
+class Writer(object):
+
+    """File object which compresses what is written to fp."""
+
+    def __init__(self, fp, codec):
+        self.fp = fp
+        self._compressor = compressor(codec)
+        fp.write(header(codec))
+
+    def write(self, data):
+        self.fp.write(self._compressor.compress(data))
+        return len(data)
+
+    def finish(self):
+        """Write the end of the compressed stream, leaving fp open."""
+        self.fp.write(self._compressor.flush())
+
+
+class Reader(object):
+
+    """
+    File object reading the body stored in fp.
+
+    Bodies with a header are decompressed as they are read; others are
+    read as is.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, fp):
+        self.fp = fp
+        data = fp.read(header_size)
+        codec = codec_of(data)
+        # bytearray grows in place, and drops read bytes from its start
+        # without moving the rest
+        if codec is None:
+            self._decompressor = None
+            self._buffer = bytearray(data)
+        else:
+            self._decompressor = decompressor(codec)
+            self._buffer = bytearray()
+        self._eof = False
+
+    def _fill(self, size):
+        while len(self._buffer) < size and not self._eof:
+            data = self.fp.read(self.chunk_size)
+            if not data:
+                self._eof = True
+                if self._decompressor is not None and hasattr(
+                        self._decompressor, 'flush'):
+                    self._buffer += self._decompressor.flush()
+                break
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            self._buffer += data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            if self._decompressor is None and not self._eof:
+                # the rest of a stored body in one read
+                self._eof = True
+                data = bytes(self._buffer) + self.fp.read()
+                self._buffer = bytearray()
+                return data
+            self._fill(float('inf'))
+            size = len(self._buffer)
+        else:
+            self._fill(size)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
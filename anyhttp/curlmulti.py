@@ -0,0 +1,259 @@
+# -*- coding: utf-8  -*-
+"""Concurrent transfers on one thread using the pycurl multi interface."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+from collections import deque
+from io import BytesIO
+
+import anyhttp
+from anyhttp import compression, events
+
+
+def parse_header_lines(lines):
+    """Return a dict of the headers of the final response in lines."""
+    headers = {}
+    for line in lines:
+        line = line.decode('latin1')
+        if line.startswith('HTTP/'):
+            # headers of the final response follow the last status line
+            headers = {}
+        elif ':' in line:
+            (name, value) = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+class CurlMulti(object):
+
+    """
+    Transfers run concurrently by a pycurl CurlMulti.
+
+    At most handles transfers run at once, each using an easy handle
+    which is recycled for later transfers; libcurl re-uses connections
+    between them.  max_host_connections limits the connections opened
+    to one host, and max_total_connections those opened in all.
+
+    callback(url, error, response) is called in the thread running
+    perform() as each transfer completes, unless add() is given one.
+    An engine must be driven by one thread at a time, and by one imap()
+    at a time, as clear() aborts all of its transfers.
+    """
+
+    select_timeout = 1.0
+
+    def __init__(self, pycurl, handles=16, max_host_connections=6,
+                 max_total_connections=None, callback=None):
+        self.pycurl = pycurl
+        self.handles = handles
+        self.callback = callback
+        self.multi = pycurl.CurlMulti()
+        # options missing in older libcurl are ignored
+        for (name, value) in (('M_MAX_HOST_CONNECTIONS', max_host_connections),
+                              ('M_MAX_TOTAL_CONNECTIONS',
+                               max_total_connections)):
+            if value and hasattr(pycurl, name):
+                self.multi.setopt(getattr(pycurl, name), value)
+        self._free = []
+        self._queue = deque()
+        self._active = {}
+
+    def add(self, url, callback=None, headers=None, encoded=False):
+        """
+        Queue a GET of url.
+
+        If encoded, a compressed body is left compressed, and the
+        Response has its content_encoding.
+        """
+        self._queue.append((url, headers, encoded, callback or self.callback))
+
+    def __len__(self):
+        """Return the number of transfers queued or running."""
+        return len(self._queue) + len(self._active)
+
+    def _start(self):
+        pycurl = self.pycurl
+        started = 0
+        while self._queue and len(self._active) < self.handles:
+            (url, headers, encoded, callback) = self._queue.popleft()
+            handle = self._free.pop() if self._free else pycurl.Curl()
+            body = BytesIO()
+            lines = []
+            handle.setopt(pycurl.URL, url)
+            handle.setopt(pycurl.WRITEFUNCTION, body.write)
+            handle.setopt(pycurl.HEADERFUNCTION, lines.append)
+            if encoded:
+                # without ENCODING, libcurl leaves the body compressed
+                headers = anyhttp._accept_encoding(headers)
+            elif anyhttp.accept_encoding:
+                handle.setopt(pycurl.ENCODING, anyhttp.accept_encoding)
+            if headers:
+                handle.setopt(pycurl.HTTPHEADER,
+                              ['%s: %s' % item for item in headers.items()])
+            self._active[handle] = (url, body, lines, encoded, callback)
+            self.multi.add_handle(handle)
+            if events.active:
+                events.emit('request_start', url=url, mode='request',
+                            handler='CurlMulti')
+            started += 1
+        return started
+
+    def _finish(self, handle, error):
+        (url, body, lines, encoded, callback) = self._active.pop(handle)
+        self.multi.remove_handle(handle)
+        response = None
+        if error is None:
+            headers = parse_header_lines(lines)
+            response = anyhttp.Response(
+                handle.getinfo(self.pycurl.RESPONSE_CODE), headers,
+                body.getvalue(),
+                compression.content_coding(headers) if encoded else None)
+        if events.active:
+            self._emit(handle, url, error, response)
+        self._recycle(handle)
+        if callback:
+            callback(url, error, response)
+
+    def _emit(self, handle, url, error, response):
+        pycurl = self.pycurl
+        if error is None:
+            events.emit('first_byte', url=url, handler='CurlMulti',
+                        elapsed=handle.getinfo(pycurl.STARTTRANSFER_TIME))
+        else:
+            events.emit('error', url=url, handler='CurlMulti', error=error)
+        events.emit('request_end', url=url, mode='request',
+                    handler='CurlMulti',
+                    elapsed=handle.getinfo(pycurl.TOTAL_TIME),
+                    bytes=len(response.body) if response else None,
+                    status=response.status if response else None,
+                    error=error)
+
+    def _recycle(self, handle):
+        # reset() drops the options but keeps the handle's caches
+        handle.reset()
+        if len(self._free) < self.handles:
+            self._free.append(handle)
+        else:
+            handle.close()
+
+    def step(self):
+        """
+        Run transfers until some complete or select_timeout passes.
+
+        Returns the number of transfers queued or running.
+        """
+        pycurl = self.pycurl
+        self._start()
+        while True:
+            (ret, running) = self.multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+        completed = 0
+        while True:
+            (queued, ok, failed) = self.multi.info_read()
+            for handle in ok:
+                self._finish(handle, None)
+            for (handle, errno, errmsg) in failed:
+                self._finish(handle, pycurl.error(errno, errmsg))
+            completed += len(ok) + len(failed)
+            if not queued:
+                break
+
+        if not completed and self._active and not self._start():
+            self.multi.select(self.select_timeout)
+        return len(self)
+
+    def perform(self):
+        """Run all queued transfers to completion."""
+        while self.step():
+            pass
+
+    def clear(self):
+        """Abort all queued and running transfers."""
+        self._queue.clear()
+        for handle in list(self._active):
+            del self._active[handle]
+            self.multi.remove_handle(handle)
+            self._recycle(handle)
+
+    def imap(self, func, urls, ordered=True, lookup=None, limit=None,
+             headers=None, encoded=False):
+        """
+        Fetch urls, yielding (url, error, result).
+
+        Like workers.imap, but the transfers run on this thread.
+        func(url, response) is called as each transfer completes, and
+        its return value is the result; exceptions raised by it or by
+        the transfer are captured per url as error.  lookup is called
+        before a url is queued; unless it raises KeyError, its return
+        value is the result and the url is not fetched, and other
+        exceptions raised by it are captured as error.  headers(url)
+        returns the request headers of a url, or None.
+        At most limit urls, by default 2 * handles, are in flight.
+        """
+        limit = limit or 2 * self.handles
+        urls = iter(urls)
+        submitted = yielded = 0
+        exhausted = False
+        backlog = {}
+
+        def completed(index):
+            def callback(url, error, response):
+                result = None
+                if error is None:
+                    try:
+                        result = func(url, response)
+                    except Exception as e:
+                        error = e
+                backlog[index] = (url, error, result)
+            return callback
+
+        try:
+            while True:
+                while not exhausted and submitted - yielded < limit:
+                    try:
+                        url = next(urls)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    if lookup:
+                        try:
+                            backlog[submitted] = (url, None, lookup(url))
+                            submitted += 1
+                            continue
+                        except KeyError:
+                            pass
+                        except Exception as e:
+                            backlog[submitted] = (url, e, None)
+                            submitted += 1
+                            continue
+
+                    self.add(url, completed(submitted),
+                             headers(url) if headers else None, encoded)
+                    submitted += 1
+
+                if ordered:
+                    ready = []
+                    while yielded + len(ready) in backlog:
+                        ready.append(backlog.pop(yielded + len(ready)))
+                else:
+                    ready = list(backlog.values())
+                    backlog.clear()
+
+                if ready:
+                    for result in ready:
+                        yielded += 1
+                        yield result
+                    continue
+
+                if yielded == submitted:
+                    break
+
+                self.step()
+        finally:
+            if yielded != submitted:
+                self.clear()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8  -*-
+"""
+Events emitted while fetching, for logging and metrics.
+
+Subscribers are called with a dict of the event fields, including
+'event', the name of the event, and 'time', when it was emitted.
+
+handler_chosen
+    handler, package
+request_start
+    url, mode, handler
+first_byte
+    url, handler, elapsed; for streamed bodies, and clients which
+    report it
+bytes_received
+    url, handler, bytes; for each chunk of streamed bodies
+request_end
+    url, mode, handler, elapsed, bytes, status, error
+error
+    url, handler, error
+cache_hit
+    url, mode, tier; tier is 'memory', 'cache' or 'revalidated'
+cache_miss
+    url, mode
+debug
+    message
+
+mode is 'text', 'binary', 'request' for requests with headers, or
+'stream' for iter_binary and get_to_file.  status is None where the
+client does not report it.
+"""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import sys
+import threading
+import time
+
+from warnings import warn
+
+# True while there are subscribers.  Emitters check it first, so that
+# events cost almost nothing when nobody is listening.
+active = False
+
+_subscribers = ()
+_lock = threading.Lock()
+
+
+def subscribe(callback, events=None):
+    """Call callback(event) for events with a name in events, or all."""
+    global _subscribers, active
+    if events is not None:
+        events = frozenset(events)
+    with _lock:
+        _subscribers += ((callback, events), )
+        active = True
+
+
+def unsubscribe(callback):
+    global _subscribers, active
+    with _lock:
+        _subscribers = tuple(item for item in _subscribers
+                             if item[0] != callback)
+        active = bool(_subscribers)
+
+
+def emit(name, **fields):
+    """Call the subscribers of the event name."""
+    fields['event'] = name
+    fields['time'] = time.time()
+    for (callback, events) in _subscribers:
+        if events is None or name in events:
+            try:
+                callback(fields)
+            except Exception as e:
+                warn('anyhttp: event subscriber %r failed: %r'
+                     % (callback, e))
+
+
+def print_event(event, file=None):
+    """Subscriber which prints events on one line each."""
+    fields = ' '.join('%s=%r' % (key, event[key]) for key in sorted(event)
+                      if key not in ('event', 'time'))
+    (file or sys.stderr).write('anyhttp: %s %s\n' % (event['event'], fields))
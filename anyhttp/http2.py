@@ -0,0 +1,201 @@
+# -*- coding: utf-8  -*-
+"""Batches of requests multiplexed on HTTP/2 connections using hyper."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import time
+
+from collections import deque
+
+import anyhttp
+from anyhttp import events
+
+
+def _path(url):
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+    return path
+
+
+class HTTP2Batch(object):
+
+    """
+    Requests multiplexed on one hyper connection per origin.
+
+    Each origin gets one hyper.HTTPConnection, which negotiates HTTP/2
+    with ALPN for https, or with an h2c upgrade for http.  Requests to
+    an HTTP/2 origin are all sent before their responses are read, so
+    they run as concurrent streams on the one connection.  If the server
+    does not negotiate HTTP/2, the connection stays HTTP/1.1 and its
+    requests are made one after another.
+
+    A batch must be driven by one thread at a time.
+    """
+
+    def __init__(self, hyper, max_streams=100):
+        self.hyper = hyper
+        self.max_streams = max_streams
+        self._connections = {}
+
+    def connection(self, url):
+        """Return the connection to the origin of a parsed url."""
+        secure = url.scheme == 'https'
+        key = (url.scheme, url.hostname, url.port)
+        conn = self._connections.get(key)
+        if conn is None:
+            conn = self.hyper.HTTPConnection(
+                url.hostname, url.port or (443 if secure else 80),
+                secure=secure)
+            self._connections[key] = conn
+        return conn
+
+    def _discard(self, conn):
+        for (key, value) in list(self._connections.items()):
+            if value is conn:
+                del self._connections[key]
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close all connections."""
+        for conn in list(self._connections.values()):
+            self._discard(conn)
+
+    def _send(self, url, headers=None):
+        """Send a GET of url; return (conn, stream_id, start)."""
+        parsed = anyhttp.urlparse(url)
+        conn = self.connection(parsed)
+        if events.active:
+            events.emit('request_start', url=url, mode='request',
+                        handler='HTTP2Batch')
+        start = time.time()
+        try:
+            stream_id = conn.request('GET', _path(parsed),
+                                     headers=anyhttp._accept_encoding(headers))
+        except Exception:
+            self._discard(conn)
+            raise
+        return (conn, stream_id, start)
+
+    def _receive(self, url, conn, stream_id, start, encoded=False):
+        """
+        Return the Response to a request sent by _send().
+
+        If encoded, a compressed body is left compressed.
+        """
+        error = response = None
+        try:
+            if stream_id is None:
+                result = conn.get_response()
+            else:
+                result = conn.get_response(stream_id)
+            headers = anyhttp._lower_headers(result.headers.items())
+            if encoded:
+                response = anyhttp.Response(
+                    result.status, headers, result.read(decode_content=False),
+                    anyhttp.compression.content_coding(headers))
+            else:
+                response = anyhttp.Response(result.status, headers,
+                                            result.read())
+            return response
+        except Exception as e:
+            error = e
+            self._discard(conn)
+            if events.active:
+                events.emit('error', url=url, handler='HTTP2Batch', error=e)
+            raise
+        finally:
+            if events.active:
+                events.emit('request_end', url=url, mode='request',
+                            handler='HTTP2Batch',
+                            elapsed=time.time() - start,
+                            bytes=len(response.body) if response else None,
+                            status=response.status if response else None,
+                            error=error)
+
+    def imap(self, func, urls, ordered=True, lookup=None, limit=None,
+             headers=None, encoded=False):
+        """
+        Fetch urls, yielding (url, error, result).
+
+        Like CurlMulti.imap.  At most limit urls, by default max_streams,
+        are in flight; responses are read in the order the requests were
+        sent.
+        """
+        limit = min(limit or self.max_streams, self.max_streams)
+        urls = iter(urls)
+        submitted = yielded = 0
+        exhausted = False
+        pending = deque()
+        backlog = {}
+
+        def receive(index, url, sent):
+            try:
+                result = func(url, self._receive(url, *sent,
+                                                 encoded=encoded))
+            except Exception as e:
+                backlog[index] = (url, e, None)
+            else:
+                backlog[index] = (url, None, result)
+
+        try:
+            while True:
+                while not exhausted and submitted - yielded < limit:
+                    try:
+                        url = next(urls)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    index = submitted
+                    submitted += 1
+
+                    if lookup:
+                        try:
+                            backlog[index] = (url, None, lookup(url))
+                            continue
+                        except KeyError:
+                            pass
+                        except Exception as e:
+                            backlog[index] = (url, e, None)
+                            continue
+
+                    try:
+                        sent = self._send(url,
+                                          headers(url) if headers else None)
+                    except Exception as e:
+                        backlog[index] = (url, e, None)
+                        continue
+                    if sent[1] is None:
+                        # HTTP/1.1: the response must be read before the
+                        # connection is used again
+                        receive(index, url, sent)
+                    else:
+                        pending.append((index, url, sent))
+
+                if ordered:
+                    ready = []
+                    while yielded + len(ready) in backlog:
+                        ready.append(backlog.pop(yielded + len(ready)))
+                else:
+                    ready = list(backlog.values())
+                    backlog.clear()
+
+                if ready:
+                    for result in ready:
+                        yielded += 1
+                        yield result
+                    continue
+
+                if yielded == submitted:
+                    break
+
+                receive(*pending.popleft())
+        finally:
+            # unread streams would be left on their connections
+            for (index, url, sent) in pending:
+                self._discard(sent[0])
@@ -0,0 +1,212 @@
+# -*- coding: utf-8  -*-
+"""Local HTTP server for measuring clients."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import gzip
+import threading
+import zlib
+
+from io import BytesIO
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+# Served by /text/CHARSET encoded with CHARSET
+sample_text = u'anyhttp \xe9t\xe9 \u20ac \u4e2d\u6587\n'
+
+
+def payload(size):
+    """Return the body served for /bytes/size."""
+    pattern = b'anyhttp local server payload\n'
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def compress(data, coding):
+    """Return data compressed with the gzip or deflate content coding."""
+    if coding == 'deflate':
+        return zlib.compress(data)
+    fp = BytesIO()
+    with gzip.GzipFile(fileobj=fp, mode='wb') as writer:
+        writer.write(data)
+    return fp.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without TCP_NODELAY,
+    # small keep-alive responses wait for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def send_body(self, body):
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'text':
+            self.send_text(parts[1])
+            return
+        if (len(parts) == 3 and parts[0] == 'compressed' and
+                parts[2].isdigit()):
+            self.send_compressed(parts[1], self.server.payload(int(parts[2])))
+            return
+        if len(parts) != 2 or parts[0] != 'bytes' or not parts[1].isdigit():
+            self.send_error(404)
+            return
+        body = self.server.payload(int(parts[1]))
+        etag = '"%d"' % len(body)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        byte_range = self.byte_range(len(body), etag)
+        if byte_range is None:
+            self.send_response(200)
+        elif not byte_range:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % len(body))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        else:
+            (first, last) = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d'
+                             % (first, last, len(body)))
+            body = body[first:last + 1]
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.send_body(body)
+
+    def byte_range(self, length, etag):
+        """
+        Return (first, last) of a satisfiable Range header.
+
+        Returns None to send the whole body, or () if the range cannot
+        be satisfied.
+        """
+        value = self.headers.get('Range', '')
+        if not value.startswith('bytes=') or ',' in value:
+            return None
+        if self.headers.get('If-Range', etag) != etag:
+            return None
+        try:
+            (first, last) = value[len('bytes='):].split('-')
+            if first:
+                first = int(first)
+                last = min(int(last), length - 1) if last else length - 1
+            else:
+                # a suffix of the body
+                first = max(0, length - int(last))
+                last = length - 1
+        except ValueError:
+            return None
+        if first > last:
+            return ()
+        return (first, last)
+
+    def send_text(self, charset):
+        try:
+            body = sample_text.encode(charset)
+        except (LookupError, UnicodeError):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=%s' % charset)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.send_body(body)
+
+    def send_compressed(self, coding, body):
+        accepted = [value.split(';')[0].strip() for value in
+                    self.headers.get('Accept-Encoding', '').split(',')]
+        if coding not in ('gzip', 'deflate'):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        if coding in accepted:
+            body = compress(body, coding)
+            self.send_header('Content-Encoding', coding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.send_body(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+
+    """
+    Keep-alive HTTP/1.1 server on 127.0.0.1, run in a daemon thread.
+
+    GET /bytes/N responds with N bytes of payload(N), or a byte range
+    of it if requested, or 304 if its ETag matches If-None-Match,
+    GET /compressed/CODING/N with payload(N) compressed with the gzip or
+    deflate CODING, if the client accepts it, and
+    GET /text/CHARSET with sample_text encoded with CHARSET.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def payload(self, size):
+        with self._lock:
+            if size not in self._payloads:
+                self._payloads[size] = payload(size)
+            return self._payloads[size]
+
+    def url(self, size):
+        """Return the url of a payload of size bytes."""
+        return 'http://127.0.0.1:%d/bytes/%d' % (self.server_address[1],
+                                                size)
+
+    def compressed_url(self, coding, size):
+        """Return the url of payload(size) compressed with coding."""
+        return 'http://127.0.0.1:%d/compressed/%s/%d' % (
+            self.server_address[1], coding, size)
+
+    def text_url(self, charset):
+        """Return the url of sample_text encoded with charset."""
+        return 'http://127.0.0.1:%d/text/%s' % (self.server_address[1],
+                                               charset)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8  -*-
+"""Pool of live connections for clients which connect to a single site."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import select
+import threading
+import time
+
+
+def close_connection(conn):
+    """Close a connection object, whatever the client calls it."""
+    for name in ('close', 'disconnect'):
+        method = getattr(conn, name, None)
+        if method:
+            try:
+                method()
+            except Exception:
+                pass
+            return
+
+
+def connection_alive(conn):
+    """
+    Check that an idle connection has not been closed by the server.
+
+    An idle keep-alive socket should have nothing to read; if it is
+    readable, the server has either closed it or sent garbage.
+    Connections which do not expose their socket are assumed alive.
+    """
+    sock = getattr(conn, 'sock', None) or getattr(conn, '_sock', None)
+    if sock is None:
+        return True
+    try:
+        fileno = sock.fileno()
+    except Exception:
+        return True
+    try:
+        readable = select.select([fileno], [], [], 0)[0]
+    except (ValueError, select.error):
+        return False
+    return not readable
+
+
+class ConnectionPool(object):
+
+    """
+    Idle connections keyed by (scheme, host, port).
+
+    Connections are checked out exclusively with acquire() and handed
+    back with release(), so a connection is never used by two requests
+    at once.  The pool itself may be shared between threads.
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=60, check=connection_alive):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check = check
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Return a live idle connection for key, or None."""
+        stale = []
+        conn = None
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                (candidate, released) = idle.pop()
+                if now - released > self.idle_timeout:
+                    stale.append(candidate)
+                    continue
+                conn = candidate
+                break
+
+        for candidate in stale:
+            close_connection(candidate)
+
+        if conn is not None and self.check and not self.check(conn):
+            close_connection(conn)
+            return self.acquire(key)
+        return conn
+
+    def release(self, key, conn):
+        """Return a connection to the pool after a successful request."""
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((conn, time.time()))
+            while len(idle) > self.max_idle:
+                evicted.append(idle.pop(0)[0])
+
+        for conn in evicted:
+            close_connection(conn)
+
+    def discard(self, conn):
+        """Close a connection which must not be reused."""
+        close_connection(conn)
+
+    def evict(self):
+        """Close all connections idle for longer than idle_timeout."""
+        stale = []
+        now = time.time()
+        with self._lock:
+            for key, idle in list(self._idle.items()):
+                keep = [(conn, released) for (conn, released) in idle
+                        if now - released <= self.idle_timeout]
+                stale += [conn for (conn, released) in idle
+                          if now - released > self.idle_timeout]
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+
+        for conn in stale:
+            close_connection(conn)
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for (conn, released) in connections:
+                close_connection(conn)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
@@ -1,35 +1,181 @@
-"""Module for clients which use Python 3 syntax."""
+"""Module for clients and APIs which use Python 3 syntax."""
+import asyncio
+import time
+from urllib.parse import urlparse
+
 import anyhttp
+from anyhttp import compression, events
+
+
+async def _closing(session):
+    """Async generator closing session as its event loop shuts down."""
+    try:
+        yield
+    finally:
+        await session.close()
 
 
 class aiohttp(anyhttp.Http):
 
     """Wrapper for aiohttp."""
 
-    def raw_worker(self, url):
-        response = yield from self.package.request('GET', url)
-        return (yield from response.read())
+    def __init__(self, package):
+        super(aiohttp, self).__init__(package)
+        self._session = None
+        self._session_loop = None
+        self._closing = None
+
+    async def _get_session(self):
+        loop = asyncio.get_event_loop()
+        if self._session_loop is not loop:
+            # a session is bound to the loop it was made on
+            await self.aclose()
+        if self._session is None or self._session.closed:
+            self._session = self.package.ClientSession()
+            self._session_loop = loop
+            # loop.shutdown_asyncgens(), as called by asyncio.run(),
+            # closes the session while the loop can still run
+            self._closing = _closing(self._session)
+            await self._closing.__anext__()
+        return self._session
+
+    async def aclose(self):
+        """Close the session, and its connections."""
+        session, self._session = self._session, None
+        self._session_loop = self._closing = None
+        if session is None or session.closed:
+            return
+        try:
+            await session.close()
+        except RuntimeError:
+            # the connections of a closed loop cannot be closed on it;
+            # the session is marked closed all the same
+            pass
+
+    async def araw(self, url):
+        return (await self.araw_text(url))[0]
+
+    async def araw_text(self, url):
+        if not hasattr(self.package, 'ClientSession'):
+            response = await self.package.request('GET', url)
+            return await self._read_text(response)
+
+        session = await self._get_session()
+        async with session.get(url) as response:
+            return await self._read_text(response)
+
+    @staticmethod
+    async def _read_text(response):
+        return (await response.read(),
+                anyhttp.charset_of(response.headers.get('Content-Type')))
 
     def raw(self, url):
-        import asyncio
         loop = asyncio.get_event_loop()
-        return loop.run_until_complete(self.raw_worker(url))
+        return loop.run_until_complete(self.araw(url))
 
 
 class yieldfrom(anyhttp.HostPortConnectionClass):
 
-    """Wrapper for yieldfrom."""
+    """Wrapper for yieldfrom, which does not decompress bodies."""
 
     cls = 'HTTPConnection'
 
-    def raw_worker(self, url):
-        path = self.get_path(url)
-        r = (yield from self.http.request('GET', path))
-        result = (yield from self.http.getresponse())
-        return (yield from result.read())
+    async def raw_worker(self, http, url):
+        return (await self.text_worker(http, url))[0]
 
-    def raw(self, url):
-        self.cls_init(url)
-        import asyncio
+    async def text_worker(self, http, url):
+        """Return the body and the charset of its Content-Type."""
+        path = urlparse(url).path
+        await http.request('GET', path,
+                           headers=anyhttp._accept_encoding(None))
+        result = await http.getresponse()
+        coding = compression.content_coding(
+            {'content-encoding': result.getheader('Content-Encoding')})
+        return (compression.decode_content(await result.read(), coding),
+                anyhttp.charset_of(result.getheader('Content-Type')))
+
+    def fetch(self, url):
         loop = asyncio.get_event_loop()
-        return loop.run_until_complete(self.raw_worker(url))
+        return loop.run_until_complete(self.raw_worker(self.http, url))
+
+    async def araw(self, url):
+        return (await self.araw_text(url))[0]
+
+    async def araw_text(self, url):
+        # Concurrent coroutines share this instance, so the connection
+        # is kept local rather than in self.http.
+        key = self.get_pool_key(url)
+        http = self.pool.acquire(key)
+        reused = http is not None
+        while True:
+            if http is None:
+                parsed = urlparse(url)
+                http = self.cls(parsed.hostname, parsed.port)
+            try:
+                result = await self.text_worker(http, url)
+            except Exception:
+                self.pool.discard(http)
+                if not reused:
+                    raise
+                http = None
+                reused = False
+            else:
+                self.pool.release(key, http)
+                return result
+
+
+async def _afetch(http, text_or_binary, url):
+    """Await the body, or for text the body and its charset."""
+    fetch = http.araw_text if text_or_binary == 'text' else http.araw
+    if not events.active:
+        return await fetch(url)
+
+    handler = anyhttp._handler_name(http)
+    events.emit('request_start', url=url, mode=text_or_binary,
+                handler=handler)
+    start = time.time()
+    try:
+        raw = await fetch(url)
+    except Exception as e:
+        events.emit('error', url=url, handler=handler, error=e)
+        events.emit('request_end', url=url, mode=text_or_binary,
+                    handler=handler, elapsed=time.time() - start,
+                    bytes=None, status=None, error=e)
+        raise
+    events.emit('request_end', url=url, mode=text_or_binary, handler=handler,
+                elapsed=time.time() - start,
+                bytes=len(raw[0] if text_or_binary == 'text' else raw),
+                status=None, error=None)
+    return raw
+
+
+async def _aget(cache, text_or_binary, url):
+    http = anyhttp._get_http()
+    if cache:
+        # checks the status, revalidates and coalesces as the sync API
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, anyhttp._get_cached, cache, text_or_binary, url, http)
+
+    raw = await _afetch(http, text_or_binary, url)
+    if text_or_binary == 'text':
+        return http._text(*raw)
+    return raw
+
+
+async def aget_text(url, cache=None):
+    """
+    Get unicode resource from a coroutine.
+
+    Clients without asyncio support are run in an executor thread.
+    """
+    return await _aget(cache, 'text', url)
+
+
+async def aget_binary(url, cache=None):
+    """
+    Get binary resource from a coroutine.
+
+    Clients without asyncio support are run in an executor thread.
+    """
+    return await _aget(cache, 'binary', url)
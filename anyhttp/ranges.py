@@ -0,0 +1,249 @@
+# -*- coding: utf-8  -*-
+"""
+Parallel download of large bodies in byte ranges.
+
+The first range is requested with a Range header.  If the response is
+206 Partial Content with a Content-Range giving the length, the rest of
+the body is split into ranges, which are fetched concurrently by worker
+threads, each using its own clone() of the handler, and written into a
+buffer or file preallocated to the length.  Otherwise the response is
+the whole body, which is used as is.
+
+Where the handler can send a HEAD request, it is sent first; if the
+response does not have Accept-Ranges: bytes, the body is streamed into
+the target with write_raw(), rather than requested whole.
+
+A download may start part way through the body, to resume an
+interrupted one, with the validator of the earlier response sent as
+If-Range; if the body has changed, the server sends all of it again.
+"""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import threading
+
+import anyhttp
+from anyhttp.workers import imap
+
+# Size of the ranges requested
+default_part_size = 8 * 1024 * 1024
+
+
+def parse_content_range(value):
+    """
+    Return (first, last, length) of a Content-Range header value.
+
+    length is None if the server did not give it.  Returns None if the
+    value is not a byte range.
+    """
+    try:
+        (unit, spec) = value.strip().split(None, 1)
+        (span, length) = spec.split('/')
+        (first, last) = span.split('-')
+        if unit.lower() != 'bytes':
+            return None
+        return (int(first), int(last),
+                None if length.strip() == '*' else int(length))
+    except (AttributeError, ValueError):
+        return None
+
+
+def split(start, length, part_size=default_part_size):
+    """Return the (first, last) byte ranges from start to length."""
+    return [(first, min(first + part_size, length) - 1)
+            for first in range(start, length, part_size)]
+
+
+def _request(http, url, headers=None):
+    return anyhttp._fetch(http, 'request', url, http.request, url,
+                          headers=headers)
+
+
+def _head(http, url):
+    return anyhttp._fetch(http, 'request', url, http.head, url,
+                          headers={'Accept-Encoding': 'identity'})
+
+
+def accepts_ranges(headers):
+    """Return whether headers advertise byte ranges of the body."""
+    return ('bytes' in headers.get('accept-ranges', '').lower() and
+            headers.get('content-encoding', 'identity') == 'identity')
+
+
+def validator_of(headers):
+    """Return the strong ETag, or else the Last-Modified, of headers."""
+    validator = headers.get('etag')
+    if not validator or validator.startswith('W/'):
+        validator = headers.get('last-modified')
+    return validator
+
+
+def _range_headers(first, last, validator=None):
+    # ranges of a compressed body could not be assembled
+    headers = {'Range': 'bytes=%d-%d' % (first, last),
+               'Accept-Encoding': 'identity'}
+    if validator:
+        headers['If-Range'] = validator
+    return headers
+
+
+class RangeError(IOError):
+
+    """A range response does not match the range requested."""
+
+
+class _Buffer(object):
+
+    """Target assembling the body in a bytearray."""
+
+    def __init__(self):
+        self.data = None
+
+    def allocate(self, length):
+        self.data = bytearray(length)
+
+    def write(self, offset, data):
+        # disjoint slices of the same length never resize the buffer
+        self.data[offset:offset + len(data)] = data
+
+
+class _Writer(object):
+
+    """File object appending to a target."""
+
+    def __init__(self, target):
+        self.target = target
+        self.length = 0
+
+    def write(self, data):
+        self.target.write(self.length, data)
+        self.length += len(data)
+
+
+class _File(object):
+
+    """Target assembling the body in a binary file object."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.start = fp.tell()
+        self._lock = threading.Lock()
+
+    def allocate(self, length):
+        self.fp.truncate(self.start + length)
+
+    def write(self, offset, data):
+        with self._lock:
+            self.fp.seek(self.start + offset)
+            self.fp.write(data)
+
+
+def fetch(http, url, target, workers=4, part_size=default_part_size,
+          start=0, validator=None, progress=None):
+    """
+    Fetch url into target in ranges; return (length, headers).
+
+    headers are those of the first response.  target.allocate(length)
+    is called once, then target.write(offset, data) for each part, from
+    worker threads.  Raises RangeError if a range response is not the
+    range requested, such as when the resource changes during the
+    download.
+
+    If start is set, the body before it is already in target, and was
+    received with validator.  progress(received, headers) is called as
+    the body up to received has been written, for each range in order.
+    """
+    probe = _head(http, url)
+    if (probe is not None and probe.status == 200 and
+            not accepts_ranges(probe.headers)):
+        return _stream(http, url, target, probe.headers, progress)
+
+    response = _request(http, url, _range_headers(
+        start, start + part_size - 1, validator))
+    content_range = parse_content_range(
+        response.headers.get('content-range', ''))
+    if (response.status != 206 or not content_range or
+            content_range[0] != start or content_range[2] is None or
+            response.headers.get('content-encoding', 'identity') !=
+            'identity'):
+        if response.status not in (None, 200):
+            # an error, or a range which is not the start of the body
+            response = _request(http, url)
+            if response.status not in (None, 200):
+                raise IOError('HTTP status %s for %s'
+                              % (response.status, url))
+        target.allocate(len(response.body))
+        target.write(0, response.body)
+        return (len(response.body), response.headers)
+
+    length = content_range[2]
+    # a strong validator ensures all the ranges are of the same body
+    validator = validator_of(response.headers) or validator
+    headers = response.headers
+    target.allocate(length)
+    target.write(start, response.body)
+    if progress:
+        progress(start + len(response.body), headers)
+
+    def fetch_range(http, byte_range):
+        (first, last) = byte_range
+        response = _request(http, url,
+                            _range_headers(first, last, validator))
+        content_range = parse_content_range(
+            response.headers.get('content-range', ''))
+        if (response.status != 206 or not content_range or
+                content_range[:2] != byte_range or
+                len(response.body) != last - first + 1):
+            raise RangeError('%s: range %d-%d not received (status %s)'
+                             % (url, first, last, response.status))
+        target.write(first, response.body)
+
+    for (byte_range, error, result) in imap(
+            fetch_range, split(start + len(response.body), length, part_size),
+            workers=workers, ordered=progress is not None,
+            context=http.clone):
+        if error:
+            raise error
+        if progress:
+            progress(byte_range[1] + 1, headers)
+    return (length, headers)
+
+
+def _stream(http, url, target, headers, progress=None):
+    """Write the whole body of url into target as it is received."""
+    if progress:
+        # the body already in target is overwritten
+        progress(0, headers)
+    target.allocate(0)
+    writer = _Writer(target)
+    anyhttp._write_raw(http, url, writer, None)
+    return (writer.length, headers)
+
+
+def request(http, url, workers=4, part_size=default_part_size):
+    """
+    Return a Response with the body of url, fetched in ranges.
+
+    The body is a bytearray, and the headers are those of the first
+    response.
+    """
+    target = _Buffer()
+    (length, headers) = fetch(http, url, target, workers, part_size)
+    return anyhttp.Response(200, headers, target.data)
+
+
+def get(http, url, workers=4, part_size=default_part_size):
+    """Return the body of url, fetched in ranges, as a bytearray."""
+    return request(http, url, workers, part_size).body
+
+
+def get_to_file(http, url, fp, workers=4, part_size=default_part_size):
+    """
+    Write the body of url, fetched in ranges, to fp; return its length.
+
+    fp must be a seekable file object opened for binary writing; the
+    body is written from its current position.
+    """
+    return fetch(http, url, _File(fp), workers, part_size)[0]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8  -*-
+"""Ranking of HTTP client packages by a benchmark against a local server."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import json
+import os
+import sys
+import time
+
+import anyhttp
+from anyhttp.caches import write_file
+
+ranking_file = os.environ.get('ANYHTTP_RANKING') or os.path.join(
+    os.path.expanduser('~'), '.cache', 'anyhttp', 'ranking.json')
+
+_loaded = {}
+
+
+def _python():
+    return '%d.%d' % sys.version_info[:2]
+
+
+def load_ranking(filename=None):
+    """
+    Return package names, fastest first, from the last saved benchmark.
+
+    Returns [] if there is none for this version of Python.
+    """
+    filename = filename or ranking_file
+    if filename not in _loaded:
+        try:
+            with open(filename) as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            data = {}
+        if data.get('python') == _python():
+            _loaded[filename] = data.get('ranking', [])
+        else:
+            _loaded[filename] = []
+    return _loaded[filename]
+
+
+def save_ranking(results, filename=None):
+    """Save benchmark results, a dict of package name to seconds."""
+    filename = filename or ranking_file
+    data = {
+        'python': _python(),
+        'time': time.time(),
+        'results': results,
+        'ranking': sorted(results, key=results.get),
+    }
+    write_file(filename,
+               lambda fp: fp.write(json.dumps(data, indent=2).encode('utf-8')))
+    _loaded[filename] = data['ranking']
+
+
+def measure(http, urls, expected, rounds=10):
+    """
+    Return the best time in seconds of rounds of fetching urls with http.
+
+    Raises ValueError if a response differs from expected.
+    """
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        for (url, body) in zip(urls, expected):
+            if http.get_binary(url) != body:
+                raise ValueError('%s returned a wrong body' % http)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(packages=None, sizes=(1024, 256 * 1024), rounds=10,
+              save=True, filename=None):
+    """
+    Time fetching payloads of sizes with each package.
+
+    packages are names in anyhttp.package_handlers; by default, those
+    already imported.  Packages which fail are left out.
+    Returns a dict of package name to seconds, which is saved for
+    choose_package() if save is True.
+    """
+    # the server is only imported to benchmark, not to load the ranking
+    from anyhttp.localserver import LocalServer
+    if packages is None:
+        packages = anyhttp.known_http_packages & set(sys.modules)
+    results = {}
+    with LocalServer() as server:
+        urls = [server.url(size) for size in sizes]
+        expected = [server.payload(size) for size in sizes]
+        for name in sorted(packages):
+            try:
+                __import__(name)
+                http = anyhttp.package_handlers[name](sys.modules[name])
+                results[name] = measure(http, urls, expected, rounds)
+            except Exception as e:
+                if anyhttp.verbose:
+                    print('benchmark: %s failed: %r' % (name, e))
+    if save and results:
+        save_ranking(results, filename)
+    return results
+
+
+def main(argv=None):
+    """Command line interface: benchmark [PACKAGE...]."""
+    argv = sys.argv[1:] if argv is None else argv
+    results = benchmark(argv or None)
+    for name in sorted(results, key=results.get):
+        print('%-24s %.4fs' % (name, results[name]))
+    print('saved to %s' % ranking_file)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
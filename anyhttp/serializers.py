@@ -1,20 +1,44 @@
+import json
+
+import anyhttp.compression as compression
+
 # I should be able to do this, but it's apparently broken.
 # from vlermv.serializers import identity as text
 
 class _serializer:
     '''
     Hack because vlermv insists on str type.
+
+    If codec is set, responses are compressed with it.  Compressed
+    responses are loaded whatever the codec is.
     '''
+    codec = None
+
     @classmethod
     def dump(Class, obj, old_fp):
         error, response = obj
         if error:
             raise error
+        if Class.codec:
+            if not Class.b:
+                response = response.encode('utf-8')
+            with open(old_fp.name, 'wb') as fp:
+                writer = compression.Writer(fp, Class.codec)
+                writer.write(response)
+                writer.finish()
+            return
         with open(old_fp.name, 'w' + Class.b) as fp:
             fp.write(response)
 
     @classmethod
     def load(Class, old_fp):
+        with open(old_fp.name, 'rb') as fp:
+            if compression.codec_of(fp.read(compression.header_size)):
+                fp.seek(0)
+                response = compression.Reader(fp).read()
+                if not Class.b:
+                    response = response.decode('utf-8')
+                return None, response
         with open(old_fp.name, 'r' + Class.b) as fp:
             response = fp.read()
         return None, response
@@ -24,3 +48,34 @@ class text(_serializer):
 
 class binary(_serializer):
     b = 'b'
+
+def compressed(serializer, codec):
+    '''
+    Return a serializer like serializer which compresses with codec.
+    '''
+    if not codec:
+        return serializer
+    compression.check_codec(codec)
+
+    class compressed_serializer(serializer):
+        pass
+    compressed_serializer.codec = codec
+    return compressed_serializer
+
+class headers(_serializer):
+    '''
+    Response headers, as JSON.
+    '''
+    @classmethod
+    def dump(Class, obj, old_fp):
+        error, response = obj
+        if error:
+            raise error
+        with open(old_fp.name, 'w') as fp:
+            json.dump(response, fp)
+
+    @classmethod
+    def load(Class, old_fp):
+        with open(old_fp.name, 'r') as fp:
+            response = json.load(fp)
+        return None, response
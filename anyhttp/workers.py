@@ -0,0 +1,198 @@
+# -*- coding: utf-8  -*-
+"""Bounded pool of worker threads."""
+#
+# (C) John Vandenberg, 2015
+#
+# Distributed under the terms of the MIT license.
+#
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def imap(func, items, workers=4, ordered=True, context=None, lookup=None):
+    """
+    Apply func to items in worker threads, yielding (item, error, result).
+
+    Exceptions raised by func are captured per item as error.
+    If ordered is False, results are yielded as they complete.
+    At most 2 * workers items are in flight, so items may be a long or
+    unbounded iterator.
+
+    context is called once in each worker thread, and its result is
+    passed to func as the first argument.  lookup is called in the
+    calling thread before an item is queued; unless it raises KeyError,
+    its return value is the result and the item is not queued.  Other
+    exceptions raised by lookup are captured as error, like those of func.
+    Raises ValueError if workers is less than 1.
+    """
+    if workers < 1:
+        raise ValueError('workers must be at least 1, not %r' % workers)
+    tasks = queue.Queue()
+    results = queue.Queue()
+
+    def worker():
+        value = error = None
+        if context:
+            try:
+                value = context()
+            except Exception as e:
+                error = e
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            (index, item) = task
+            if error:
+                results.put((index, (item, error, None)))
+                continue
+            try:
+                result = (item, None, func(value, item))
+            except Exception as e:
+                result = (item, e, None)
+            results.put((index, result))
+
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    items = iter(items)
+    limit = 2 * workers
+    submitted = yielded = 0
+    exhausted = False
+    backlog = {}
+    try:
+        while True:
+            while not exhausted and submitted - yielded < limit:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                if lookup:
+                    try:
+                        backlog[submitted] = (item, None, lookup(item))
+                        submitted += 1
+                        continue
+                    except KeyError:
+                        pass
+                    except Exception as e:
+                        backlog[submitted] = (item, e, None)
+                        submitted += 1
+                        continue
+
+                tasks.put((submitted, item))
+                submitted += 1
+
+            if ordered:
+                ready = []
+                while yielded + len(ready) in backlog:
+                    ready.append(backlog.pop(yielded + len(ready)))
+            else:
+                ready = list(backlog.values())
+                backlog.clear()
+
+            if ready:
+                for result in ready:
+                    yielded += 1
+                    yield result
+                continue
+
+            if yielded == submitted:
+                break
+
+            (index, result) = results.get()
+            backlog[index] = result
+    finally:
+        while True:
+            try:
+                tasks.get_nowait()
+            except queue.Empty:
+                break
+        for thread in threads:
+            tasks.put(None)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = self.error = None
+        self.cancelled = False
+
+
+class SingleFlight(object):
+
+    """
+    Concurrent calls for the same key, sharing one call.
+
+    While a call for a key is running, do() in other threads waits for
+    it and returns its result or raises its error, instead of calling
+    func again.
+
+    A call may also be run by other means, such as a batch of transfers,
+    between start() and end(); do() waits for it the same way.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        """
+        Start a call for key; return it, or None if one is running.
+
+        The call must be ended with end().
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+            call = self._calls[key] = _Call()
+            return call
+
+    def end(self, key, call, result=None, error=None, cancelled=False):
+        """
+        End a call started with start().
+
+        If cancelled, calls waiting for it call their func instead.
+        """
+        call.result = result
+        call.error = error
+        call.cancelled = cancelled
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    def do(self, key, func, *args, **kwargs):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            call.done.wait()
+            if call.cancelled:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.end(key, call, error=e)
+            raise
+        self.end(key, call, result=result)
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
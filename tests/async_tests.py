@@ -0,0 +1,137 @@
+"""asyncio API tests."""
+import shutil
+import sys
+import tempfile
+import unittest
+
+import anyhttp
+from anyhttp.localserver import LocalServer, payload
+
+if sys.version_info < (3, 5):
+    raise unittest.SkipTest('asyncio API requires Python 3.5')
+
+import asyncio
+
+
+class FakeHttp(anyhttp.Http):
+
+    def raw(self, url):
+        return url.encode('ascii')
+
+    def raw_text(self, url):
+        if url == 'gb18030':
+            return (u'\u4e2d\u6587'.encode('gb18030'), 'gb18030')
+        return (self.raw(url), None)
+
+
+class FakeResponse(object):
+
+    headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def read(self):
+        return b'body'
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def get(self, url):
+        return FakeResponse()
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeAiohttp(object):
+
+    ClientSession = FakeSession
+
+
+@unittest.skipUnless(hasattr(asyncio, 'run'), 'asyncio.run requires 3.7')
+class TestAiohttp(unittest.TestCase):
+
+    def test_session_per_loop(self):
+        from anyhttp.py3_clients import aiohttp
+        http = aiohttp(FakeAiohttp)
+        sessions = []
+        for i in range(2):
+            self.assertEqual(asyncio.run(http.araw('a')), b'body')
+            sessions.append(http._session)
+        # each loop closes its session as it shuts down
+        self.assertIsNot(sessions[0], sessions[1])
+        self.assertTrue(all(session.closed for session in sessions))
+
+
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        anyhttp.http = FakeHttp(None)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        anyhttp.http = None
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_aget_binary(self):
+        result = self.loop.run_until_complete(anyhttp.aget_binary('a'))
+        self.assertEqual(result, b'a')
+
+    def test_aget_text_concurrent(self):
+        urls = ['u%d' % i for i in range(20)]
+        tasks = [anyhttp.aget_text(url) for url in urls]
+        results = self.loop.run_until_complete(asyncio.gather(*tasks))
+        self.assertEqual(results, urls)
+
+    def test_aget_text_charset(self):
+        result = self.loop.run_until_complete(anyhttp.aget_text('gb18030'))
+        self.assertEqual(result, u'\u4e2d\u6587')
+
+
+class TestAsyncCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        try:
+            import urllib.request as package
+        except ImportError:
+            import urllib2 as package
+        anyhttp.http = anyhttp.urlopen(package)
+        self.directory = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.server.stop()
+        anyhttp.http = None
+        anyhttp._caches.pop(self.directory, None)
+        shutil.rmtree(self.directory)
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_error_status(self):
+        url = 'http://127.0.0.1:%d/missing' % self.server.server_address[1]
+        self.assertRaises(anyhttp.StatusError, self.loop.run_until_complete,
+                          anyhttp.aget_binary(url, cache=self.directory))
+        # the error page is not cached
+        self.assertRaises(KeyError, anyhttp._get_cache(self.directory).load,
+                          'binary', url)
+
+    def test_cached(self):
+        url = self.server.url(1000)
+        for i in range(2):
+            self.assertEqual(self.loop.run_until_complete(
+                anyhttp.aget_binary(url, cache=self.directory)),
+                payload(1000))
+        headers = anyhttp._get_cache(self.directory).load_headers(
+            'binary', url)
+        self.assertEqual(headers['etag'], '"1000"')
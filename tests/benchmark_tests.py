@@ -0,0 +1,39 @@
+"""Benchmark harness tests."""
+import unittest
+
+from anyhttp import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([3], 0.99), 3)
+        self.assertIsNone(benchmark.percentile([], 0.5))
+
+    def test_run(self):
+        report = benchmark.run([benchmark.baseline], sizes=[100],
+                               concurrency=[1, 2], requests=3,
+                               isolate=False)
+        results = report['results']
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertEqual(result['errors'], 0)
+            self.assertEqual(result['size'], 100)
+            self.assertGreater(result['bytes_per_second'], 0)
+        self.assertEqual(set((r['connection'], r['concurrency'])
+                             for r in results),
+                         set([('cold', 1), ('warm', 1),
+                              ('cold', 2), ('warm', 2)]))
+        self.assertTrue(benchmark.format_table(report))
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_lazy_modules(self):
+        result = benchmark.import_time(runs=1)
+        self.assertIn('anyhttp', result['modules'])
+        for module in benchmark.lazy_modules:
+            self.assertNotIn(module, result['modules'])
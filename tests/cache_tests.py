@@ -1,4 +1,4 @@
-import os, unittest
+import io, os, shutil, tempfile, time, unittest, zlib
 
 import anyhttp
 
@@ -34,3 +34,353 @@ class TestCacheText(CacheBase, unittest.TestCase):
 class TestCacheBinary(CacheBase, unittest.TestCase):
     body = 'Body goes here.'.encode('ascii')
     text_or_binary = 'binary'
+
+    def test_get_to_file(self):
+        anyhttp.http = anyhttp._get_http(require_http = False)
+        try:
+            fp = io.BytesIO()
+            length = anyhttp.get_to_file(self.url, fp, cache = self.cache_dir)
+        finally:
+            anyhttp.http = None
+        self.assertEqual(fp.getvalue(), self.body)
+        self.assertEqual(length, len(self.body))
+
+class TestMemoryCache(unittest.TestCase):
+    def test_lru(self):
+        cache = anyhttp.MemoryCache(max_bytes = 1000)
+        cache.set(('binary', 'a'), b'a' * 400)
+        cache.set(('binary', 'b'), b'b' * 400)
+        cache.get(('binary', 'a'))
+        cache.set(('binary', 'c'), b'c' * 400)
+        self.assertEqual(cache.get(('binary', 'a')), b'a' * 400)
+        self.assertRaises(KeyError, cache.get, ('binary', 'b'))
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertLessEqual(cache.size, 1000)
+
+    def test_too_large(self):
+        cache = anyhttp.MemoryCache(max_bytes = 10)
+        cache.set(('binary', 'a'), b'a' * 400)
+        self.assertEqual(len(cache), 0)
+
+    def test_replaced_too_large(self):
+        cache = anyhttp.MemoryCache(max_bytes = 10)
+        cache.set(('binary', 'a'), b'old')
+        cache.set(('binary', 'a'), b'a' * 400)
+        self.assertRaises(KeyError, cache.get, ('binary', 'a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_size(self):
+        cache = anyhttp.MemoryCache(max_bytes = 1000)
+        cache.set(('binary', 'a'), memoryview(b'a' * 400))
+        cache.set(('binary', 'b'), bytearray(400))
+        self.assertEqual(cache.size, 800)
+        cache.set(('binary', 'c'), memoryview(b'c' * 400))
+        self.assertRaises(KeyError, cache.get, ('binary', 'a'))
+
+class TestMemoryCacheTier(TestCacheBinary):
+    def setUp(self):
+        super(TestMemoryCacheTier, self).setUp()
+        anyhttp.memory_cache = anyhttp.MemoryCache()
+
+    def tearDown(self):
+        anyhttp.memory_cache = None
+
+    def test_memory_hit(self):
+        self.test_read_cache()
+        os.remove(os.path.join(self.cache_dir, self.text_or_binary, self.url))
+        self.test_read_cache()
+        self.assertEqual(anyhttp.memory_cache.stats()['hits'], 1)
+
+class TestDirectoryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_max_age(self):
+        cache = anyhttp.DirectoryCache(self.cache_dir, max_age = 60)
+        cache.dump('binary', 'a', b'a')
+        self.assertEqual(cache.load('binary', 'a')[0], b'a')
+        filename = cache.filename('binary', 'a')
+        old = time.time() - 120
+        os.utime(filename, (old, old))
+        self.assertRaises(KeyError, cache.load, 'binary', 'a')
+        self.assertEqual(cache.load('binary', 'a', max_age = 300)[0], b'a')
+
+    def test_max_bytes(self):
+        cache = anyhttp.DirectoryCache(self.cache_dir, max_bytes = 250)
+        for name in 'abc':
+            cache.dump('binary', name, name.encode('ascii') * 100)
+            filename = cache.filename('binary', name)
+            old = time.time() - 100
+            os.utime(filename, (old, old))
+        self.assertRaises(KeyError, cache.load, 'binary', 'a')
+        self.assertEqual(cache.load('binary', 'c')[0], b'c' * 100)
+
+    def test_lru(self):
+        cache = anyhttp.DirectoryCache(self.cache_dir, max_bytes = 250)
+        for name in 'ab':
+            cache.dump('binary', name, name.encode('ascii') * 100)
+            filename = cache.filename('binary', name)
+            old = time.time() - 100
+            os.utime(filename, (old, old))
+        cache.load('binary', 'a')
+        cache.dump('binary', 'c', b'c' * 100)
+        self.assertRaises(KeyError, cache.load, 'binary', 'b')
+        self.assertEqual(cache.load('binary', 'a')[0], b'a' * 100)
+
+    def test_mmap(self):
+        cache = anyhttp.DirectoryCache(self.cache_dir, use_mmap = True)
+        cache.dump('binary', 'a', b'a' * 100)
+        cache.dump('text', 'a', u'a')
+        response = cache.load('binary', 'a')[0]
+        self.assertIsInstance(response, memoryview)
+        self.assertTrue(response.readonly)
+        self.assertEqual(response, b'a' * 100)
+        self.assertEqual(cache.load('text', 'a')[0], u'a')
+
+    def test_compress(self):
+        old = anyhttp.DirectoryCache(self.cache_dir)
+        old.dump('text', 'old', u'old')
+        cache = anyhttp.DirectoryCache(self.cache_dir, compress = 'zlib')
+        cache.dump('text', 'a', u'caf\xe9' * 100)
+        cache.dump('binary', 'a', b'a' * 1000)
+        cache.write('binary', 'b', lambda fp: fp.write(b'b' * 1000))
+        self.assertLess(os.path.getsize(cache.filename('binary', 'a')), 100)
+        self.assertEqual(cache.load('text', 'a')[0], u'caf\xe9' * 100)
+        self.assertEqual(cache.load('text', 'old')[0], u'old')
+        with cache.open('binary', 'b') as fp:
+            self.assertEqual(fp.read(), b'b' * 1000)
+        self.assertEqual(old.load('binary', 'a')[0], b'a' * 1000)
+
+    def test_dump_codec(self):
+        body = zlib.compress(b'a' * 1000)
+        cache = anyhttp.DirectoryCache(self.cache_dir, compress = 'zlib')
+        cache.dump('binary', 'a', body, codec = 'deflate')
+        self.assertEqual(os.path.getsize(cache.filename('binary', 'a')),
+                         len(body) + 5)
+        self.assertEqual(cache.load('binary', 'a')[0], b'a' * 1000)
+        with cache.open('binary', 'a') as fp:
+            self.assertEqual(fp.read(), b'a' * 1000)
+
+    def test_read_chunks(self):
+        body = os.urandom(300 * 1024)
+        cache = anyhttp.DirectoryCache(self.cache_dir, compress = 'zlib')
+        cache.dump('binary', 'a', body)
+        with cache.open('binary', 'a') as fp:
+            self.assertEqual(fp.read(3), body[:3])
+            self.assertEqual(fp.read(100000), body[3:100003])
+            self.assertEqual(fp.read(), body[100003:])
+            self.assertEqual(fp.read(), b'')
+
+    def test_scan(self):
+        for name in 'ab':
+            anyhttp.DirectoryCache(self.cache_dir).dump(
+                'binary', name, name.encode('ascii') * 100)
+        cache = anyhttp.DirectoryCache(self.cache_dir, max_bytes = 250)
+        cache.dump('binary', 'c', b'c' * 100)
+        self.assertRaises(KeyError, cache.load, 'binary', 'a')
+        self.assertEqual(cache.load('binary', 'b')[0], b'b' * 100)
+
+class TestPackCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'cache.pack')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_dump_load(self):
+        cache = anyhttp.PackCache(self.path)
+        cache.dump('text', 'a', u'caf\xe9', headers = {'etag': '"1"'})
+        cache.dump('binary', 'a', b'\x00\x01')
+        cache.close()
+        cache = anyhttp.PackCache(self.path)
+        self.assertEqual(cache.load('text', 'a')[0], u'caf\xe9')
+        self.assertEqual(cache.load('binary', 'a')[0], b'\x00\x01')
+        self.assertEqual(cache.load_headers('text', 'a'), {'etag': '"1"'})
+        self.assertRaises(KeyError, cache.load, 'binary', 'b')
+        cache.close()
+
+    def test_max_age(self):
+        cache = anyhttp.PackCache(self.path, max_age = 60)
+        cache.dump('binary', 'a', b'a')
+        cache._index.execute('UPDATE entries SET mtime = ?',
+                             (time.time() - 120, ))
+        self.assertRaises(KeyError, cache.load, 'binary', 'a')
+        self.assertEqual(cache.load('binary', 'a', stale = True)[0], b'a')
+        cache.touch('binary', 'a')
+        self.assertEqual(cache.load('binary', 'a')[0], b'a')
+        cache.close()
+
+    def test_write_open(self):
+        cache = anyhttp.PackCache(self.path)
+        cache.write('binary', 'a', lambda fp: fp.write(b'abc' * 1000))
+        with cache.open('binary', 'a') as fp:
+            self.assertEqual(fp.read(3), b'abc')
+            self.assertEqual(len(fp.read()), 2997)
+        cache.close()
+
+    def test_mmap(self):
+        cache = anyhttp.PackCache(self.path, use_mmap = True)
+        cache.dump('binary', 'a', b'a' * 100)
+        first = cache.load('binary', 'a')[0]
+        cache.dump('binary', 'b', b'b' * 100)
+        second = cache.load('binary', 'b')[0]
+        self.assertIsInstance(second, memoryview)
+        self.assertEqual(first, b'a' * 100)
+        self.assertEqual(second, b'b' * 100)
+        cache.compact()
+        self.assertEqual(cache.load('binary', 'b')[0], b'b' * 100)
+        cache.close()
+
+    def test_compress(self):
+        cache = anyhttp.PackCache(self.path, compress = 'lzma')
+        cache.dump('text', 'a', u'caf\xe9' * 1000)
+        cache.write('binary', 'b', lambda fp: fp.write(b'b' * 1000))
+        self.assertLess(os.path.getsize(self.path), 1000)
+        cache.close()
+        cache = anyhttp.PackCache(self.path, use_mmap = True)
+        self.assertEqual(cache.load('text', 'a')[0], u'caf\xe9' * 1000)
+        self.assertEqual(cache.load('binary', 'b')[0], b'b' * 1000)
+        with cache.open('binary', 'b') as fp:
+            self.assertEqual(fp.read(10), b'b' * 10)
+        cache.close()
+
+    def test_dump_codec(self):
+        body = zlib.compress(b'a' * 1000)
+        cache = anyhttp.PackCache(self.path, use_mmap = True)
+        cache.dump('binary', 'a', body, codec = 'deflate')
+        self.assertEqual(os.path.getsize(self.path), len(body) + 5)
+        self.assertEqual(cache.load('binary', 'a')[0], b'a' * 1000)
+        cache.close()
+
+    def test_compact(self):
+        cache = anyhttp.PackCache(self.path)
+        for i in range(3):
+            cache.dump('binary', 'a', b'a' * 100)
+        cache.dump('binary', 'b', b'b' * 100)
+        self.assertEqual(cache.compact(), 200)
+        self.assertEqual(os.path.getsize(self.path), 200)
+        self.assertEqual(cache.load('binary', 'a')[0], b'a' * 100)
+        self.assertEqual(cache.load('binary', 'b')[0], b'b' * 100)
+        cache.close()
+
+    def interrupted_compact(self, fail):
+        cache = anyhttp.PackCache(self.path)
+        for i in range(3):
+            cache.dump('binary', 'a', b'a' * 100)
+        cache.dump('binary', 'b', b'b' * 100)
+        replace_file = anyhttp.caches.replace_file
+        calls = []
+
+        def interrupt(source, filename):
+            calls.append(filename)
+            if len(calls) == fail:
+                raise KeyboardInterrupt
+            replace_file(source, filename)
+
+        anyhttp.caches.replace_file = interrupt
+        try:
+            self.assertRaises(KeyboardInterrupt, cache.compact)
+        finally:
+            anyhttp.caches.replace_file = replace_file
+        self.assertEqual(cache.load('binary', 'a')[0], b'a' * 100)
+        self.assertEqual(cache.load('binary', 'b')[0], b'b' * 100)
+        self.assertFalse(os.path.exists(self.path + '.compact'))
+        self.assertFalse(os.path.exists(self.path + '.idx.compact'))
+        cache.close()
+
+    def test_compact_interrupted(self):
+        # the new index is not in place
+        self.interrupted_compact(1)
+        self.assertEqual(os.path.getsize(self.path), 400)
+
+    def test_compact_interrupted_pack(self):
+        # the new index is in place, and the new pack is not
+        self.interrupted_compact(2)
+        self.assertEqual(os.path.getsize(self.path), 200)
+
+    def test_compact_crashed(self):
+        cache = anyhttp.PackCache(self.path)
+        cache.dump('binary', 'a', b'a' * 100)
+        cache.close()
+        # left by a compact() which did not replace the index
+        for suffix in ('.compact', '.idx.compact'):
+            with open(self.path + suffix, 'wb') as fp:
+                fp.write(b'partial')
+        cache = anyhttp.PackCache(self.path)
+        self.assertEqual(cache.load('binary', 'a')[0], b'a' * 100)
+        self.assertFalse(os.path.exists(self.path + '.compact'))
+        self.assertFalse(os.path.exists(self.path + '.idx.compact'))
+        cache.close()
+
+    def test_get_binary(self):
+        anyhttp.http = http = FakeValidatingHttp()
+        try:
+            for i in range(2):
+                self.assertEqual(
+                    anyhttp.get_binary('a', cache = self.path), b'body')
+        finally:
+            anyhttp.http = None
+        self.assertEqual(len(http.requests), 1)
+        self.assertIsInstance(anyhttp._get_cache(self.path),
+                              anyhttp.PackCache)
+        anyhttp._caches.pop(self.path).close()
+
+class FakeValidatingHttp(anyhttp.Http):
+    def __init__(self):
+        super(FakeValidatingHttp, self).__init__(None)
+        self.requests = []
+        self.status = 200
+
+    def request(self, url, headers = None):
+        self.requests.append(headers)
+        if self.status != 200:
+            return anyhttp.Response(self.status, {}, b'error page')
+        if headers and headers.get('If-None-Match') == '"1"':
+            return anyhttp.Response(304, {'etag': '"1"'}, b'')
+        return anyhttp.Response(200, {'etag': '"1"'}, b'body')
+
+class TestRevalidation(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        anyhttp.http = self.http = FakeValidatingHttp()
+
+    def tearDown(self):
+        anyhttp.http = None
+        shutil.rmtree(self.cache_dir)
+
+    def test_not_modified(self):
+        self.assertEqual(anyhttp.get_binary('a', cache = self.cache_dir),
+                         b'body')
+        cache = anyhttp._get_cache(self.cache_dir)
+        filename = cache.filename('binary', 'a')
+        old = time.time() - 120
+        os.utime(filename, (old, old))
+        self.assertEqual(anyhttp.get_binary('a', cache = self.cache_dir,
+                                            max_age = 60), b'body')
+        self.assertEqual(self.http.requests[-1], {'If-None-Match': '"1"'})
+        self.assertGreater(os.path.getmtime(filename), old)
+
+    def test_error_status(self):
+        self.http.status = 404
+        self.assertRaises(anyhttp.StatusError, anyhttp.get_text, 'a',
+                          cache = self.cache_dir)
+        cache = anyhttp._get_cache(self.cache_dir)
+        self.assertRaises(KeyError, cache.load, 'text', 'a', stale = True)
+
+    def test_revalidation_error(self):
+        anyhttp.get_binary('a', cache = self.cache_dir)
+        cache = anyhttp._get_cache(self.cache_dir)
+        filename = cache.filename('binary', 'a')
+        old = time.time() - 120
+        os.utime(filename, (old, old))
+        self.http.status = 500
+        with self.assertRaises(anyhttp.StatusError) as raised:
+            anyhttp.get_binary('a', cache = self.cache_dir, max_age = 60)
+        self.assertEqual(raised.exception.status, 500)
+        self.assertEqual(cache.load('binary', 'a', stale = True)[0], b'body')
+        self.assertEqual(cache.load_headers('binary', 'a'), {'etag': '"1"'})
@@ -0,0 +1,224 @@
+"""CurlMulti and get_many() engine tests."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import anyhttp
+from anyhttp.curlmulti import CurlMulti, parse_header_lines
+from anyhttp.localserver import LocalServer, payload
+from anyhttp.workers import SingleFlight
+
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+
+def body(url, response):
+    return response.body
+
+
+@unittest.skipUnless(pycurl, 'pycurl is not installed')
+class TestCurlMulti(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        self.urls = [self.server.url(size)
+                     for size in range(1000, 11000, 1000)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_imap(self):
+        multi = CurlMulti(pycurl, handles=2, max_host_connections=1)
+        results = list(multi.imap(body, self.urls))
+        self.assertEqual(results, [(url, None, payload(1000 * (i + 1)))
+                                   for (i, url) in enumerate(self.urls)])
+        # handles are recycled, not one per transfer
+        self.assertEqual(len(multi._free), 2)
+        self.assertEqual(len(multi), 0)
+
+    def test_callback(self):
+        completed = []
+        multi = CurlMulti(pycurl, callback=lambda url, error, response:
+                          completed.append((url, error, response.status)))
+        for url in self.urls[:3]:
+            multi.add(url)
+        multi.perform()
+        self.assertEqual(sorted(completed),
+                         sorted((url, None, 200) for url in self.urls[:3]))
+
+    def test_error(self):
+        multi = CurlMulti(pycurl)
+        url = 'http://127.0.0.1:%d/bytes/1' % self.server.server_address[1]
+        self.server.stop()
+        self.server = LocalServer().start()
+        results = list(multi.imap(body, [url]))
+        self.assertIsInstance(results[0][1], pycurl.error)
+
+    def test_lookup_error(self):
+        def lookup(url):
+            if url == self.urls[0]:
+                raise IOError('corrupt entry')
+            raise KeyError(url)
+
+        multi = CurlMulti(pycurl)
+        results = list(multi.imap(body, self.urls[:2], lookup=lookup))
+        self.assertIsInstance(results[0][1], IOError)
+        self.assertEqual(results[1], (self.urls[1], None, payload(2000)))
+
+    def test_headers(self):
+        multi = CurlMulti(pycurl)
+        etag = '"%d"' % 1000
+        results = list(multi.imap(
+            lambda url, response: response.status, self.urls[:2],
+            headers=lambda url: {'If-None-Match': etag}))
+        self.assertEqual([result[2] for result in results], [304, 200])
+
+
+@unittest.skipUnless(pycurl, 'pycurl is not installed')
+class TestGetMany(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        self.urls = [self.server.url(size)
+                     for size in range(1000, 21000, 1000)]
+        anyhttp.http = anyhttp.pycurl(pycurl)
+
+    def tearDown(self):
+        anyhttp.http = None
+        self.server.stop()
+
+    def expected(self):
+        return [(url, None, payload(1000 * (i + 1)))
+                for (i, url) in enumerate(self.urls)]
+
+    def test_interleaved(self):
+        first = anyhttp.get_binary_many(self.urls, workers=2)
+        second = anyhttp.get_binary_many(self.urls, workers=2)
+        self.assertEqual(next(first), self.expected()[0])
+        self.assertEqual(next(second), self.expected()[0])
+        # closing one batch does not abort the other's transfers
+        first.close()
+        self.assertEqual(list(second), self.expected()[1:])
+
+    def test_threads(self):
+        results = []
+
+        def target():
+            try:
+                results.append(list(anyhttp.get_binary_many(self.urls)))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=target) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [self.expected()] * 4)
+
+    def test_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            results = list(anyhttp.get_binary_many(self.urls[:2],
+                                                   cache=directory))
+            self.assertEqual(results, self.expected()[:2])
+            cache = anyhttp._get_cache(directory)
+            filename = cache.filename('binary', self.urls[0])
+            old = time.time() - 120
+            os.utime(filename, (old, old))
+            # the stale entry is revalidated with a 304
+            results = list(anyhttp.get_binary_many(self.urls[:2],
+                                                   cache=directory,
+                                                   max_age=60))
+            self.assertEqual(results, self.expected()[:2])
+            self.assertGreater(os.path.getmtime(filename), old)
+        finally:
+            anyhttp._caches.pop(directory, None)
+            shutil.rmtree(directory)
+
+    def test_in_flight(self):
+        # each transfer is a call which other threads' fetches wait for
+        calls = []
+
+        class Recording(SingleFlight):
+            def start(self, key):
+                calls.append(key)
+                return super(Recording, self).start(key)
+
+        in_flight = anyhttp._in_flight
+        anyhttp._in_flight = Recording()
+        try:
+            self.assertEqual(list(anyhttp.get_binary_many(self.urls)),
+                             self.expected())
+            self.assertEqual(calls, [('binary', url) for url in self.urls])
+            results = anyhttp.get_binary_many(self.urls, workers=10)
+            next(results)
+            results.close()
+            # calls of the aborted transfers are cancelled
+            self.assertEqual(len(anyhttp._in_flight), 0)
+        finally:
+            anyhttp._in_flight = in_flight
+
+
+class FakeMultiHttp(anyhttp.Http):
+
+    """Handler with an engine which fetches urls one after another."""
+
+    def raw(self, url):
+        return url.encode('ascii')
+
+    def imap_request(self, func, urls, ordered=True, lookup=None,
+                     limit=None, headers=None, encoded=False):
+        for url in urls:
+            if lookup:
+                try:
+                    yield (url, None, lookup(url))
+                    continue
+                except KeyError:
+                    pass
+            response = anyhttp.Response(200, {'etag': url}, self.raw(url))
+            yield (url, None, func(url, response))
+
+
+class TestGetManyEngine(unittest.TestCase):
+
+    def setUp(self):
+        anyhttp.http = FakeMultiHttp(None)
+
+    def tearDown(self):
+        anyhttp.http = None
+
+    def test_get_many(self):
+        results = list(anyhttp.get_many(['a', 'b']))
+        self.assertEqual(results, [('a', None, u'a'), ('b', None, u'b')])
+
+    def test_cache(self):
+        cache = anyhttp.MemoryCache()
+
+        class Cache(object):
+            max_age = None
+
+            def load(self, text_or_binary, url, max_age=None, stale=False):
+                return (cache.get(url), 0)
+
+            def load_headers(self, text_or_binary, url):
+                return {}
+
+            def dump(self, text_or_binary, url, response, headers=None):
+                cache.set(url, (response, headers))
+
+        list(anyhttp.get_binary_many(['a'], cache=Cache()))
+        self.assertEqual(cache.get('a'), (b'a', {'etag': 'a'}))
+
+
+class TestParseHeaderLines(unittest.TestCase):
+
+    def test_redirect(self):
+        lines = [b'HTTP/1.1 302 Found\r\n', b'Location: /b\r\n', b'\r\n',
+                 b'HTTP/1.1 200 OK\r\n', b'ETag: "1"\r\n', b'\r\n']
+        self.assertEqual(parse_header_lines(lines), {'etag': '"1"'})
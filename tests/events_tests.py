@@ -0,0 +1,95 @@
+"""Event hook tests."""
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import anyhttp
+from anyhttp import events
+
+
+class FakeHttp(anyhttp.Http):
+
+    def raw(self, url):
+        if url == 'bad':
+            raise IOError('bad url')
+        return url.encode('ascii')
+
+    def iter_raw(self, url, chunk_size=None):
+        for chunk in (b'a', b'bc'):
+            yield chunk
+
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        events.subscribe(self.events.append)
+        anyhttp.http = FakeHttp(None)
+
+    def tearDown(self):
+        anyhttp.http = None
+        events.unsubscribe(self.events.append)
+
+    def names(self):
+        return [event['event'] for event in self.events
+                if event['event'] != 'debug']
+
+    def test_inactive(self):
+        events.unsubscribe(self.events.append)
+        self.assertFalse(events.active)
+        anyhttp.get_binary('a')
+        self.assertEqual(self.events, [])
+
+    def test_filter(self):
+        errors = []
+        events.subscribe(errors.append, ['error'])
+        try:
+            self.assertRaises(IOError, anyhttp.get_binary, 'bad')
+        finally:
+            events.unsubscribe(errors.append)
+        self.assertEqual([event['event'] for event in errors], ['error'])
+        self.assertEqual(self.names(), ['request_start', 'error',
+                                        'request_end'])
+        self.assertIsInstance(self.events[-1]['error'], IOError)
+
+    def test_request(self):
+        anyhttp.get_text('a')
+        self.assertEqual(self.names(), ['request_start', 'request_end'])
+        end = self.events[-1]
+        self.assertEqual((end['url'], end['mode'], end['handler'],
+                          end['bytes'], end['error']),
+                         ('a', 'text', 'FakeHttp', 1, None))
+        self.assertGreaterEqual(end['elapsed'], 0)
+
+    def test_stream(self):
+        self.assertEqual(b''.join(anyhttp.iter_binary('a')), b'abc')
+        self.assertEqual(self.names(), ['request_start', 'first_byte',
+                                        'bytes_received', 'bytes_received',
+                                        'request_end'])
+        self.assertEqual(self.events[-1]['bytes'], 3)
+
+    def test_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            anyhttp.get_binary('a', cache=directory)
+            anyhttp.get_binary('a', cache=directory)
+        finally:
+            shutil.rmtree(directory)
+        names = self.names()
+        self.assertEqual(names[0], 'cache_miss')
+        self.assertIn('request_end', names)
+        self.assertEqual(names[-1], 'cache_hit')
+        self.assertEqual(self.events[-1]['tier'], 'cache')
+
+    def test_failing_subscriber(self):
+        def fail(event):
+            raise ValueError(event)
+        events.subscribe(fail)
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.assertEqual(anyhttp.get_binary('a'), b'a')
+        finally:
+            events.unsubscribe(fail)
+        self.assertTrue(caught)
@@ -0,0 +1,230 @@
+"""Offline tests of the handler base classes."""
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import anyhttp
+from anyhttp.localserver import LocalServer, payload, sample_text
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeSession(object):
+
+    def get(self, url):
+        return FakeResponse(b'session ' + url.encode('ascii'))
+
+
+class FakePackage(object):
+
+    __name__ = 'fake'
+
+    @staticmethod
+    def get(url):
+        return FakeResponse(b'package ' + url.encode('ascii'))
+
+
+class FakeSessionPackage(FakePackage):
+
+    Session = FakeSession
+
+
+class TestPackageGet(unittest.TestCase):
+
+    def test_session(self):
+        http = anyhttp.PackageGetContents(FakeSessionPackage)
+        self.assertIsInstance(http.session, FakeSession)
+        self.assertEqual(http.raw('a'), b'session a')
+
+    def test_no_session(self):
+        http = anyhttp.PackageGetContents(FakePackage)
+        self.assertIsNone(http.session)
+        self.assertEqual(http.raw('a'), b'package a')
+
+
+class TestIterRaw(unittest.TestCase):
+
+    def test_default(self):
+        http = anyhttp.PackageGetContents(FakePackage)
+        self.assertEqual(list(http.iter_raw('a')), [b'package a'])
+
+
+class FakeConnection(object):
+
+    def __init__(self, host, port):
+        self.host = host
+
+
+class FakeConnectionPackage(object):
+
+    FakeConnection = FakeConnection
+
+
+class FakeHostPortClass(anyhttp.HostPortConnectionClass):
+
+    cls = 'FakeConnection'
+    pooled = False
+
+    def fetch(self, url):
+        return self.http.host
+
+
+class FakeCurl(object):
+
+    def setopt(self, option, value):
+        pass
+
+
+class FakeCurlShare(FakeCurl):
+
+    def __init__(self):
+        # widen the window in which clones could race to make a share
+        time.sleep(0.05)
+
+
+class FakeCurlPackage(object):
+
+    __name__ = 'pycurl'
+
+    Curl = FakeCurl
+    CurlShare = FakeCurlShare
+    ENCODING = SH_SHARE = SHARE = LOCK_DATA_DNS = LOCK_DATA_SSL_SESSION = 0
+
+
+class TestThreadSafety(unittest.TestCase):
+
+    def test_no_url_state(self):
+        http = FakeHostPortClass(FakeConnectionPackage)
+        self.assertEqual(http.raw('http://a.example/'), 'a.example')
+        self.assertEqual(http.raw('http://b.example/'), 'b.example')
+        self.assertEqual(http.get_path('http://a.example/x'), '/x')
+        self.assertEqual(http.get_path('http://a.example/y'), '/y')
+
+    def test_thread_local(self):
+        http = anyhttp.ThreadLocalHttp(
+            anyhttp.PackageGetContents(FakePackage))
+        handlers = []
+        thread = threading.Thread(target=lambda: handlers.append(http.get()))
+        thread.start()
+        thread.join()
+        self.assertIs(http.get(), http.get())
+        self.assertIsNot(http.get(), handlers[0])
+        self.assertIsNot(http.get(), http.prototype)
+        self.assertEqual(http.raw('a'), b'package a')
+
+    def test_curl_share(self):
+        http = anyhttp.pycurl(FakeCurlPackage)
+        clones = []
+        threads = [threading.Thread(target=lambda: clones.append(http.clone()))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(set(id(clone.share) for clone in clones),
+                         set([id(http.share)]))
+
+
+class TestCharset(unittest.TestCase):
+
+    def test_charset_of(self):
+        self.assertEqual(anyhttp.charset_of('text/html; charset=ISO-8859-1'),
+                         'iso8859-1')
+        self.assertEqual(anyhttp.charset_of('text/html;charset="utf-8"'),
+                         'utf-8')
+        self.assertIsNone(anyhttp.charset_of('text/html'))
+        self.assertIsNone(anyhttp.charset_of('text/html; charset=bogus'))
+        self.assertIsNone(anyhttp.charset_of(None))
+
+    def test_text(self):
+        http = anyhttp.PackageGetContents(FakePackage)
+        text = u'\xe9t\xe9'
+        self.assertEqual(http._text(text.encode('utf-8')), text)
+        self.assertEqual(http._text(text.encode('latin1'), 'latin1'), text)
+        self.assertEqual(
+            http._text(memoryview(text.encode('utf-16')), 'utf-16'), text)
+
+    def test_iter_decode(self):
+        data = u'\u20ac\u4e2d'.encode('utf-8')
+        chunks = [data[i:i + 1] for i in range(len(data))]
+        self.assertEqual(u''.join(anyhttp.iter_decode(chunks)),
+                         u'\u20ac\u4e2d')
+
+
+class TestCharsetServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_urlopen(self):
+        try:
+            import urllib.request as package
+        except ImportError:
+            import urllib2 as package
+        http = anyhttp.urlopen(package)
+        for charset in ('utf-8', 'utf-16', 'gb18030'):
+            url = self.server.text_url(charset)
+            self.assertEqual(http.get_text(url), sample_text)
+            self.assertEqual(u''.join(http.iter_text(url, 3, charset)),
+                             sample_text)
+
+
+class TestContentEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        try:
+            import urllib.request as package
+        except ImportError:
+            import urllib2 as package
+        self.http = anyhttp.urlopen(package)
+
+    def tearDown(self):
+        self.server.stop()
+        anyhttp.accept_encoding = anyhttp.compression.accept_encoding
+
+    def test_decompress(self):
+        for coding in ('gzip', 'deflate'):
+            url = self.server.compressed_url(coding, 100000)
+            self.assertEqual(self.http.raw(url), payload(100000))
+            self.assertEqual(b''.join(self.http.iter_raw(url, 1000)),
+                             payload(100000))
+            response = self.http.request_encoded(url)
+            self.assertEqual(response.content_encoding, coding)
+            self.assertLess(len(response.body), 10000)
+            self.assertEqual(self.http.request(url).body, payload(100000))
+
+    def test_identity(self):
+        anyhttp.accept_encoding = None
+        url = self.server.compressed_url('gzip', 1000)
+        response = self.http.request_encoded(url)
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.body, payload(1000))
+
+    def test_store_encoded(self):
+        directory = tempfile.mkdtemp()
+        anyhttp.http = self.http
+        anyhttp.store_encoded = True
+        try:
+            url = self.server.compressed_url('gzip', 1000)
+            self.assertEqual(anyhttp.get_binary(url, cache=directory),
+                             payload(1000))
+            cache = anyhttp._get_cache(directory)
+            with open(cache.filename('binary', url), 'rb') as fp:
+                self.assertEqual(
+                    anyhttp.compression.codec_of(fp.read()), 'gzip')
+            self.assertEqual(cache.load('binary', url)[0], payload(1000))
+        finally:
+            anyhttp.http = None
+            anyhttp.store_encoded = False
+            anyhttp._caches.pop(directory, None)
+            shutil.rmtree(directory)
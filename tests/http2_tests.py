@@ -0,0 +1,186 @@
+"""HTTP/2 batch tests, using a fake hyper package."""
+import time
+import unittest
+
+import anyhttp
+from anyhttp.http2 import HTTP2Batch
+
+
+class FakeResponse(object):
+
+    status = 200
+
+    def __init__(self, path):
+        self.headers = {b'content-type': b'text/plain'}
+        self.path = path
+
+    def read(self):
+        return self.path.encode('ascii')
+
+
+class FakeConnection(object):
+
+    """HTTP/2 for h2.example, HTTP/1.1 for other hosts."""
+
+    instances = []
+
+    def __init__(self, host, port, secure=False):
+        self.instances.append(self)
+        self.host = host
+        self.secure = secure
+        self.h2 = host == 'h2.example'
+        self.streams = {}
+        self.next_stream = 1
+        self.last = None
+        self.most_streams = 0
+        self.closed = False
+
+    def request(self, method, url, headers=None):
+        assert not self.closed
+        if url == '/refused':
+            raise IOError('refused')
+        if not self.h2:
+            assert self.last is None, 'HTTP/1.1 requests overlap'
+            self.last = url
+            return None
+        stream_id = self.next_stream
+        self.next_stream += 2
+        self.streams[stream_id] = url
+        self.most_streams = max(self.most_streams, len(self.streams))
+        return stream_id
+
+    def get_response(self, stream_id=None):
+        if self.host == 'slow.example':
+            time.sleep(0.2)
+        if stream_id is None:
+            (url, self.last) = (self.last, None)
+        else:
+            url = self.streams.pop(stream_id)
+        if url == '/reset':
+            raise IOError('stream reset')
+        return FakeResponse(url)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHyper(object):
+
+    HTTPConnection = HTTP11Connection = FakeConnection
+
+
+class MultiplexHyper(anyhttp.hyper):
+
+    multiplex = True
+
+
+def body(url, response):
+    return response.body
+
+
+class TestHTTP2Batch(unittest.TestCase):
+
+    def setUp(self):
+        FakeConnection.instances = []
+        self.batch = HTTP2Batch(FakeHyper, max_streams=10)
+
+    def test_multiplexed(self):
+        urls = ['https://h2.example/%d' % i for i in range(25)]
+        results = list(self.batch.imap(body, urls))
+        self.assertEqual(results, [(url, None, url[18:].encode('ascii'))
+                                   for url in urls])
+        self.assertEqual(len(FakeConnection.instances), 1)
+        conn = FakeConnection.instances[0]
+        self.assertTrue(conn.secure)
+        self.assertEqual(conn.most_streams, 10)
+
+    def test_origins(self):
+        urls = ['https://h2.example/a', 'http://h1.example/b',
+                'https://h2.example/c', 'http://h1.example/d?q=1']
+        results = list(self.batch.imap(body, urls, ordered=False))
+        self.assertEqual(sorted(result[2] for result in results),
+                         [b'/a', b'/b', b'/c', b'/d?q=1'])
+        self.assertEqual(len(FakeConnection.instances), 2)
+
+    def test_errors(self):
+        urls = ['https://h2.example/a', 'https://h2.example/reset',
+                'https://h2.example/refused', 'https://h2.example/b']
+        results = list(self.batch.imap(body, urls))
+        self.assertEqual([url for (url, error, result) in results], urls)
+        self.assertIsNone(results[0][1])
+        self.assertIsInstance(results[1][1], IOError)
+        self.assertIsInstance(results[2][1], IOError)
+        self.assertEqual(results[3][2], b'/b')
+
+    def test_lookup(self):
+        def lookup(url):
+            if url.endswith('a'):
+                return b'cached'
+            raise KeyError(url)
+
+        urls = ['https://h2.example/a', 'https://h2.example/b']
+        self.assertEqual([result for (url, error, result) in
+                          self.batch.imap(body, urls, lookup=lookup)],
+                         [b'cached', b'/b'])
+
+    def test_lookup_error(self):
+        def lookup(url):
+            if url.endswith('a'):
+                raise IOError('corrupt entry')
+            raise KeyError(url)
+
+        urls = ['https://h2.example/a', 'https://h2.example/b']
+        results = list(self.batch.imap(body, urls, lookup=lookup))
+        self.assertIsInstance(results[0][1], IOError)
+        self.assertEqual(results[1], (urls[1], None, b'/b'))
+
+    def test_close_early(self):
+        urls = ['https://h2.example/%d' % i for i in range(5)]
+        results = self.batch.imap(body, urls)
+        next(results)
+        results.close()
+        self.assertTrue(FakeConnection.instances[0].closed)
+
+    def test_get_many(self):
+        anyhttp.http = MultiplexHyper(FakeHyper)
+        try:
+            urls = ['https://h2.example/%d' % i for i in range(5)]
+            self.assertEqual(
+                [result for (url, error, result) in
+                 anyhttp.get_binary_many(urls, workers=5)],
+                [url[18:].encode('ascii') for url in urls])
+        finally:
+            anyhttp.http = None
+
+    def test_get_many_interleaved(self):
+        anyhttp.http = MultiplexHyper(FakeHyper)
+        try:
+            urls = ['https://h2.example/%d' % i for i in range(5)]
+            first = anyhttp.get_binary_many(urls, workers=1)
+            second = anyhttp.get_binary_many(urls, workers=1)
+            next(first)
+            next(second)
+            # each call has its own batch, and so its own connection
+            first.close()
+            self.assertEqual([result for (url, error, result) in second],
+                             [url[18:].encode('ascii') for url in urls[1:]])
+            self.assertEqual(len(FakeConnection.instances), 2)
+            # a batch is re-used, with its connection, once it completes
+            list(anyhttp.get_binary_many(urls))
+            self.assertEqual(len(FakeConnection.instances), 2)
+        finally:
+            anyhttp.http = None
+
+    def test_get_many_http11(self):
+        # without multiplex, HTTP/1.1 requests run on worker threads
+        anyhttp.http = anyhttp.hyper(FakeHyper)
+        try:
+            urls = ['http://slow.example/%d' % i for i in range(8)]
+            start = time.time()
+            self.assertEqual(
+                [result for (url, error, result) in
+                 anyhttp.get_binary_many(urls, workers=8)],
+                [url[19:].encode('ascii') for url in urls])
+            self.assertLess(time.time() - start, 0.8)
+        finally:
+            anyhttp.http = None
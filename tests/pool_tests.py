@@ -0,0 +1,110 @@
+"""Connection pool tests."""
+import time
+import unittest
+
+import anyhttp
+from anyhttp.pool import ConnectionPool
+
+
+class FakeConnection(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.closed = False
+        self.broken = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakePackage(object):
+
+    FakeConnection = FakeConnection
+
+
+class FakeSiteClass(anyhttp.SingleSiteClass):
+
+    cls = 'FakeConnection'
+
+    def fetch(self, url):
+        if self.http.broken:
+            raise IOError('connection reset')
+        return self.http
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    key = ('http', 'example.com', None)
+
+    def test_reuse(self):
+        pool = ConnectionPool()
+        conn = FakeConnection('a')
+        pool.release(self.key, conn)
+        self.assertIs(pool.acquire(self.key), conn)
+        self.assertIsNone(pool.acquire(self.key))
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_idle=2)
+        conns = [FakeConnection(i) for i in range(3)]
+        for conn in conns:
+            pool.release(self.key, conn)
+        self.assertEqual(len(pool), 2)
+        self.assertTrue(conns[0].closed)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(idle_timeout=0)
+        conn = FakeConnection('a')
+        pool.release(self.key, conn)
+        time.sleep(0.01)
+        self.assertIsNone(pool.acquire(self.key))
+        self.assertTrue(conn.closed)
+
+    def test_broken(self):
+        pool = ConnectionPool(check=lambda conn: not conn.broken)
+        conn = FakeConnection('a')
+        conn.broken = True
+        pool.release(self.key, conn)
+        self.assertIsNone(pool.acquire(self.key))
+        self.assertTrue(conn.closed)
+
+
+class TestSingleSiteClass(unittest.TestCase):
+
+    def test_reuse(self):
+        http = FakeSiteClass(FakePackage)
+        first = http.raw('http://example.com/a')
+        second = http.raw('http://example.com/b')
+        self.assertIs(first, second)
+        third = http.raw('http://example.org/a')
+        self.assertIsNot(first, third)
+
+    def test_retry_broken(self):
+        http = FakeSiteClass(FakePackage)
+        first = http.raw('http://example.com/a')
+        first.broken = True
+        second = http.raw('http://example.com/a')
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+
+class FakeStreamingSiteClass(FakeSiteClass):
+
+    def iter_fetch(self, http, url, chunk_size):
+        for i in range(3):
+            yield http.url.encode('ascii')
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_release(self):
+        http = FakeStreamingSiteClass(FakePackage)
+        chunks = list(http.iter_raw('http://example.com/a'))
+        self.assertEqual(chunks, [b'http://example.com/a'] * 3)
+        self.assertEqual(len(http.pool), 1)
+
+    def test_close_discards(self):
+        http = FakeStreamingSiteClass(FakePackage)
+        chunks = http.iter_raw('http://example.com/a')
+        next(chunks)
+        chunks.close()
+        self.assertEqual(len(http.pool), 0)
@@ -0,0 +1,258 @@
+"""Ranged download tests, against the local server."""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import anyhttp
+from anyhttp import ranges
+from anyhttp.localserver import LocalServer, payload
+
+
+def urlopen():
+    try:
+        import urllib.request as package
+    except ImportError:
+        import urllib2 as package
+    return anyhttp.urlopen(package)
+
+
+class TestParse(unittest.TestCase):
+
+    def test_parse_content_range(self):
+        self.assertEqual(ranges.parse_content_range('bytes 0-9/100'),
+                         (0, 9, 100))
+        self.assertEqual(ranges.parse_content_range('bytes 10-19/*'),
+                         (10, 19, None))
+        self.assertIsNone(ranges.parse_content_range('items 0-9/100'))
+        self.assertIsNone(ranges.parse_content_range('bytes */100'))
+        self.assertIsNone(ranges.parse_content_range(''))
+
+    def test_split(self):
+        self.assertEqual(ranges.split(10, 35, 10),
+                         [(10, 19), (20, 29), (30, 34)])
+        self.assertEqual(ranges.split(10, 10, 10), [])
+
+
+class ChangingHttp(object):
+
+    """Handler of a resource which changes after the first response."""
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, url, headers=None):
+        self.requests.append(headers)
+        if len(self.requests) == 1:
+            return anyhttp.Response(206, {'content-range': 'bytes 0-9/30',
+                                          'etag': '"1"'}, b'0' * 10)
+        # If-Range does not match the new entity
+        return anyhttp.Response(200, {'etag': '"2"'}, b'1' * 30)
+
+    def head(self, url, headers=None):
+        return None
+
+    def clone(self):
+        return self
+
+
+class TestRanges(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        self.http = urlopen()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get(self):
+        url = self.server.url(100000)
+        for part_size in (1000, 30000, 100000, 200000):
+            self.assertEqual(ranges.get(self.http, url, 4, part_size),
+                             payload(100000))
+
+    def test_empty(self):
+        self.assertEqual(ranges.get(self.http, self.server.url(0), 4, 1000),
+                         b'')
+
+    def test_no_ranges(self):
+        # the server ignores Range on compressed urls
+        url = self.server.compressed_url('gzip', 10000)
+        self.assertEqual(ranges.get(self.http, url, 4, 1000), payload(10000))
+        # the body is streamed, rather than requested with a range
+        http = FlakyHttp(self.http)
+        fp = io.BytesIO()
+        self.assertEqual(ranges.get_to_file(http, url, fp, 4, 1000), 10000)
+        self.assertEqual(fp.getvalue(), payload(10000))
+        self.assertEqual(http.requests, [None])
+
+    def test_head(self):
+        response = self.http.head(self.server.url(1000))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, b'')
+        self.assertTrue(ranges.accepts_ranges(response.headers))
+        response = self.http.head(self.server.compressed_url('gzip', 1000))
+        self.assertFalse(ranges.accepts_ranges(response.headers))
+
+    def test_get_to_file(self):
+        url = self.server.url(100000)
+        fp = io.BytesIO()
+        fp.write(b'head')
+        self.assertEqual(ranges.get_to_file(self.http, url, fp, 4, 7000),
+                         100000)
+        self.assertEqual(fp.getvalue(), b'head' + payload(100000))
+
+    def test_changed(self):
+        http = ChangingHttp()
+        self.assertRaises(ranges.RangeError, ranges.get, http, 'url', 2, 10)
+        self.assertEqual(http.requests[1]['If-Range'], '"1"')
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        anyhttp.http = urlopen()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        anyhttp.http = None
+        anyhttp._caches.pop(self.directory, None)
+        shutil.rmtree(self.directory)
+
+    def test_get_binary(self):
+        url = self.server.url(100000)
+        self.assertEqual(anyhttp.get_binary(url, workers=4), payload(100000))
+        cache = os.path.join(self.directory, 'cache')
+        self.assertEqual(anyhttp.get_binary(url, cache=cache, workers=4),
+                         payload(100000))
+        headers = anyhttp._get_cache(cache).load_headers('binary', url)
+        self.assertEqual(headers['etag'], '"100000"')
+
+    def test_get_to_file(self):
+        url = self.server.url(100000)
+        filename = os.path.join(self.directory, 'file')
+        self.assertEqual(anyhttp.get_to_file(url, filename, workers=4), 100000)
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), payload(100000))
+
+
+class FlakyHttp(object):
+
+    """Handler which records requests, and fails after fail_after."""
+
+    def __init__(self, http, fail_after=None):
+        self.http = http
+        self.fail_after = fail_after
+        self.requests = []
+
+    def request(self, url, headers=None):
+        if len(self.requests) == self.fail_after:
+            raise IOError('connection reset')
+        self.requests.append(headers)
+        return self.http.request(url, headers)
+
+    def head(self, url, headers=None):
+        return self.http.head(url, headers)
+
+    def write_raw(self, url, fp, chunk_size=None):
+        self.requests.append(None)
+        return self.http.write_raw(url, fp, chunk_size)
+
+    def clone(self):
+        return self
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer().start()
+        self.directory = tempfile.mkdtemp()
+        self.part_size = ranges.default_part_size
+        ranges.default_part_size = 1000
+        anyhttp.resumable = True
+
+    def tearDown(self):
+        self.server.stop()
+        anyhttp.http = None
+        anyhttp.resumable = False
+        ranges.default_part_size = self.part_size
+        shutil.rmtree(self.directory)
+
+    def interrupt(self, cache, url):
+        anyhttp.http = FlakyHttp(urlopen(), fail_after=3)
+        self.assertRaises(IOError, anyhttp.get_binary, url, cache=cache)
+        cache = anyhttp._get_cache(cache)
+        self.assertRaises(KeyError, cache.load, 'binary', url)
+        self.assertEqual(cache.partials.load('binary', url),
+                         (3000, {'content-type': 'application/octet-stream',
+                                 'etag': '"10000"'}))
+
+    def check_resume(self, cache):
+        url = self.server.url(10000)
+        self.interrupt(cache, url)
+        anyhttp.http = http = FlakyHttp(urlopen())
+        self.assertEqual(anyhttp.get_binary(url, cache=cache),
+                         payload(10000))
+        cache = anyhttp._get_cache(cache)
+        self.assertEqual(http.requests[0]['Range'], 'bytes=3000-3999')
+        self.assertEqual(http.requests[0]['If-Range'], '"10000"')
+        self.assertEqual(len(http.requests), 7)
+        self.assertEqual(cache.load('binary', url)[0], payload(10000))
+        self.assertEqual(cache.load_headers('binary', url)['etag'],
+                         '"10000"')
+        self.assertRaises(KeyError, cache.partials.load, 'binary', url)
+        self.assertFalse(os.path.exists(
+            cache.partials.filename('binary', url)))
+
+    def test_directory(self):
+        self.check_resume(anyhttp.DirectoryCache(self.directory))
+
+    def test_compressed(self):
+        self.check_resume(anyhttp.DirectoryCache(self.directory,
+                                                 compress='zlib'))
+
+    def test_pack(self):
+        # by path, as an empty PackCache is false
+        path = os.path.join(self.directory, 'cache.pack')
+        try:
+            self.check_resume(path)
+        finally:
+            anyhttp._caches.pop(path).close()
+
+    def test_changed(self):
+        cache = anyhttp.DirectoryCache(self.directory)
+        url = self.server.url(10000)
+        self.interrupt(cache, url)
+        # a partial body of another version of the resource
+        cache.partials.dump('binary', url, 3000, {'etag': '"old"'})
+        anyhttp.http = http = FlakyHttp(urlopen())
+        self.assertEqual(anyhttp.get_binary(url, cache=cache),
+                         payload(10000))
+        self.assertEqual(len(http.requests), 1)
+
+    def test_no_validator(self):
+        cache = anyhttp.DirectoryCache(self.directory)
+        url = self.server.url(10000)
+        self.interrupt(cache, url)
+        # the partial body cannot be known to be of the current version
+        cache.partials.dump('binary', url, 3000, {})
+        anyhttp.http = http = FlakyHttp(urlopen())
+        self.assertEqual(anyhttp.get_binary(url, cache=cache),
+                         payload(10000))
+        self.assertEqual(http.requests[0]['Range'], 'bytes=0-999')
+        self.assertNotIn('If-Range', http.requests[0])
+        self.assertEqual(len(http.requests), 10)
+
+    def test_get_to_file(self):
+        cache = anyhttp.DirectoryCache(self.directory)
+        url = self.server.url(10000)
+        self.interrupt(cache, url)
+        anyhttp.http = FlakyHttp(urlopen())
+        filename = os.path.join(self.directory, 'file')
+        self.assertEqual(anyhttp.get_to_file(url, filename, cache=cache),
+                         10000)
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), payload(10000))
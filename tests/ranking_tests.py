@@ -0,0 +1,98 @@
+"""Backend ranking tests."""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+import anyhttp
+from anyhttp import ranking
+from anyhttp.localserver import LocalServer
+
+
+class FakeHttp(anyhttp.Http):
+
+    def raw(self, url):
+        response = urlopen(url)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+
+class TestRankPackages(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'ranking.json')
+        self.ranking_file = ranking.ranking_file
+        ranking.ranking_file = self.filename
+
+    def tearDown(self):
+        ranking.ranking_file = self.ranking_file
+        anyhttp.preferred_packages = []
+        ranking._loaded.clear()
+        shutil.rmtree(self.directory)
+
+    def test_priority(self):
+        self.assertEqual(
+            anyhttp.rank_packages(['webob', 'async_http', 'urllib3']),
+            ['urllib3', 'async_http', 'webob'])
+
+    def test_preferred(self):
+        anyhttp.preferred_packages = ['webob']
+        self.assertEqual(anyhttp.rank_packages(['urllib3', 'webob']),
+                         ['webob', 'urllib3'])
+
+    def test_saved(self):
+        ranking.save_ranking({'requests': 0.1, 'pycurl': 0.2})
+        ranking._loaded.clear()
+        self.assertEqual(ranking.load_ranking(), ['requests', 'pycurl'])
+        self.assertEqual(
+            anyhttp.rank_packages(['urllib3', 'pycurl', 'requests']),
+            ['requests', 'pycurl', 'urllib3'])
+
+
+class TestMeasure(unittest.TestCase):
+
+    def test_measure(self):
+        with LocalServer() as server:
+            urls = [server.url(10), server.url(100000)]
+            expected = [server.payload(10), server.payload(100000)]
+            self.assertGreater(
+                ranking.measure(FakeHttp(None), urls, expected, rounds=2), 0)
+            self.assertRaises(ValueError, ranking.measure, FakeHttp(None),
+                              urls, expected[::-1], rounds=1)
+
+
+class TestImportPackage(unittest.TestCase):
+
+    def test_available(self):
+        available = anyhttp.detect_available_packages()
+        self.assertTrue(available <= anyhttp.known_http_packages)
+        self.assertIs(anyhttp.detect_available_packages(), available)
+
+    def test_import_preferred(self):
+        available = anyhttp.detect_available_packages()
+        if not available:
+            raise unittest.SkipTest('no http packages installed')
+        name = anyhttp.rank_packages(available)[0]
+        script = ('import anyhttp; '
+                  'print(anyhttp.choose_package().package.__name__)')
+        out = subprocess.check_output([sys.executable, '-c', script],
+                                      env=dict(os.environ,
+                                               ANYHTTP_PACKAGES=name))
+        self.assertEqual(out.decode('ascii').strip(), name)
+
+    def test_lazy_server(self):
+        # choose_package() loads the ranking without the benchmark server
+        script = ('import sys, anyhttp; anyhttp.choose_package(); '
+                  'print("anyhttp.localserver" in sys.modules)')
+        out = subprocess.check_output([sys.executable, '-c', script])
+        self.assertEqual(out.decode('ascii').strip(), 'False')
@@ -0,0 +1,245 @@
+"""Worker pool and batch fetch tests."""
+import io
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import anyhttp
+from anyhttp.workers import SingleFlight, imap
+
+
+class FakeHttp(anyhttp.Http):
+
+    def raw(self, url):
+        if url == 'bad':
+            raise IOError('bad url')
+        return url.encode('ascii')
+
+
+class TestImap(unittest.TestCase):
+
+    def test_ordered(self):
+        def func(context, item):
+            time.sleep(0.01 * (5 - item))
+            return item * 2
+
+        results = list(imap(func, range(5), workers=3))
+        self.assertEqual(results, [(i, None, i * 2) for i in range(5)])
+
+    def test_unordered(self):
+        results = list(imap(lambda c, i: i, range(20), ordered=False))
+        self.assertEqual(sorted(results), [(i, None, i) for i in range(20)])
+
+    def test_errors(self):
+        def func(context, item):
+            return 1 // item
+
+        results = list(imap(func, [1, 0]))
+        self.assertEqual(results[0], (1, None, 1))
+        self.assertIsInstance(results[1][1], ZeroDivisionError)
+
+    def test_context(self):
+        results = list(imap(lambda c, i: c, range(3), context=lambda: 'c'))
+        self.assertEqual([r[2] for r in results], ['c'] * 3)
+
+    def test_lookup(self):
+        def lookup(item):
+            if item % 2:
+                return 'hit'
+            raise KeyError(item)
+
+        def func(context, item):
+            self.assertFalse(item % 2)
+            return 'miss'
+
+        results = list(imap(func, range(4), lookup=lookup))
+        self.assertEqual([r[2] for r in results],
+                         ['miss', 'hit', 'miss', 'hit'])
+
+    def test_lookup_error(self):
+        def lookup(item):
+            if item == 1:
+                raise IOError('corrupt entry')
+            raise KeyError(item)
+
+        results = list(imap(lambda context, item: item, range(3),
+                            lookup=lookup))
+        self.assertEqual([r[2] for r in results], [0, None, 2])
+        self.assertIsInstance(results[1][1], IOError)
+
+    def test_no_workers(self):
+        self.assertRaises(ValueError, list, imap(lambda c, i: i, [1],
+                                                 workers=0))
+
+
+class TestGetMany(unittest.TestCase):
+
+    def setUp(self):
+        anyhttp.http = FakeHttp(None)
+
+    def tearDown(self):
+        anyhttp.http = None
+
+    def test_get_many(self):
+        results = list(anyhttp.get_many(['a', 'bad', 'c']))
+        self.assertEqual(results[0], ('a', None, u'a'))
+        self.assertIsInstance(results[1][1], IOError)
+        self.assertEqual(results[2], ('c', None, u'c'))
+
+    def test_get_binary_many(self):
+        results = list(anyhttp.get_binary_many(['a', 'b'], ordered=False))
+        self.assertEqual(sorted(results),
+                         [('a', None, b'a'), ('b', None, b'b')])
+
+    def test_no_workers(self):
+        self.assertRaises(ValueError, anyhttp.get_binary_many, ['a'],
+                          workers=0)
+
+
+class SlowHttp(anyhttp.Http):
+
+    def __init__(self, package):
+        super(SlowHttp, self).__init__(package)
+        self.calls = 0
+
+    def raw(self, url):
+        self.calls += 1
+        time.sleep(0.1)
+        if url == 'bad':
+            raise IOError('bad url')
+        return url.encode('ascii')
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_threads(self, func, count=5):
+        results = []
+
+        def target():
+            try:
+                results.append(func())
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=target) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_shared(self):
+        flight = SingleFlight()
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'a'
+
+        results = self.run_threads(lambda: flight.do('a', func))
+        self.assertEqual(results, ['a'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(flight), 0)
+
+    def test_start(self):
+        flight = SingleFlight()
+        call = flight.start('a')
+        self.assertIsNone(flight.start('a'))
+        threading.Timer(0.1, flight.end, ('a', call, 'b')).start()
+        self.assertEqual(flight.do('a', lambda: 'c'), 'b')
+        self.assertEqual(len(flight), 0)
+
+    def test_cancelled(self):
+        flight = SingleFlight()
+        call = flight.start('a')
+        threading.Timer(0.1, flight.end, ('a', call),
+                        {'cancelled': True}).start()
+        self.assertEqual(flight.do('a', lambda: 'c'), 'c')
+
+    def test_get_binary(self):
+        anyhttp.http = http = SlowHttp(None)
+        try:
+            results = self.run_threads(lambda: anyhttp.get_binary('a'))
+            errors = self.run_threads(lambda: anyhttp.get_binary('bad'))
+        finally:
+            anyhttp.http = None
+        self.assertEqual(results, [b'a'] * 5)
+        self.assertTrue(all(isinstance(e, IOError) for e in errors))
+        self.assertEqual(http.calls, 2)
+
+    def test_get_binary_ranged(self):
+        anyhttp.http = SlowHttp(None)
+        index = []
+
+        def fetch():
+            # a ranged fetch is not shared with plain ones
+            index.append(None)
+            if len(index) % 2:
+                return anyhttp.get_binary('a', workers=2)
+            return anyhttp.get_binary('a')
+
+        try:
+            results = self.run_threads(fetch, count=6)
+        finally:
+            anyhttp.http = None
+        self.assertEqual(sorted(type(result).__name__
+                                for result in results),
+                         ['bytearray'] * 3 + ['bytes'] * 3)
+        self.assertEqual(len(set(id(result) for result in results
+                                 if isinstance(result, bytearray))), 3)
+
+    def test_cache_fill(self):
+        cache = anyhttp.MemoryCache()
+
+        class Cache(object):
+            max_age = None
+            writes = 0
+
+            def load(self, text_or_binary, url, max_age=None, stale=False):
+                return (cache.get(url), 0)
+
+            def load_headers(self, text_or_binary, url):
+                return {}
+
+            def dump(self, text_or_binary, url, response, headers=None):
+                Cache.writes += 1
+                cache.set(url, response)
+
+        shared = Cache()
+        anyhttp.http = http = SlowHttp(None)
+        try:
+            results = self.run_threads(
+                lambda: anyhttp.get_text('a', cache=shared))
+        finally:
+            anyhttp.http = None
+        self.assertEqual(results, [u'a'] * 5)
+        self.assertEqual(http.calls, 1)
+        self.assertEqual(Cache.writes, 1)
+
+
+    def test_write_and_fill(self):
+        directory = tempfile.mkdtemp()
+        anyhttp.http = http = SlowHttp(None)
+        index = []
+
+        def fetch():
+            # streamed writes and fills of the url share one call
+            index.append(None)
+            if len(index) % 2:
+                fp = io.BytesIO()
+                anyhttp.get_to_file('a', fp, cache=directory)
+                return fp.getvalue()
+            return anyhttp.get_binary('a', cache=directory)
+
+        try:
+            results = self.run_threads(fetch, count=6)
+        finally:
+            anyhttp.http = None
+            anyhttp._caches.pop(directory, None)
+            shutil.rmtree(directory)
+        self.assertEqual(results, [b'a'] * 6)
+        self.assertEqual(http.calls, 1)
+